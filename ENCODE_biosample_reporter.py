@@ -77,9 +77,10 @@ def main():
         print("No accessions to check!", file=sys.stderr)
         sys.exit(1)
     data = []
+    objs = encodedcc.get_multi(accessions, connection)
     for acc in accessions:
         temp = {}
-        obj = encodedcc.get_ENCODE(acc, connection)
+        obj = objs.get(acc, {})
         for h in headers:
             x = obj.get(h, "")
             if any(x):
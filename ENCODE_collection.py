@@ -5,7 +5,6 @@ their properties suitable for spreadsheet import'''
 import json
 import os.path
 import encodedcc
-import requests
 from urllib.parse import urljoin
 import logging
 
@@ -36,8 +35,8 @@ def get_without_ESearch(obj_id, connection):
     '''GET an ENCODE object as JSON and return as dict'''
     url = urljoin(connection.server, obj_id + "?limit=all")
     logging.debug('GET %s' % (url))
-    response = requests.get(url, auth=connection.auth,
-                            headers=connection.headers)
+    response = connection.request('GET', url, auth=connection.auth,
+                                  headers=connection.headers)
     logging.debug('GET RESPONSE code %s' % (response.status_code))
     try:
         if response.json():
@@ -104,8 +103,7 @@ def main():
         search_name = supplied_name.replace('-', '_')
         schema_name = search_name + '.json'
 
-    schema_uri = '/profiles/' + schema_name
-    object_schema = encodedcc.get_ENCODE(schema_uri, connection)
+    object_schema = encodedcc.get_profile(schema_name, connection)
     headings = []
     for schema_property in object_schema["properties"]:
         property_type = object_schema["properties"][schema_property]["type"]
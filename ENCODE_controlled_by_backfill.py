@@ -92,15 +92,25 @@ def getArgs():
     return args
 
 
+CONTROL_PATHS = ["files", "replicates.library.biosample"]
+EXPERIMENT_PATHS = CONTROL_PATHS + ["possible_controls"]
+
+
 class BackFill:
-    def __init__(self, connection, debug=False, missing=False, update=False, ignore_runtype=False):
+    def __init__(self, connection, debug=False, missing=False, update=False, ignore_runtype=False, expander=None):
         self.connection = connection
+        self.expander = expander or encodedcc.ENC_Expander(connection)
         self.DEBUG = debug
         self.MISSING = missing
         self.update = update
         self.ignore_runtype = ignore_runtype
         self.dataList = []
 
+    def control(self, accession):
+        ''' control with its files and replicate biosamples embedded'''
+        return self.expander.embed(
+            accession, paths=CONTROL_PATHS)
+
     def updater(self, exp, con):
         ''' helper function runs the update step'''
         temp = encodedcc.get_ENCODE(
@@ -117,8 +127,8 @@ class BackFill:
     def single_rep(self, obj):
         '''one control with one replicate in control,
         multiple replicates in experiment'''
-        control_files = encodedcc.get_ENCODE(
-            obj["possible_controls"][0]["accession"], self.connection, frame="embedded").get("files", [])
+        control_files = self.control(
+            obj["possible_controls"][0]["accession"]).get("files", [])
         if len(control_files) == 0:
             if self.DEBUG:
                 print("Control object {} has no files".format(
@@ -155,8 +165,8 @@ class BackFill:
     def multi_rep(self, obj):
         '''one control, with one replicate in
         control per replicate in experiment'''
-        control_files = encodedcc.get_ENCODE(
-            obj["possible_controls"][0]["accession"], self.connection, frame="embedded").get("files", [])
+        control_files = self.control(
+            obj["possible_controls"][0]["accession"]).get("files", [])
         control_replicates = obj["possible_controls"][0].get("replicates", [])
         exp_data = {}
         con_data = {}
@@ -218,8 +228,7 @@ class BackFill:
         con_data = {}
         val = True
         for con in obj["possible_controls"]:
-            c = encodedcc.get_ENCODE(
-                con["accession"], self.connection, frame="embedded")
+            c = self.control(con["accession"])
             if c.get("replicates"):
                 for rep in c["replicates"]:
                     if c.get("files"):
@@ -302,8 +311,9 @@ def main():
         print("ERROR: object has no identifier", file=sys.stderr)
         sys.exit(1)
     else:
-        for acc in accessions:
-            obj = encodedcc.get_ENCODE(acc, connection, frame="embedded")
+        expander = encodedcc.ENC_Expander(connection)
+        objs = expander.embed_many(accessions, paths=EXPERIMENT_PATHS)
+        for acc, obj in zip(accessions, objs):
             isValid = True
             check = ["replicates", "files"]
             for c in check:
@@ -327,7 +337,8 @@ def main():
                         acc), file=sys.stderr)
             if isValid:
                 backfill = BackFill(connection, debug=args.debug, missing=args.missing,
-                                    update=args.update, ignore_runtype=args.ignore_runtype)
+                                    update=args.update, ignore_runtype=args.ignore_runtype,
+                                    expander=expander)
                 if args.method == "single":
                     if args.debug:
                         print("SINGLE REP {}".format(acc))
@@ -4,7 +4,6 @@ import argparse
 import os.path
 import encodedcc
 import csv
-from urllib.parse import quote
 
 EPILOG = '''
 This script uses the matrix view available at
@@ -136,29 +135,20 @@ def main():
     args = getArgs()
     key = encodedcc.ENC_Key(args.keyfile, args.key)
     connection = encodedcc.ENC_Connection(key)
-    search_string = "/matrix/?type=Experiment"
-    rfa_string = ""
-    species_string = ""
-    status_string = ""
-    lab_string = ""
+    filters = []  # shared by the matrix and every search below
     if args.rfa:
-        rfa_list = args.rfa.split(",")
-        for r in rfa_list:
-            rfa_string += "&award.rfa=" + r
+        filters += [("award.rfa", r) for r in args.rfa.split(",")]
     if args.species:
-        species_list = args.species.split(",")
-        for r in species_list:
-            species_string += "&replicates.library.biosample.donor.organism.name=" + r
+        filters += [("replicates.library.biosample.donor.organism.name", r)
+                    for r in args.species.split(",")]
     if args.status:
-        status_list = args.status.split(",")
-        for r in status_list:
-            status_string += "&status=" + r
+        filters += [("status", r) for r in args.status.split(",")]
     if args.lab:
-        lab_list = args.lab.split(",")
-        for r in lab_list:
-            lab_string += "&lab.name=" + r
-    full_string = rfa_string + species_string + status_string + lab_string
-    search_string += full_string
+        filters += [("lab.name", r) for r in args.lab.split(",")]
+    experiments = encodedcc.ENC_Query(
+        "search", [("type", "Experiment")] + filters)
+    search_string = encodedcc.ENC_Query(
+        "matrix", [("type", "Experiment")] + filters).url()
     matrix_url = '=HYPERLINK("{}","{}")'.format(
         connection.server + search_string, connection.server + search_string)
 
@@ -181,10 +171,9 @@ def main():
     headers = [matrix_url] + ["Long RNA-seq",
                               "Short RNA-seq"] + temp_list + ["TOTAL"]
 
-    final_assay_search = ""  # this will be used to total rows
-    for name in full_list:
-        final_assay_search += "&assay_term_name=" + name
-    final_bio_search = ""  # this will be used to total columns
+    # these will be used to total rows and columns
+    size_range = "replicates.library.size_range"
+    bio_names = []
 
     col_dict = dict.fromkeys(headers)
     for k in col_dict.keys():
@@ -200,7 +189,7 @@ def main():
             dictwriter.writerow(group_dict)
             for item in inner_buckets:
                 bio_name = item["key"]
-                final_bio_search += "&biosample_term_name=" + quote(bio_name)
+                bio_names.append(bio_name)
                 assay_list = item["assay_title"]
                 row_dict = dict.fromkeys(headers)
                 for k in row_dict.keys():
@@ -211,20 +200,22 @@ def main():
                     assay_name = x_buckets[x]["key"]
                     if assay_name in full_list:
                         if assay_list[x] > 0:
-                            search = "/search/?type=Experiment&biosample_term_name=" + \
-                                quote(bio_name) + "&assay_title=" + \
-                                assay_name + full_string
+                            search = experiments.add(
+                                biosample_term_name=bio_name,
+                                assay_title=assay_name)
                             if 'RNA' in assay_name:
-                                short_search = search + "&replicates.library.size_range=<200"
-                                long_search = search + "&replicates.library.size_range!=<200"
+                                short_search = search.add(
+                                    {size_range: "<200"})
+                                long_search = search.add(
+                                    {size_range + "!": "<200"})
 
-                                short_url = connection.server + short_search
-                                long_url = connection.server + long_search
+                                short_url = short_search.url(connection.server)
+                                long_url = long_search.url(connection.server)
 
                                 short_facets = encodedcc.get_ENCODE(
-                                    short_search, connection)
+                                    short_search.url(), connection)
                                 long_facets = encodedcc.get_ENCODE(
-                                    long_search, connection)
+                                    long_search.url(), connection)
 
                                 if short_facets.get("total") == 0:
                                     row_dict["Short RNA-seq"] = 0
@@ -266,9 +257,9 @@ def main():
                                     col_dict["Long RNA-seq"].append(
                                         [total, error, not_compliant, warning, dcc_action])
                             else:
-                                url = connection.server + search
+                                url = search.url(connection.server)
                                 facets = encodedcc.get_ENCODE(
-                                    search, connection).get("facets", [])
+                                    search.url(), connection).get("facets", [])
                                 total, error, not_compliant, warning, dcc_action = audit_count(
                                     facets, assay_list[x], args.allaudits)
                                 if args.allaudits:
@@ -300,9 +291,9 @@ def main():
                 row_not_compliant = 0
                 row_warning = 0
                 row_dcc_action = 0
-                bio_total = "/search/?type=Experiment&biosample_term_name=" + \
-                    quote(bio_name) + final_assay_search + full_string
-                bio_url = connection.server + bio_total
+                bio_total = experiments.add(biosample_term_name=bio_name,
+                                            assay_term_name=full_list)
+                bio_url = bio_total.url(connection.server)
                 for col in row_count:
                     row_total += col[0]
                     row_error += col[1]
@@ -342,24 +333,24 @@ def main():
                 warning += col_warning
                 dcc_action += col_dcc_action
                 if key == "Long RNA-seq":
-                    assay_total = "/search/?type=Experiment&assay_term_name=RNA-seq&replicates.library.size_range!=<200" + \
-                        final_bio_search + full_string
+                    assay_total = experiments.add(
+                        {size_range + "!": "<200"}, assay_term_name="RNA-seq")
                 elif key == "Short RNA-seq":
-                    assay_total = "/search/?type=Experiment&assay_term_name=RNA-seq&replicates.library.size_range=<200" + \
-                        final_bio_search + full_string
+                    assay_total = experiments.add(
+                        {size_range: "<200"}, assay_term_name="RNA-seq")
                 else:
-                    assay_total = "/search/?type=Experiment&assay_term_name=" + \
-                        key + final_bio_search + full_string
-                assay_url = connection.server + assay_total
+                    assay_total = experiments.add(assay_term_name=key)
+                assay_total = assay_total.add(biosample_term_name=bio_names)
+                assay_url = assay_total.url(connection.server)
                 if args.allaudits:
                     total_dict[key] = '=HYPERLINK("{}", "{}, {}E, {}NC, {}W, {}DCC")'.format(
                         assay_url, col_total, col_error, col_not_compliant, col_warning, col_dcc_action)
                 else:
                     total_dict[key] = '=HYPERLINK("{}", "{}, {}E, {}NC")'.format(
                         assay_url, col_total, col_error, col_not_compliant)
-        full_search = "/search/?type=Experiment" + \
-            final_assay_search + final_bio_search + full_string
-        full_url = connection.server + full_search
+        full_search = experiments.add(assay_term_name=full_list,
+                                      biosample_term_name=bio_names)
+        full_url = full_search.url(connection.server)
         if args.allaudits:
             total_dict["TOTAL"] = '=HYPERLINK("{}", "{}, {}E, {}NC, {}W, {}DCC")'.format(
                 full_url, total, error, not_compliant, warning, dcc_action)
@@ -1,20 +1,18 @@
 import requests
-import urllib.parse
 import sys
 import time
-from time import sleep
 import json
 import pprint
 import subprocess
 import os
 import gzip
 import shutil
+import encodedcc
 
 AUTHID = "" 
 AUTHPW = "" 
 keypair = (AUTHID, AUTHPW)
 
-GET_HEADERS = {'accept': 'application/json'}
 POST_HEADERS = {'accept': 'application/json',
                 'Content-Type': 'application/json'}
 
@@ -23,40 +21,9 @@ SERVER = "https://test.encodedcc.org/"
 
 DEBUG_ON = False
 
-def encoded_get(url, keypair=None, frame='object', return_response=False):
-    url_obj = urllib.parse.urlsplit(url)
-    new_url_list = list(url_obj)
-    query = urllib.parse.parse_qs(url_obj.query)
-    if 'format' not in query:
-        new_url_list[3] += "&format=json"
-    if 'frame' not in query:
-        new_url_list[3] += "&frame=%s" % (frame)
-    if 'limit' not in query:
-        new_url_list[3] += "&limit=all"
-    if new_url_list[3].startswith('&'):
-        new_url_list[3] = new_url_list[3].replace('&', '', 1)
-    get_url = urllib.parse.urlunsplit(new_url_list)
-    max_retries = 10
-    max_sleep = 10
-    while max_retries:
-        try:
-            if keypair:
-                response = requests.get(get_url,
-                                        auth=keypair,
-                                        headers=GET_HEADERS)
-            else:
-                response = requests.get(get_url, headers=GET_HEADERS)
-        except (requests.exceptions.ConnectionError,
-                requests.exceptions.SSLError) as e:
-            print >> sys.stderr, e
-            sleep(max_sleep - max_retries)
-            max_retries -= 1
-            continue
-        else:
-            if return_response:
-                return response
-            else:
-                return response.json()
+connection = encodedcc.ENC_Connection(encodedcc.ENC_Key(
+    {'default': {'key': AUTHID, 'secret': AUTHPW, 'server': SERVER}},
+    'default'))
 
 def fix_read_name(name):
     return name.split(" ")[0].split("/")[0]
@@ -120,12 +87,12 @@ def post_file(json_payload, file_path, keypair):
 with open("file_to_fix", "r") as f:
     for l in f:
         acc = l.split("/")[-1].split(".")[0]
-        url = SERVER + "/files/" + acc + "/"
-        file = encoded_get(url, keypair)
+        url = "/files/" + acc + "/"
+        file = encodedcc.get_ENCODE(url, connection)
         
         local_path = "/s3/" + file['s3_uri'][5:]
         print (local_path)
-        ed = encoded_get(url, keypair, frame="edit")
+        ed = encodedcc.get_ENCODE(url, connection, frame="edit")
         ed['derived_from'] = [ed['accession']]
         ed.pop('accession', None)
         ed['aliases'] = ["encode:new_"+acc]
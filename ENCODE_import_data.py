@@ -10,7 +10,6 @@ import sys
 import mimetypes
 import requests
 from PIL import Image  # install me with 'pip3 install Pillow'
-from urllib.parse import quote
 from base64 import b64encode
 import magic  # install me with 'pip3 install python-magic'
 # https://github.com/ahupp/python-magic
@@ -331,6 +330,19 @@ def expose_objects(post_json, json_properties):
     return post_json
 
 
+def row_identifier(post_json):
+    ''' the identifier an object is looked up by, if it has one '''
+    if post_json.get("uuid"):
+        return post_json["uuid"]
+    elif post_json.get("aliases"):
+        return post_json["aliases"][0]
+    elif post_json.get("accession"):
+        return post_json["accession"]
+    elif post_json.get("@id"):
+        return post_json["@id"]
+    return None
+
+
 def excel_reader(datafile, sheet, update, connection, patchall):
     row = reader(datafile, sheetname=sheet)
     keys = next(row)  # grab the first row of headers
@@ -342,8 +354,8 @@ def excel_reader(datafile, sheet, update, connection, patchall):
         '/profiles/{}.json'.format(sheet), connection)['properties']
     new_accessions_aliases = []
     failed_postings = []
+    post_jsons = []
     for values in row:
-        total += 1
         post_json = dict(zip(keys, values))
         post_json = dict_patcher(post_json)
         post_json = expose_objects(post_json, json_properties)
@@ -351,19 +363,19 @@ def excel_reader(datafile, sheet, update, connection, patchall):
         if post_json.get("attachment"):
             attach = attachment(post_json["attachment"])
             post_json["attachment"] = attach
+        post_jsons.append(post_json)
+    # find which rows already exist with a few batched searches, fresh
+    # from the portal as the index may be out of date
+    resolver = encodedcc.ENC_Resolver(connection, max_age=0)
+    identifiers = [row_identifier(post_json) for post_json in post_jsons]
+    with encodedcc.print_muted():
+        existing = resolver.resolve(identifiers)
+    for post_json, identifier in zip(post_jsons, identifiers):
+        total += 1
         print(post_json)
         temp = {}
-        # Silence get_ENCODE failures.
-        with encodedcc.print_muted():
-            if post_json.get("uuid"):
-                temp = encodedcc.get_ENCODE(post_json["uuid"], connection)
-            elif post_json.get("aliases"):
-                temp = encodedcc.get_ENCODE(quote(post_json["aliases"][0]),
-                                            connection)
-            elif post_json.get("accession"):
-                temp = encodedcc.get_ENCODE(post_json["accession"], connection)
-            elif post_json.get("@id"):
-                temp = encodedcc.get_ENCODE(post_json["@id"], connection)
+        if identifier in existing:
+            temp["uuid"] = existing[identifier][1]
         if temp.get("uuid"):
             if patchall:
                 e = encodedcc.patch_ENCODE(temp["uuid"], connection, post_json)
@@ -394,6 +406,14 @@ def excel_reader(datafile, sheet, update, connection, patchall):
                         'aliases', 'alias not specified'))
                 elif e["status"] == "success":
                     new_object = e['@graph'][0]
+                    canonical = resolver.learn(new_object, identifier)
+                    # later rows of the sheet naming it PATCH, not POST
+                    for name in [identifier, new_object.get('@id'),
+                                 new_object.get('uuid'),
+                                 new_object.get('accession')] + \
+                            (new_object.get('aliases') or []):
+                        if name:
+                            existing[name] = canonical
                     # Print now and later.
                     print('New accession/UUID: {}'.format((new_object.get(
                         'accession', new_object.get('uuid')))))
@@ -6,7 +6,6 @@ import os.path
 import argparse
 import encodedcc
 import collections
-from encodedcc import get_ENCODE
 
 EPILOG = '''
 This takes in a list of accessions and returns a status report
@@ -39,6 +38,7 @@ def getArgs():
                         help="Let the script PATCH the data.  Default is False")
     parser.add_argument('--accession',
                         help="Single accession/identifier to patch")
+    encodedcc.add_cache_args(parser)
     parser.add_argument('--query',
                         help="A custom query to get accessions.")
 
@@ -55,11 +55,8 @@ def get_experiment_list(file, search, connection):
         for i in range(0, len(objList)):
             objList[i] = objList[i].strip()
     else:
-        col = get_ENCODE(search, connection, frame='page')
-        for i in range(0, len(col['@graph'])):
-            # print set['@graph'][i]['accession']
-            objList.append(col['@graph'][i]['@id'])
-            # objList.append(set['@graph'][i]['uuid'] )
+        for hit in encodedcc.search(search, connection, fields=['@id']):
+            objList.append(hit['@id'])
 
     return objList
 
@@ -75,6 +72,7 @@ def main():
     args = getArgs()
     key = encodedcc.ENC_Key(args.keyfile, args.key)
     connection = encodedcc.ENC_Connection(key)
+    encodedcc.configure_cache(connection, args)
     assemblies = ['hg19', 'GRCh38']
     summary = []
 
@@ -83,10 +81,15 @@ def main():
     else:
         objList = get_experiment_list(args.infile, args.query, connection)
 
-    for obj_id in objList:
-        results = {}
+    # embed what the report reads instead of fetching each page frame
+    expander = encodedcc.ENC_Expander(connection)
+    objs = expander.embed_many(
+        objList, paths=['files.lab', 'award', 'replicates'])
+    audits = encodedcc.get_audits(objList, connection)
 
-        obj = get_ENCODE(obj_id, connection, frame='page')
+    for obj_id, obj in zip(objList, objs):
+        results = {}
+        obj['audit'] = audits.get(obj_id, {})
 
         # Get basic info
         reps = get_replicate_count(obj)
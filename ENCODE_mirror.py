@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: latin-1 -*-
+''' Keep a local SQLite mirror of ENCODE objects up to date
+'''
+import os.path
+import argparse
+import logging
+import encodedcc
+
+EPILOG = '''
+Copies objects (frame=object) of the chosen types into a local database
+that other scripts can read instead of the portal by passing --mirror.
+
+The first run copies each type in full; later runs fetch only objects
+modified since the previous one.
+
+Examples:
+
+    Create or update a mirror of the default types:
+
+        %(prog)s --mirror ~/encode_mirror.sqlite
+
+    Mirror just files and experiments, starting again from scratch:
+
+        %(prog)s --mirror ~/encode_mirror.sqlite --types File Experiment --full
+
+    Then, in another script:
+
+        %(prog)s ... --mirror ~/encode_mirror.sqlite
+
+For more details:
+
+        %(prog)s --help
+'''
+
+
+def getArgs():
+    parser = argparse.ArgumentParser(
+        description=__doc__, epilog=EPILOG,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('--mirror',
+                        default=os.environ.get('ENCODEDCC_MIRROR'),
+                        help="Path of the mirror database.  Default is \
+                        $ENCODEDCC_MIRROR, if set")
+    parser.add_argument('--types',
+                        nargs='*',
+                        help="Object types to mirror.  Default is the types \
+                        already in the mirror, or %s for a new one" %
+                        (', '.join(encodedcc.ENC_Mirror.DEFAULT_TYPES)))
+    parser.add_argument('--full',
+                        default=False,
+                        action='store_true',
+                        help="Copy the types afresh instead of fetching only \
+                        what changed.  Default is False")
+    parser.add_argument('--key',
+                        default='default',
+                        help="The keypair identifier from the keyfile.  \
+                        Default is --key=default")
+    parser.add_argument('--keyfile',
+                        default=os.path.expanduser("~/keypairs.json"),
+                        help="The keypair file.  Default is --keyfile=%s" % (os.path.expanduser("~/keypairs.json")))
+    parser.add_argument('--debug',
+                        default=False,
+                        action='store_true',
+                        help="Print debug messages.  Default is False.")
+    args = parser.parse_args()
+    if args.debug:
+        logging.basicConfig(format='%(levelname)s:%(message)s',
+                            level=logging.DEBUG)
+    else:
+        logging.basicConfig(format='%(levelname)s:%(message)s',
+                            level=logging.INFO)
+    return args
+
+
+def main():
+    args = getArgs()
+    if not args.mirror:
+        print("No mirror given, use --mirror or set ENCODEDCC_MIRROR")
+        return
+    key = encodedcc.ENC_Key(args.keyfile, args.key)
+    connection = encodedcc.ENC_Connection(key)
+    mirror = encodedcc.ENC_Mirror(args.mirror)
+    fetched = mirror.sync(connection, types=args.types, full=args.full)
+    print("Fetched {} objects, mirror holds {}".format(
+        fetched, ', '.join(mirror.types())))
+
+
+if __name__ == '__main__':
+    main()
@@ -7,7 +7,6 @@ import copy
 import argparse
 import encodedcc
 import collections
-from encodedcc import get_ENCODE
 
 EPILOG = '''
 The output of this program is for consumption by a googlesheet.
@@ -37,6 +36,7 @@ def getArgs():
                         default=False,
                         action='store_true',
                         help="Print debug messages.  Default is False.")
+    encodedcc.add_mirror_args(parser)
     args = parser.parse_args()
     return args
 
@@ -45,15 +45,19 @@ def make_matrix(rows, columns, headers, queries, basic_query, connection):
 
     matrix = {}
 
+    # every cell is a count, so fetch them all at once with limit=0
+    cells = [basic_query + queries[row] + columns[col]
+             for row in rows for col in headers]
+    totals = dict(zip(cells, encodedcc.count_many(cells, connection)))
+
     for row in rows:
 
         matrix[row] = [row]
 
         for col in headers:
             query = basic_query + queries[row] + columns[col]
-            res = get_ENCODE(query, connection, frame='object')
             link = connection.server + query
-            total = res['total']
+            total = totals[query]
             func = '=HYPERLINK(' + '"' + link + '",' + repr(total) + ')'
             matrix[row].append(func)
         print('\t'.join(matrix[row]))
@@ -361,6 +365,7 @@ def main():
     args = getArgs()
     key = encodedcc.ENC_Key(args.keyfile, args.key)
     connection = encodedcc.ENC_Connection(key)
+    encodedcc.configure_mirror(connection, args)
 
     labs = {
         'stam': '&lab.title=John+Stamatoyannopoulos%2C+UW&lab.title=Job+Dekker%2C+UMass',
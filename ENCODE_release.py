@@ -29,8 +29,11 @@ files as well.
 
 '''
 import argparse
+import csv
 import os
 import datetime
+import hashlib
+import json
 import encodedcc
 import logging
 import sys
@@ -79,6 +82,17 @@ Basic Useage:
     in the report file
 
 
+    %(prog)s --infile file.txt --plan plan.tsv
+    %(prog)s --apply plan.tsv --update
+
+    '--plan' writes every object that would be released, once, with its
+    current and target status, as TSV (.tsv) or JSON (anything else)
+    '--apply' PATCHes the objects of a reviewed plan in batches; objects
+    already released are recorded in 'plan.tsv.done' so a run that fails
+    part way can be repeated and carries on where it stopped
+    '--apply' MUST BE RUN WITH '--update' TO WORK
+
+
 Misc. Useage:
 
     The output file default is 'Release_report.txt'
@@ -96,6 +110,12 @@ Misc. Useage:
 '''
 logger = logging.getLogger(__name__)
 
+PLAN_FIELDS = ["@id", "type", "status", "target_status"]
+# the property naming the object a type takes its biosample_term_id from
+TERM_ID_PARENTS = {"File": "dataset",
+                   "Replicate": "experiment",
+                   "Library": "biosample"}
+
 
 def make_dir(directory):
     if not os.path.exists(directory):
@@ -141,7 +161,8 @@ def getArgs():
                         help="The keyfile",
                         default=os.path.expanduser('~/keypairs.json'))
     parser.add_argument('--timing',
-                        help="Time the script execution.  Default is off",
+                        help="Time the script execution and each level of \
+                        the link walk.  Default is off",
                         action='store_true', default=False)
     parser.add_argument('--debug',
                         help="Run script in debug mode.  Default is off",
@@ -149,7 +170,21 @@ def getArgs():
     parser.add_argument('--hela',
                         help='Force release of HeLa data.',
                         action='store_true')
+    parser.add_argument('--plan',
+                        help="Write the objects that would be released, with \
+                        their current and target status, to this file (TSV if \
+                        it ends in .tsv, otherwise JSON)")
+    parser.add_argument('--apply',
+                        help="Release the objects of a plan written with \
+                        --plan instead of walking --infile or --query.  \
+                        Needs --update")
+    parser.add_argument('--batch_size',
+                        help="Number of PATCHes between progress records when \
+                        releasing.  Default is 100",
+                        type=int, default=100)
     args = parser.parse_args()
+    if args.apply and not args.update:
+        parser.error("--apply needs --update")
     make_dir(args.out_dir)
     run_type = 'update' if args.update else 'dry_run'
     args.outfile = '{}/{}_{}'.format(args.out_dir, run_type, args.outfile)
@@ -178,11 +213,17 @@ class Data_Release():
         self.PRINTALL = args.printall
         self.UPDATE = args.update
         self.TIMING = args.timing
+        self.PLAN = args.plan
+        self.APPLY = args.apply
+        self.BATCH_SIZE = args.batch_size
         self.keysLink = []
         self.PROFILES = {}
         self.ACCESSIONS = []
         self.statusDict = {}
-        self.searched = []
+        self.searched = set()
+        self.audits = {}
+        # {@id: biosample_term_id} of everything checked for HeLa this run
+        self.term_ids = {}
         self.connection = connection
         self.HELA = args.hela
         # Define objects associated with HeLa data.
@@ -193,9 +234,12 @@ class Data_Release():
             'Library',
             'Replicate'
         ]
-        temp = encodedcc.get_ENCODE("/profiles/", self.connection)
+        # compiled from /profiles/ and kept on disk between runs
+        profiles = encodedcc.profile_map(self.connection)
         # Fix for WRAN-708, new objects in profiles that don't have properties.
-        temp = {k: v for k, v in temp.items() if isinstance(v, dict) and v.get('properties')}
+        temp = {k: v for k, v in profiles.profiles.items() if isinstance(v, dict) and v.get('properties')}
+        self.expander = encodedcc.ENC_Expander(
+            self.connection, links=profiles.links)
         ignore = ["Lab", "Award", "Platform",
                   "Organism", "Reference", "AccessKey", "User", "AnalysisStep",
                   "AnalysisStepVersion", "AnalysisStepRun", "Pipeline",
@@ -264,6 +308,9 @@ class Data_Release():
             print('WARNING: Objects associated with HeLa data will be released')
         if self.LOGALL:
             print("Logging all statuses")
+        if self.APPLY:
+            # the plan already lists the objects
+            return
         if self.infile:
             if os.path.isfile(self.infile):
                 self.ACCESSIONS = [line.rstrip('\n') for line in open(
@@ -334,41 +381,67 @@ class Data_Release():
                             if i.get("linkTo"):
                                 self.keysLink.append(prop)
 
-    def process_link(self, identifier_link, approved_types):
-        item = identifier_link.split("/")[1].replace("-", "")
-        subobj = encodedcc.get_ENCODE(identifier_link, self.connection)
-        subobjname = subobj["@type"][0]
-        restricted_flag = False
-        inactive_pipeline_flag = False
-
-        if (item in self.profiles_ref) and \
-           (identifier_link not in self.searched):
+    def process_level(self, links):
+        '''take the (link, approved types) pairs found on one level,
+        fetch the objects they name together and expand those that may
+        be released, returning the pairs for the next level'''
+        links = [(link, approved) for link, approved in links
+                 if link.split("/")[1].replace("-", "") in self.profiles_ref
+                 and link not in self.searched]
+        if not links:
+            return []
+        subobjs = encodedcc.get_multi(
+            [link for link, approved in links], self.connection)
+        # pipelines of the files, embedded as has_inactive_pipeline wants
+        steps = [obj for obj in subobjs.values()
+                 if obj["@type"][0] == 'File' and
+                 obj.get('analysis_step_version')]
+        if steps:
+            steps = self.expander.embed_many(
+                steps,
+                paths=['analysis_step_version.analysis_step.pipelines'])
+        pipelines = {obj["@id"]: obj for obj in steps}
+        next_links = []
+        for identifier_link, approved_types in links:
+            if identifier_link in self.searched:
+                continue
+            if identifier_link not in subobjs:
+                # nothing below it is checked or released
+                log = "WARNING: {} could not be fetched and was not " \
+                      "checked".format(identifier_link)
+                print(log)
+                logger.warning(log)
+                self.searched.add(identifier_link)
+                continue
+            subobj = subobjs[identifier_link]
+            subobjname = subobj["@type"][0]
+            restricted_flag = False
+            inactive_pipeline_flag = False
             if (subobjname == 'File'):
                 if self.is_restricted(subobj) is True:
                     print(subobj['@id'] + ' is restricted, ' +
                           'therefore will not be released')
                     restricted_flag = True
-                    self.searched.append(subobj["@id"])
+                    self.searched.add(subobj["@id"])
                 if subobj.get('analysis_step_version'):
-                    p = self.has_inactive_pipeline(encodedcc.get_ENCODE(
-                        identifier_link,
-                        self.connection, "embedded"))
+                    p = self.has_inactive_pipeline(pipelines[subobj["@id"]])
                     if p:
                         print('{} is only associated with inactive pipelines'
                               ' and therefore will not be released: {}'.format(subobj['@id'], p))
                         inactive_pipeline_flag = True
-                        self.searched.append(subobj["@id"])
+                        self.searched.add(subobj["@id"])
             # expand subobject
-            if (subobjname in approved_types) and \
+            if (subobjname in (approved_types or ())) and \
                (restricted_flag is False) and \
                (inactive_pipeline_flag is False):
-                self.get_status(
+                next_links.extend(self.expand(
                     subobj,
                     hi.dictionary_of_lower_levels.get(
-                        hi.levels_mapping.get(subobjname)))
+                        hi.levels_mapping.get(subobjname))))
+        return next_links
 
     def update_self(self, subobj, subobjname, update_status_flag):
-        self.searched.append(subobj["@id"])
+        self.searched.add(subobj["@id"])
         if update_status_flag is True:
             self.statusDict[subobj["@id"]] = [subobjname,
                                               subobj["status"]]
@@ -387,30 +460,38 @@ class Data_Release():
                 return [p['@id'] for p in pipelines]
         return False
 
+    def resolve_term_ids(self, objs):
+        '''find the biosample_term_id of every object in objs, fetching the
+        parents that Files, Replicates and Libraries take it from together.
+        Answers are kept in term_ids for the rest of the run'''
+        parents = {}
+        for obj in objs:
+            if obj["@id"] in self.term_ids:
+                continue
+            prop = TERM_ID_PARENTS.get(obj["@type"][0])
+            if prop is None:
+                # For experiments and biosamples.
+                self.term_ids[obj["@id"]] = obj.get("biosample_term_id")
+            else:
+                parents[obj["@id"]] = obj.get(prop)
+        wanted = set(parent for parent in parents.values()
+                     if parent is not None and parent not in self.term_ids)
+        if wanted:
+            found = encodedcc.get_multi(wanted, self.connection,
+                                        fields=["biosample_term_id"])
+            for parent in wanted:
+                self.term_ids[parent] = found.get(
+                    parent, {}).get("biosample_term_id")
+        for obj_id, parent in parents.items():
+            self.term_ids[obj_id] = self.term_ids.get(parent)
+
     def _get_associated_term_id(self, data_type, data):
         """
         Find biosample_term_id associated with particular object.
         """
-        obj_id = None
-        if data_type == 'File':
-            # Get biosample_term_id in file.dataset.
-            obj_id = data.get('dataset')
-        elif data_type == 'Replicate':
-            # Get biosample_term_id in replicate.experiment.
-            obj_id = data.get('experiment')
-        elif data_type == 'Library':
-            # Get biosample_term_id in library.biosample.
-            obj_id = data.get('biosample')
-        else:
-            # For experiments and biosamples.
-            biosample_term_id = data.get('biosample_term_id')
-        if obj_id is not None:
-            # Return biosample_term_id of embedded object.
-            biosample_term_id = encodedcc.get_ENCODE(
-                obj_id,
-                self.connection
-            ).get('biosample_term_id')
-        return biosample_term_id
+        if data["@id"] not in self.term_ids:
+            self.resolve_term_ids([data])
+        return self.term_ids[data["@id"]]
 
     def associated_with_hela_data(self, data_type, data):
         """
@@ -432,10 +513,12 @@ class Data_Release():
         return False
 
     def has_audit(self, accession):
-        # Another GET request for page frame.
-        audit = encodedcc.get_ENCODE(accession,
-                                     self.connection,
-                                     'page').get('audit', {})
+        audit = self.audits.get(accession)
+        if audit is None:
+            # Another GET request for page frame.
+            audit = encodedcc.get_ENCODE(accession,
+                                         self.connection,
+                                         'page').get('audit', {})
         if (audit.get('ERROR') is not None
                 or audit.get('NOT_COMPLIANT') is not None):
             details = [v[0]['category'] for v in audit.values()]
@@ -447,59 +530,66 @@ class Data_Release():
 
     def get_status(self, obj, approved_for_update_types):
         '''take object get status, @type, @id, uuid
-        {@id : [@type, status]}'''
+        {@id : [@type, status]}
+        for it and everything linked below it, breadth first'''
+        links = self.expand(obj, approved_for_update_types)
+        level = 0
+        while links:
+            level += 1
+            t0 = time.time()
+            count = len(links)
+            links = self.process_level(links)
+            if self.TIMING:
+                print("Level {}: {} links checked in {:.2f} seconds".format(
+                    level, count, time.time() - t0))
+
+    def expand(self, obj, approved_for_update_types):
+        '''record the status of obj and return its links as
+        (link, approved types) pairs'''
         name = obj["@type"][0]
-        self.searched.append(obj["@id"])
-
+        self.searched.add(obj["@id"])
+        links = []
         if self.PROFILES.get(name):
             self.statusDict[obj["@id"]] = [name, obj["status"]]
-            # print (obj.keys())
             for key in obj.keys():
                 # loop through object properties
                 if key in self.PROFILES[name]:
                     # if the key is in profiles it's a link
                     if type(obj[key]) is list:
-                        for link in obj[key]:
-                            self.process_link(
-                                link, approved_for_update_types)
+                        links.extend((link, approved_for_update_types)
+                                     for link in obj[key])
                     else:
-                        self.process_link(
-                            obj[key], approved_for_update_types)
+                        links.append((obj[key], approved_for_update_types))
+        return links
 
-    def releasinator(self, name, identifier, status):
-        '''releases objects into their equivalent released states'''
-        patch_dict = {}
-        if name in self.current:
-            log = '%s' % "UPDATING: {} {} with status {} ".format(
-                name, identifier, status) + \
-                "is now current"
-            patch_dict = {"status": "current"}
-        elif name in self.finished:
-            log = '%s' % "UPDATING: {} {} with status {} ".format(
-                name, identifier, status) + \
-                "is now finished"
-            patch_dict = {"status": "finished"}
-        else:
-            log = "UPDATING: {} {} with status {} ".format(
-                name, identifier, status) + \
-                "is now released"
-            patch_dict = {"status": "released"}
+    def release_patch(self, name):
+        '''the PATCH that moves an object of type name to its released state'''
         if name in self.date_released:
             # if the object would have a date_released give it one
             now = datetime.datetime.now().date()
-            patch_dict = {"date_released": str(now), "status": "released"}
-            log += " with date {}".format(now)
+            return {"date_released": str(now), "status": "released"}
+        elif name in self.current:
+            return {"status": "current"}
+        elif name in self.finished:
+            return {"status": "finished"}
+        return {"status": "released"}
+
+    def releasinator(self, name, identifier, status):
+        '''releases objects into their equivalent released states'''
+        patch_dict = self.release_patch(name)
+        log = "UPDATING: {} {} with status {} ".format(
+            name, identifier, status) + \
+            "is now {}".format(patch_dict["status"])
+        if "date_released" in patch_dict:
+            log += " with date {}".format(patch_dict["date_released"])
         logger.info('%s' % log)
         if self.PRINTALL:
             print(log)
-        encodedcc.patch_ENCODE(identifier, self.connection, patch_dict)
-
-    def run_script(self):
-        # set_up() gets all the command line arguments and validates them
-        # also makes the list of accessions to run from
-        t0 = time.time()
-        self.set_up()
+        return encodedcc.patch_ENCODE(identifier, self.connection, patch_dict)
 
+    def make_plan(self):
+        '''walk every accession and return the objects to release, each
+        once, as {@id, type, status, target_status} rows'''
         good = ["released",
                 "current",
                 "disabled",
@@ -520,12 +610,21 @@ class Data_Release():
         ignore = ["User",
                   "AntibodyCharacterization",
                   "Publication"]
-        version = 'Releasenator version {}'.format(self.releasenator_version)
-        print(version)
-        logger.info(version)
+        plan = []
+        if not self.FORCE:
+            # audits of all the accessions from a few searches up front
+            self.audits = encodedcc.get_audits(self.ACCESSIONS,
+                                               self.connection)
+        objects = encodedcc.get_multi(self.ACCESSIONS, self.connection)
+        if not self.HELA:
+            # the parents of all the accessions in one go, not one GET each
+            self.resolve_term_ids(
+                obj for obj in objects.values()
+                if obj["@type"][0] in self.hela_associated_objects)
         for accession in self.ACCESSIONS:
             print('Processing accession:', accession)
-            data = encodedcc.get_ENCODE(accession, self.connection)
+            data = objects.get(accession) or \
+                encodedcc.get_ENCODE(accession, self.connection)
             data_status = data.get('status')
             data_type = data['@type'][0]
             logger.info('{}: {} Status: {}'.format(data_type,
@@ -537,6 +636,8 @@ class Data_Release():
             # Skip if has audit.
             if not self.FORCE and self.has_audit(accession):
                 continue
+            # searched is shared by all the accessions, so an object linked
+            # from several of them is walked and planned only the first time
             self.statusDict = {}
             self.get_status(
                 data,
@@ -565,14 +666,122 @@ class Data_Release():
                             key, status)
                         # print (log)
                         logger.info(log)
-                        if self.UPDATE:
-                            self.releasinator(name, key, status)
+                        plan.append({
+                            "@id": key,
+                            "type": name,
+                            "status": status,
+                            "target_status":
+                                self.release_patch(name)["status"]})
                     named.append(name)
+        return plan
+
+    def write_plan(self, plan, path):
+        '''write the plan as TSV if path ends in .tsv, otherwise JSON,
+        dropping the progress of any earlier plan at the same path'''
+        if os.path.isfile(path + ".done"):
+            os.remove(path + ".done")
+        with open(path, "w") as f:
+            if path.endswith(".tsv"):
+                writer = csv.DictWriter(f, fieldnames=PLAN_FIELDS,
+                                        delimiter="\t", lineterminator="\n")
+                writer.writeheader()
+                writer.writerows(plan)
+            else:
+                json.dump(plan, f, indent=4)
+
+    def read_plan(self, path):
+        '''read a plan written by write_plan'''
+        with open(path) as f:
+            if path.endswith(".tsv"):
+                return list(csv.DictReader(f, delimiter="\t"))
+            return json.load(f)
+
+    def plan_digest(self, plan):
+        '''a hash of the plan's rows, whatever file format they came from'''
+        rows = sorted(json.dumps(row, sort_keys=True) for row in plan)
+        return hashlib.sha1("\n".join(rows).encode("utf-8")).hexdigest()
+
+    def apply_plan(self, plan, progress=None):
+        '''PATCH the objects of plan in parallel, batch_size at a time.
+        Released @ids are appended to the progress file after each batch
+        and skipped when the same plan is applied again; the file starts
+        with the plan's digest, so the progress of another plan is not'''
+        header = "# plan {}\n".format(self.plan_digest(plan))
+        done = set()
+        if progress and os.path.isfile(progress):
+            with open(progress) as f:
+                lines = f.readlines()
+            if lines and lines[0] == header:
+                done = set(line.strip() for line in lines[1:] if line.strip())
+            else:
+                logger.warning("WARNING: {} is the progress of another "
+                               "plan, starting over".format(progress))
+                os.remove(progress)
+        if progress and not os.path.isfile(progress):
+            with open(progress, "w") as f:
+                f.write(header)
+        todo = [row for row in plan if row["@id"] not in done]
+        if done:
+            print("Resuming: {} of {} objects already released".format(
+                len(plan) - len(todo), len(plan)))
+        failed = []
+        for i in range(0, len(todo), self.BATCH_SIZE):
+            batch = todo[i:i + self.BATCH_SIZE]
+            results = encodedcc.run_bulk(
+                lambda row: self.releasinator(
+                    row["type"], row["@id"], row["status"]),
+                batch, self.connection)
+            released = []
+            for row, result in zip(batch, results):
+                if isinstance(result, dict) and \
+                   result.get("status") == "success":
+                    released.append(row["@id"])
+                else:
+                    failed.append(row["@id"])
+                    logger.warning("WARNING: {} was not released: {}".format(
+                        row["@id"], result))
+            if progress and released:
+                with open(progress, "a") as f:
+                    f.writelines(r + "\n" for r in released)
+        if failed:
+            print("ERROR: {} objects were not released, see {}".format(
+                len(failed), self.outfile), file=sys.stderr)
+            if progress:
+                print("Run with --apply {} --update again to retry "
+                      "them".format(progress[:-len(".done")]),
+                      file=sys.stderr)
+        return failed
+
+    def run_script(self):
+        # set_up() gets all the command line arguments and validates them
+        # also makes the list of accessions to run from
+        t0 = time.time()
+        self.set_up()
+        version = 'Releasenator version {}'.format(self.releasenator_version)
+        print(version)
+        logger.info(version)
+        if self.APPLY:
+            plan = self.read_plan(self.APPLY)
+            print("Read release plan of {} objects from {}".format(
+                len(plan), self.APPLY))
+        else:
+            plan = self.make_plan()
+            if self.PLAN:
+                self.write_plan(plan, self.PLAN)
+                print("Release plan of {} objects written to {}".format(
+                    len(plan), self.PLAN))
+        failed = []
+        if self.UPDATE and plan:
+            plan_file = self.APPLY or self.PLAN
+            failed = self.apply_plan(
+                plan, plan_file + ".done" if plan_file else None)
         print("Data written to file", self.outfile)
         if self.TIMING:
             timing = int(time.time() - t0)
             print("Execution of releasenator script took " +
                   str(timing) + " seconds")
+        if failed:
+            sys.exit(1)
 
 
 def main():
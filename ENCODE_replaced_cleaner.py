@@ -32,16 +32,24 @@ def getArgs():
                         default=False,
                         action='store_true',
                         help="Print debug messages.  Default is False.")
+    encodedcc.add_mirror_args(parser)
     args = parser.parse_args()
     return args
 
 
+def find_by_accession(accession, connection):
+    if connection.mirror is not None:
+        obj = connection.mirror.get(accession)
+        if obj is not None and obj.get('accession') == accession:
+            return [obj]
+    return encodedcc.get_ENCODE('search/?type=Item&accession=' + accession,
+                                connection)['@graph']
+
+
 def retreive_list_of_replaced(object_to_inspect_acc,
                               connection):
     to_return_list = [object_to_inspect_acc]
-    objects_to_inspect = encodedcc.get_ENCODE('search/?type=Item&accession=' +
-                                              object_to_inspect_acc,
-                                              connection)['@graph']
+    objects_to_inspect = find_by_accession(object_to_inspect_acc, connection)
     if objects_to_inspect:
         for object_to_inspect in objects_to_inspect:
             if object_to_inspect.get('alternate_accessions'):
@@ -59,16 +67,20 @@ def main():
     args = getArgs()
     key = encodedcc.ENC_Key(args.keyfile, args.key)
     connection = encodedcc.ENC_Connection(key)
-    profiles = encodedcc.get_ENCODE('/profiles/', connection)
+    encodedcc.configure_mirror(connection, args)
+    profiles = encodedcc.profile_map(connection).profiles
     for object_type in profiles.keys():
-        profile_properties = encodedcc.get_ENCODE(
-            '/profiles/' + object_type, connection).get('properties')
+        profile_properties = profiles[object_type].get('properties')
         # we should fix only objects that have alternate accessions property
         if profile_properties and profile_properties.get(
                 'alternate_accessions'):
             uuid_2_alternate_accessions = {}
-            objects = encodedcc.get_ENCODE('search/?type=' + object_type,
-                                           connection)['@graph']
+            if connection.mirror is not None and \
+                    connection.mirror.has_type(object_type):
+                objects = list(connection.mirror.items(object_type))
+            else:
+                objects = encodedcc.get_ENCODE('search/?type=' + object_type,
+                                               connection)['@graph']
             for entry in objects:
                 if entry.get('alternate_accessions'):
                     replaced_objects_accessions = []
@@ -90,9 +102,7 @@ def main():
                         uuid_sets_counter += 1
                 if uuid_sets_counter == 1:
                     for acc in list(uuid_2_alternate_accessions[uuid]):
-                        to_clean_objects = encodedcc.get_ENCODE(
-                            'search/?type=Item&accession=' + acc,
-                            connection)['@graph']
+                        to_clean_objects = find_by_accession(acc, connection)
                         for object_to_clean in to_clean_objects:
                             print(object_to_clean['uuid'] +
                                   ' alternate accessions list ' +
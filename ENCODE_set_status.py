@@ -42,6 +42,7 @@ import sys
 
 import requests
 
+import encodedcc
 
 DCC_MODES = {
     "dev": "https://test.encodedcc.org",
@@ -252,13 +253,14 @@ class Connection():
         res_json = response.json()
         if response.ok:
             if update:
-                self.debug_logger.info("Success.")
+                self.debug_logger.info("Success: {}".format(object_id))
                 self.debug_logger.debug(
                     json.dumps(res_json["changed"], indent=4, sort_keys=True)
                 )
                 return
             else:
-                self.debug_logger.info("DRY RUN is enabled.")
+                self.debug_logger.info(
+                    "DRY RUN is enabled: {}".format(object_id))
                 assert not res_json["changed"]
                 self.debug_logger.debug(
                     json.dumps(res_json["considered"], indent=4, sort_keys=True)
@@ -306,6 +308,13 @@ def get_parser():
                         Overide the transition table of ENCODE API and force
                         the API to make whatever status changes defined by
                         -s/--status.""")
+    parser.add_argument("--concurrency", type=int, default=4, help="""
+                        Number of records to change at once to start with.
+                        It is adjusted to portal latency and errors as the
+                        run goes. Default is %(default)s.""")
+    parser.add_argument("--max-concurrency", type=int, default=16, help="""
+                        Upper bound for --concurrency. Use 1 to change one
+                        record at a time. Default is %(default)s.""")
     parser.add_argument("-d", "--log-dir", default='.', help="""
                         A directory for the log file. Default is the current
                         working directory.""")
@@ -332,7 +341,7 @@ def main():
                 if line.strip() and (not line.startswith('#'))
             ]
 
-    for rec_id in rec_ids:
+    def set_one(rec_id):
         # Make sure the record is real and accessible
         conn.touch_record(rec_id)
         conn.set_status(
@@ -344,6 +353,23 @@ def main():
             block_children=args.block_children
         )
 
+    # Number of records handled at once adapts to portal latency and errors.
+    controller = encodedcc.ENC_AdaptiveConcurrency(
+        initial=args.concurrency, maximum=args.max_concurrency,
+        logger=conn.debug_logger
+    )
+    results = encodedcc.run_bulk(set_one, rec_ids, controller=controller)
+    failed = [
+        rec_id for rec_id, result in zip(rec_ids, results)
+        if isinstance(result, Exception)
+    ]
+    if failed:
+        conn.debug_logger.error(
+            'Failed to set status of {} of {} records: {}'.format(
+                len(failed), len(rec_ids), ', '.join(failed))
+        )
+        sys.exit(1)
+
 
 __doc__ = __doc__.format(
     setup_connection=Connection._setup_connection.__doc__
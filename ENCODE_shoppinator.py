@@ -1,5 +1,6 @@
 import argparse
 import os
+import encodedcc
 
 EPILOG = '''
 For more details:
@@ -64,7 +65,6 @@ def main():
               str(sorted(object_types.keys())))
     else:
         is_valid = True
-        attach = ''
         for acc in ACCESSIONS:
             if acc.startswith(object_types[object_type]) is False:
                 print('ERROR - Accession ' + acc +
@@ -75,9 +75,12 @@ def main():
                       ' does not match ENCODE accession format ' +
                       '(ENCXY123ABC) length')
                 is_valid = False
-            attach += '&accession=' + acc
         if is_valid:
-            print(server + 'search/?type=' + object_type + attach)
+            # long lists are printed as several URLs a browser will accept
+            query = encodedcc.ENC_Query('search', type=object_type,
+                                        accession=ACCESSIONS)
+            for chunk in query.split(server=server):
+                print(chunk.url(server))
 
 
 if __name__ == '__main__':
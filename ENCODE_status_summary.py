@@ -5,7 +5,6 @@
 import os.path
 import argparse
 import encodedcc
-from encodedcc import get_ENCODE
 
 EPILOG = '''
 The output of this program is for consumption by a googlesheet.
@@ -32,6 +31,7 @@ def getArgs():
                         default=False,
                         action='store_true',
                         help="Print debug messages.  Default is False.")
+    encodedcc.add_mirror_args(parser)
     args = parser.parse_args()
     return args
 
@@ -109,6 +109,12 @@ def make_rna_report(connection):
     ]
 
     matrix = {}
+    cells = [basic_query + rows[row] + queries[col]
+             for row in rows.keys() for col in headers]
+    cells += [basic_query + labs[lab] + rows['Long RNA'] + queries[col]
+              for lab in labs.keys() for col in headers]
+    totals = dict(zip(cells, encodedcc.count_many(cells, connection)))
+
     print('\t'.join([''] + headers))
     for row in rows.keys():
 
@@ -116,9 +122,8 @@ def make_rna_report(connection):
 
         for col in headers:
             query = basic_query + rows[row] + queries[col]
-            res = get_ENCODE(query, connection, frame='embedded')
             link = connection.server + query
-            total = res['total']
+            total = totals[query]
             if (col in [
                     'Unreleased with concordance issues',
                     'Released with concordance issues',
@@ -160,9 +165,8 @@ def make_rna_report(connection):
 
         for col in headers:
             query = basic_query + labs[lab] + rows['Long RNA'] + queries[col]
-            res = get_ENCODE(query, connection, frame='embedded')
             link = connection.server + query
-            total = res['total']
+            total = totals[query]
             # if col == 'Released with metadata issues':
             #    total = make_errors_detail(res['facets'], link)
             if total == 'no audit':
@@ -205,18 +209,10 @@ def make_errors_detail(facets, link):
         "technical replicates with not identical biosample",
     }
 
-    for f in facets:
-        if f['field'] == 'audit.ERROR.category':
-            errors = f
-            break
-        else:
-            errors = None
-    if errors is not None:
-        list_of_errs = []
-        total = 0
-    for term in errors['terms']:
-        count = term['doc_count']
-        key = term['key']
+    errors = (facets or {}).get('audit.ERROR.category', {})
+    list_of_errs = []
+    total = 0
+    for key, count in errors.items():
         if key in issues and count > 0:
             func2 = '=HYPERLINK(' + '"' + link + '",' + repr(count) + ')'
             list_of_errs.append(func2)
@@ -322,6 +318,10 @@ def make_chip_report(connection):
         'Unreleased unreplicated',
     ]
 
+    cells = [basic_query + labs[lab] + rows[row] + queries[col]
+             for lab in labs.keys() for row in rows.keys() for col in headers]
+    totals = dict(zip(cells, encodedcc.count_many(cells, connection)))
+
     for lab in labs.keys():
         print(lab, '--------------------------------------')
         print('\t'.join([''] + headers))
@@ -334,9 +334,8 @@ def make_chip_report(connection):
 
             for col in headers:
                 query = basic_query + labs[lab] + rows[row] + queries[col]
-                res = get_ENCODE(query, connection, frame='embedded')
                 link = connection.server + query
-                total = res['total']
+                total = totals[query]
 
                 # if col == 'Released with antibody issues':
                 #    make_antibody_detail(res['@graph'])
@@ -348,7 +347,8 @@ def make_chip_report(connection):
                 ]:
                     total = 'no audit'
                 if col == 'Unreleased with metadata issues':
-                    total = make_errors_detail(res['facets'], link)
+                    total = make_errors_detail(encodedcc.facets(
+                        query, connection, ['audit.ERROR.category']), link)
 
                 func = '=HYPERLINK(' + '"' + link + '",' + repr(total) + ')'
                 matrix[row].append(func)
@@ -361,6 +361,7 @@ def main():
     args = getArgs()
     key = encodedcc.ENC_Key(args.keyfile, args.key)
     connection = encodedcc.ENC_Connection(key)
+    encodedcc.configure_mirror(connection, args)
     if args.datatype == 'CHIP':
         make_chip_report(connection)
     elif args.datatype == 'RNA':
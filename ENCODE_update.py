@@ -10,7 +10,7 @@ import subprocess
 import time
 import logging
 import common
-from encodedcc import ENC_Key, ENC_Connection, ENC_Item
+from encodedcc import ENC_Key, ENC_Connection, ENC_Item, ENC_Resolver
 # from StringIO import StringIO
 
 logger = logging.getLogger(__name__)
@@ -122,7 +122,11 @@ def main():
 
     with open(args.infile, 'rU') as f:
         reader = csv.DictReader(f, delimiter=',', quotechar='"')
-        for new_metadata in reader:
+        rows = list(reader)
+        # check every uuid/accession exists with a few batched searches
+        resolved = ENC_Resolver(connection, max_age=0).resolve(
+            row.get('uuid') or row.get('accession') for row in rows)
+        for new_metadata in rows:
             uuid = new_metadata.pop('uuid', None)
             accession = new_metadata.pop('accession', None)
             if uuid:  # use the uuid if there is one
@@ -131,6 +135,9 @@ def main():
                 obj_id = accession
             else:  # if neither uuid or accession, assume this is a new object
                 obj_id = None
+            if obj_id and obj_id not in resolved:
+                logger.warning('Skipping %s, it was not found' % (obj_id))
+                continue
             enc_object = ENC_Item(connection, obj_id)
             # print "Got accessioned object %s with status %s" %(enc_object.get('accession'), enc_object.get('status'))
             for prop in new_metadata:
@@ -1,19 +1,18 @@
 import argparse
 import os.path
 import encodedcc
-import requests
-import urllib.parse
-from time import sleep
 import csv
 import json
 import sys
 
-GET_HEADERS = {'accept': 'application/json'}
 CORE_MARKS = ['H3K27ac', 'H3K27me3', 'H3K36me3', 'H3K4me1',
               'H3K4me3', 'H3K9me3']
 EXPERIMENT_IGNORE_STATUS = ['deleted', 'revoked', 'replaced']
 FILE_IGNORE_STATUS = ['deleted', 'revoked', 'replaced', 'archived',
                       'upload failed', 'format check failed', 'uploading']
+FILE_FIELDS = ['status', 'file_format', 'read_length', 'run_type',
+               'replicate.biological_replicate_number',
+               'replicate.technical_replicate_number']
 
 EPILOG = '''
 For more details:
@@ -55,46 +54,11 @@ def getArgs():
                         default=False,
                         action='store_true',
                         help="Print debug messages.  Default is False.")
+    encodedcc.add_mirror_args(parser)
     args = parser.parse_args()
     return args
 
 
-def encoded_get(url, keypair=None, frame='object', return_response=False):
-    url_obj = urllib.parse.urlsplit(url)
-    new_url_list = list(url_obj)
-    query = urllib.parse.parse_qs(url_obj.query)
-    if 'format' not in query:
-        new_url_list[3] += "&format=json"
-    if 'frame' not in query:
-        new_url_list[3] += "&frame=%s" % (frame)
-    if 'limit' not in query:
-        new_url_list[3] += "&limit=all"
-    if new_url_list[3].startswith('&'):
-        new_url_list[3] = new_url_list[3].replace('&', '', 1)
-    get_url = urllib.parse.urlunsplit(new_url_list)
-    max_retries = 10
-    max_sleep = 10
-    while max_retries:
-        try:
-            if keypair:
-                response = requests.get(get_url,
-                                        auth=keypair,
-                                        headers=GET_HEADERS)
-            else:
-                response = requests.get(get_url, headers=GET_HEADERS)
-        except (requests.exceptions.ConnectionError,
-                requests.exceptions.SSLError) as e:
-            print >> sys.stderr, e
-            sleep(max_sleep - max_retries)
-            max_retries -= 1
-            continue
-        else:
-            if return_response:
-                return response
-            else:
-                return response.json()
-
-
 def is_interesting(experiment):
     if experiment['status'] in EXPERIMENT_IGNORE_STATUS:
         return False
@@ -252,60 +216,67 @@ def is_not_mild_library_bottlenecking(experiment):
     return True
 
 
+def seq_info(file_ids, files):
+    '''REPb.t read lengths and run types of the fastqs in file_ids'''
+    rep_dict = {}
+    for file_id in file_ids:
+        file_object = files.get(file_id)
+        if file_object is None or \
+                file_object['status'] in FILE_IGNORE_STATUS:
+            continue
+        if file_object['file_format'] == 'fastq':
+            bio_rep_number = file_object['replicate.biological_replicate_number']
+            tec_rep_number = file_object['replicate.technical_replicate_number']
+            if bio_rep_number is not None:
+                key = (bio_rep_number, tec_rep_number)
+                if key not in rep_dict:
+                    rep_dict[key] = set()
+                if file_object['read_length'] is not None and \
+                        file_object['run_type'] is not None:
+                    if file_object['run_type'] == 'single-ended':
+                        record_val = str(file_object['read_length']) + 'SE'
+                    else:
+                        record_val = str(file_object['read_length']) + 'PE'
+                    rep_dict[key].add(record_val)
+    seq_info_string = ''
+    for k in sorted(rep_dict.keys()):
+        reps_string = ''
+        for member in rep_dict[k]:
+            reps_string += member + ', '
+        seq_info_string += 'REP' + \
+            str(k[0]) + '.' + str(k[1]) + ' ' + reps_string[:-2] + '\r'
+    return seq_info_string
+
+
 def main():
     args = getArgs()
     key = encodedcc.ENC_Key(args.keyfile, args.key)
-    keypair = (key.authid, key.authpw)
-    server = key.server
     connection = encodedcc.ENC_Connection(key)
-
-    lab = '&lab.name=' + args.lab
-    organism = '&replicates.library.biosample.donor.organism.scientific_name=' + \
-               args.organism
-
-    histone_experiments_pages = encoded_get(server +
-                                            'search/?type=Experiment' +
-                                            '&assay_term_name=ChIP-seq'
-                                            '&award.rfa=ENCODE3' + organism +
-                                            '&target.investigated_as=' +
-                                            args.target + lab +
-                                            '&format=json&frame=' +
-                                            'page&limit=all',
-                                            keypair)['@graph']
-    print("retreived " + str(len(histone_experiments_pages)) +
-          " experiment pages")
-
-    histone_controls_pages = encoded_get(server +
-                                         'search/?type=Experiment' +
-                                         '&assay_term_name=ChIP-seq'
-                                         '&award.rfa=ENCODE3' + organism +
-                                         '&target.investigated_as=control' +
-                                         lab + '&format=json&frame=' +
-                                         'page&limit=all', keypair)['@graph']
-    print("retreived " + str(len(histone_controls_pages)) + " control pages")
-
-    histone_experiments_objects = encoded_get(server +
-                                              'search/?type=Experiment' +
-                                              '&assay_term_name=ChIP-seq'
-                                              '&award.rfa=ENCODE3' + organism +
-                                              '&target.investigated_as=' +
-                                              args.target + lab +
-                                              '&format=json&frame=' +
-                                              'embedded&limit=all',
-                                              keypair)['@graph']
+    encodedcc.configure_mirror(connection, args)
+
+    experiments = encodedcc.ENC_Query(
+        'search', {'type': 'Experiment', 'assay_term_name': 'ChIP-seq',
+                   'award.rfa': 'ENCODE3', 'lab.name': args.lab,
+                   'replicates.library.biosample.donor.organism.scientific_name':
+                   args.organism})
+
+    # only what the checks below read, for both the page and object views
+    fields = ['accession', 'status', 'aliases', 'replication_type',
+              'biosample_term_name', 'target.label',
+              'possible_controls.accession', 'original_files', 'audit']
+
+    histone_experiments_objects = list(encodedcc.search(
+        experiments.add({'target.investigated_as': args.target}).url(),
+        connection, fields=fields, flat=False))
+    histone_experiments_pages = histone_experiments_objects
     print("retreived " + str(len(histone_experiments_objects)) +
-          " experiment objects")
-
-    histone_controls_objects = encoded_get(server +
-                                           'search/?type=Experiment' +
-                                           '&assay_term_name=ChIP-seq'
-                                           '&award.rfa=ENCODE3' + organism +
-                                           '&target.investigated_as=control' +
-                                           lab + '&format=json&frame=' +
-                                           'embedded&limit=all',
-                                           keypair)['@graph']
-    print("retreived " + str(len(histone_controls_objects)) +
-          " control objects")
+          " experiments")
+
+    histone_controls_objects = list(encodedcc.search(
+        experiments.add({'target.investigated_as': 'control'}).url(),
+        connection, fields=fields, flat=False))
+    histone_controls_pages = histone_controls_objects
+    print("retreived " + str(len(histone_controls_objects)) + " controls")
 
     matrix = {}
     control_matrix = {}
@@ -352,6 +323,14 @@ def main():
         sample_types.add(sample)
         marks.add(mark)
 
+    # every file of every experiment and control in one chunked pass, with
+    # the replicate numbers embedded instead of a GET per file and replicate
+    file_ids = [file_id for entry in
+                histone_experiments_objects + histone_controls_objects
+                for file_id in entry['original_files']]
+    files = encodedcc.get_multi(file_ids, connection, fields=FILE_FIELDS,
+                                fallback_frame='embedded')
+
     mone = 0
     for ac in histone_experiments_dict:
         page = histone_experiments_dict[ac]['page']
@@ -429,36 +408,8 @@ def main():
 
             histone_experiments_dict[ac]['statuses'] = statuses
 
-            rep_dict = {}
-            for file_id in obj['original_files']:
-                file_object = encodedcc.get_ENCODE(
-                    file_id.split('/')[2], connection, 'embedded')
-                if file_object['status'] in FILE_IGNORE_STATUS:
-                    continue
-                if file_object['file_format'] == 'fastq':
-                    if 'replicate' in file_object:
-                        bio_rep_number = file_object['replicate']['biological_replicate_number']
-                        tec_rep_number = file_object['replicate']['technical_replicate_number']
-                        key = (bio_rep_number, tec_rep_number)
-                        if key not in rep_dict:
-                            rep_dict[key] = set()
-                        if 'read_length' in file_object and 'run_type' in file_object:
-                            if file_object['run_type'] == 'single-ended':
-                                record_val = str(
-                                    file_object['read_length']) + 'SE'
-                            else:
-                                record_val = str(
-                                    file_object['read_length']) + 'PE'
-                            rep_dict[key].add(record_val)
-            seq_info_string = ''
-            for k in sorted(rep_dict.keys()):
-                reps_string = ''
-                for member in rep_dict[k]:
-                    reps_string += member + ', '
-                seq_info_string += 'REP' + \
-                    str(k[0]) + '.' + str(k[1]) + ' ' + reps_string[:-2] + '\r'
-
-            histone_experiments_dict[ac]['seq_info'] = seq_info_string
+            histone_experiments_dict[ac]['seq_info'] = seq_info(
+                obj['original_files'], files)
 
     mone = 0
     for ac in histone_controls_dict:
@@ -489,33 +440,8 @@ def main():
                 statuses['qc'].append('mild library bottlenecking')
 
         histone_controls_dict[ac]['statuses'] = statuses
-        rep_dict = {}
-        for file_id in obj['original_files']:
-            file_object = encodedcc.get_ENCODE(
-                file_id.split('/')[2], connection, 'embedded')
-            if file_object['status'] in FILE_IGNORE_STATUS:
-                continue
-            if file_object['file_format'] == 'fastq':
-                if 'replicate' in file_object:
-                    bio_rep_number = file_object['replicate']['biological_replicate_number']
-                    tec_rep_number = file_object['replicate']['technical_replicate_number']
-                    key = (bio_rep_number, tec_rep_number)
-                    if key not in rep_dict:
-                        rep_dict[key] = set()
-                    if 'read_length' in file_object and 'run_type' in file_object:
-                        if file_object['run_type'] == 'single-ended':
-                            record_val = str(file_object['read_length']) + 'SE'
-                        else:
-                            record_val = str(file_object['read_length']) + 'PE'
-                        rep_dict[key].add(record_val)
-        seq_info_string = ''
-        for k in sorted(rep_dict.keys()):
-            reps_string = ''
-            for member in rep_dict[k]:
-                reps_string += member + ', '
-            seq_info_string += 'REP' + \
-                str(k[0]) + '.' + str(k[1]) + ' ' + reps_string[:-2] + '\r'
-        histone_controls_dict[ac]['seq_info'] = seq_info_string
+        histone_controls_dict[ac]['seq_info'] = seq_info(
+            obj['original_files'], files)
 
     if args.target == "histone":
 
@@ -3,14 +3,29 @@
 
 import requests
 import json
+import re
+import keyword
 import sys
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
 from urllib.parse import urljoin
-from urllib.parse import quote
+from urllib.parse import quote, quote_plus
 import os.path
 import hashlib
 import copy
 import subprocess
+import sqlite3
+import time
+import zlib
+import atexit
+import random
+import email.utils
+import codecs
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode, unquote
+from collections import OrderedDict, deque
+from array import array
+from datetime import timezone
 
 from contextlib import contextmanager
 
@@ -30,6 +45,75 @@ def print_muted():
         logging.getLogger().disabled = False
 
 
+JSON_BACKENDS = ('orjson', 'ujson', 'json')
+
+
+def set_json_backend(name=None):
+    '''
+    Choose the library json_loads and json_dumps use: orjson, ujson or
+    json (the standard library).  By default, or given None, the first of
+    these that is installed, unless $ENCODEDCC_JSON names one.  Returns the
+    name of the backend chosen.
+    '''
+    global _loads, _dumps, json_backend
+    names = [name or os.environ.get('ENCODEDCC_JSON')] + list(JSON_BACKENDS)
+    for name in names:
+        if name == 'orjson':
+            try:
+                import orjson
+            except ImportError:
+                continue
+            _loads = orjson.loads
+            _dumps = lambda obj: orjson.dumps(obj).decode('utf-8')
+        elif name == 'ujson':
+            try:
+                import ujson
+            except ImportError:
+                continue
+            _loads = ujson.loads
+            _dumps = lambda obj: ujson.dumps(obj, ensure_ascii=False,
+                                             escape_forward_slashes=False)
+        elif name == 'json':
+            _loads = json.loads
+            _dumps = json.dumps
+        else:
+            continue
+        json_backend = name
+        return name
+
+
+def json_loads(data):
+    '''decode JSON from str or UTF-8 bytes with the chosen backend'''
+    try:
+        return _loads(data)
+    except ValueError:
+        # the fast backends refuse some valid JSON, e.g. huge integers
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        return json.loads(data)
+
+
+def json_dumps(obj):
+    '''encode obj as compact JSON text with the chosen backend'''
+    try:
+        return _dumps(obj)
+    except (TypeError, OverflowError):
+        return json.dumps(obj)
+
+
+set_json_backend()
+
+
+def _debugging():
+    '''whether debug messages are being logged, so that they are only
+    formatted when they will be seen'''
+    return logging.getLogger().isEnabledFor(logging.DEBUG)
+
+
+def _pretty(obj, **kwargs):
+    return json.dumps(obj, indent=4, separators=(',', ': '), **kwargs)
+
+
 class dict_diff(object):
     """
     Calculate items added, items removed, keys same in both but changed values,
@@ -94,12 +178,1170 @@ class ENC_Key:
             self.server += "/"
 
 
+class ENC_ObjectCache(object):
+    '''
+    Bounded in-memory LRU of single objects, keyed by @id and frame.
+
+    Every ENC_Connection has one as connection.objects and get_ENCODE
+    consults it before going to the network, so a run that touches the same
+    lab, platform or biosample a thousand times fetches it once.  Entries
+    are found only by the object's full @id or its uuid: aliases can be
+    reassigned and accessions of replaced objects resolve to their
+    replacements, so those spellings always go to the portal.  Reads with
+    a query string (?datastore=database and the like) are never served
+    from the cache.  Only objects are cached, never searches or
+    collections; PATCH and PUT through encodedcc drop the object from the
+    cache, whichever identifier they use.  Embedded frames of other
+    objects that contain a patched object are not tracked.
+
+    Raw response bodies are stored and decoded on each hit, so callers are
+    free to modify what they get back.
+    '''
+    def __init__(self, max_entries=20000, max_bytes=256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # (@id, frame): body
+        self._names = {}  # @id or uuid: @id
+        self._spellings = {}  # any identifier: set of @ids, to invalidate
+        self._known = {}  # @id: set of identifiers
+        self._frames = {}  # @id: set of cached frames
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def name(identifier):
+        '''/files/ENCFF000AAA/?frame=object -> /files/ENCFF000AAA/,
+        a uuid on its own or under a collection -> the uuid'''
+        if identifier.startswith(('http://', 'https://')):
+            identifier = urlsplit(identifier).path
+        # aliases look like URLs with a scheme, so no urlsplit for them
+        path = unquote(identifier.split('?')[0]).strip('/')
+        last = path.split('/')[-1]
+        if UUID_RE.match(last.lower()):
+            return last.lower()
+        if '/' not in path:
+            return path
+        return '/' + path + '/'
+
+    def get(self, obj_id, frame):
+        if '?' in obj_id:
+            return None
+        with self._lock:
+            at_id = self._names.get(self.name(obj_id))
+            body = self._entries.get((at_id, frame))
+            if body is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((at_id, frame))
+            self.hits += 1
+            return body
+
+    def put(self, obj_id, frame, obj, body):
+        if '?' in obj_id or not isinstance(obj, dict) or \
+           not obj.get('uuid') or not obj.get('@id') or \
+           len(body) > self.max_bytes:
+            return
+        at_id = self.name(obj['@id'])
+        uuid = self.name(obj['uuid'])
+        spellings = [obj_id, at_id, uuid] + obj.get('aliases', [])
+        if obj.get('accession'):
+            spellings.append(obj['accession'])
+        with self._lock:
+            self._names[at_id] = at_id
+            self._names[uuid] = at_id
+            known = self._known.setdefault(at_id, set())
+            for name in spellings:
+                name = self.name(name)
+                self._spellings.setdefault(name, set()).add(at_id)
+                known.add(name)
+            old = self._entries.pop((at_id, frame), None)
+            if old is not None:
+                self.bytes -= len(old)
+            self._entries[(at_id, frame)] = body
+            self._frames.setdefault(at_id, set()).add(frame)
+            self.bytes += len(body)
+            while len(self._entries) > self.max_entries or \
+                    self.bytes > self.max_bytes:
+                (evicted, evicted_frame), old = self._entries.popitem(
+                    last=False)
+                self.bytes -= len(old)
+                self.evictions += 1
+                self._frames[evicted].discard(evicted_frame)
+                if not self._frames[evicted]:
+                    self._forget(evicted)
+
+    def invalidate(self, obj_id):
+        '''drop every frame of every object obj_id may name'''
+        with self._lock:
+            for at_id in list(self._spellings.get(self.name(obj_id), ())):
+                for frame in self._frames.get(at_id, ()):
+                    self.bytes -= len(self._entries.pop((at_id, frame)))
+                self._forget(at_id)
+
+    def _forget(self, at_id):
+        self._frames.pop(at_id, None)
+        for name in self._known.pop(at_id, ()):
+            if self._names.get(name) == at_id:
+                del self._names[name]
+            at_ids = self._spellings.get(name)
+            if at_ids is not None:
+                at_ids.discard(at_id)
+                if not at_ids:
+                    del self._spellings[name]
+
+    def stats(self):
+        return {'entries': len(self._entries), 'bytes': self.bytes,
+                'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions}
+
+
+class ENC_SingleFlight(object):
+    '''
+    Coalesces identical requests that are in flight at the same time.
+
+    The first thread to call do() with a key runs func; every other thread
+    that asks for the same key before it finishes waits for that result
+    instead of sending its own request.  saved counts the requests that
+    were avoided this way.
+    '''
+    def __init__(self):
+        self.leaders = 0
+        self.saved = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+                self.leaders += 1
+            else:
+                self.saved += 1
+        if leader:
+            try:
+                future.set_result(func(*args))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    del self._calls[key]
+        return future.result()
+
+
+class ENC_RetryPolicy(object):
+    '''
+    When and how long to wait before retrying a request.
+
+    Connection errors, timeouts and the statuses in retry_statuses are
+    retried up to max_retries times with exponential backoff and full jitter,
+    or after the server's Retry-After if it sent one.  Retrying is
+    idempotency-aware: GET and PUT are always safe to repeat, PATCH is
+    treated as idempotent when idempotent_patch is set (encodedcc PATCHes
+    set absolute values), and POST is only retried when the server cannot
+    have acted on it: a connect failure, or a 429/503 rejection.
+    '''
+    IDEMPOTENT = ['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE']
+    # statuses where the request was refused rather than processed
+    REJECTED = [429, 503]
+
+    def __init__(self, max_retries=5, backoff=0.5, max_backoff=60,
+                 retry_statuses=(429, 500, 502, 503, 504),
+                 idempotent_patch=True):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_statuses = retry_statuses
+        self.idempotent_patch = idempotent_patch
+
+    def is_idempotent(self, method):
+        return method in self.IDEMPOTENT or \
+            (method == 'PATCH' and self.idempotent_patch)
+
+    def should_retry(self, method, attempt, response=None, error=None):
+        if attempt >= self.max_retries:
+            return False
+        if error is not None:
+            if isinstance(error, requests.exceptions.ConnectTimeout):
+                return True
+            return isinstance(error, (requests.exceptions.ConnectionError,
+                                      requests.exceptions.Timeout)) and \
+                self.is_idempotent(method)
+        if response.status_code in self.REJECTED:
+            return True
+        return response.status_code in self.retry_statuses and \
+            self.is_idempotent(method)
+
+    def delay(self, attempt, response=None):
+        retry_after = response is not None and \
+            response.headers.get('retry-after')
+        if retry_after:
+            try:
+                return max(0, min(self.max_backoff, float(retry_after)))
+            except ValueError:
+                pass
+            try:
+                # a malformed date raises on 3.10+, older Pythons may give None
+                when = email.utils.parsedate_to_datetime(retry_after)
+            except (TypeError, ValueError, IndexError):
+                when = None
+            if when is not None:
+                if when.tzinfo is None:
+                    when = when.replace(tzinfo=timezone.utc)
+                return max(0, min(self.max_backoff,
+                                  when.timestamp() - time.time()))
+        return random.uniform(
+            0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+
+class ENC_RateLimiter(object):
+    '''
+    Token bucket allowing rate requests per second with bursts of up to
+    burst requests.  acquire() blocks until a token is available.
+    Use rate_limiter_for() to share one bucket per server.
+    '''
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = burst or max(1, int(rate))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens +
+                                  (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def rate_limiter_for(server, rate, burst=None):
+    '''the ENC_RateLimiter shared by every connection to server'''
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(server)
+        if limiter is None or limiter.rate != rate:
+            limiter = _rate_limiters[server] = ENC_RateLimiter(rate, burst)
+        return limiter
+
+
+class ENC_AdaptiveConcurrency(object):
+    '''
+    AIMD controller for the number of requests a bulk job keeps in flight.
+
+    Every window samples the limit is raised by increase while the p95
+    latency stays under target_latency.  A 5xx, 429 or timeout cuts the
+    limit by the decrease factor at once; one cut per limit samples, so a
+    burst of failures from the same round does not collapse it to minimum.
+    Changes are logged at INFO to logger and kept in history as
+    (time, limit) so the targets can be tuned afterwards.
+
+    ENC_Connection.request() reports every attempt to connection.controller
+    when one is set; run_bulk() sets it up.
+    '''
+    def __init__(self, initial=4, minimum=1, maximum=32, target_latency=2.0,
+                 increase=1, decrease=0.5, window=20, logger=logging):
+        self.limit = max(minimum, min(initial, maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.increase = increase
+        self.decrease = decrease
+        self.window = window
+        self.logger = logger
+        self.in_flight = 0
+        self.history = [(time.time(), self.limit)]
+        self._latencies = deque(maxlen=window)
+        self._since_change = 0
+        self._condition = threading.Condition()
+
+    def p95(self):
+        latencies = sorted(self._latencies)
+        if not latencies:
+            return 0
+        return latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+
+    def record(self, latency, error=False):
+        with self._condition:
+            self._latencies.append(latency)
+            self._since_change += 1
+            if error:
+                if self._since_change >= self.limit:
+                    self._set_limit(max(self.minimum,
+                                        int(self.limit * self.decrease)),
+                                    'error')
+            elif self._since_change >= self.window and \
+                    self.p95() < self.target_latency:
+                self._set_limit(min(self.maximum,
+                                    self.limit + self.increase), 'p95')
+
+    def _set_limit(self, limit, reason):
+        self._since_change = 0
+        if limit == self.limit:
+            return
+        self.logger.info('concurrency %d -> %d (%s, p95 %.2fs)' %
+                         (self.limit, limit, reason, self.p95()))
+        self.limit = limit
+        self.history.append((time.time(), limit))
+        self._condition.notify_all()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= self.limit:
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+
+def _is_overload(response=None, error=None):
+    '''does this outcome mean the portal wants us to back off'''
+    if error is not None:
+        if isinstance(error, requests.exceptions.HTTPError) and \
+           error.response is not None:
+            return _is_overload(response=error.response)
+        return isinstance(error, (requests.exceptions.Timeout,
+                                  requests.exceptions.ConnectionError))
+    return response.status_code == 429 or response.status_code >= 500
+
+
+def run_bulk(func, items, connection=None, controller=None):
+    '''
+    Call func(item) for every item on a thread pool, keeping as many calls
+    in flight as controller (an ENC_AdaptiveConcurrency) allows.
+
+    If connection is given its requests drive the controller; otherwise
+    each call of func is timed and its exceptions classified instead.
+    Results come back in input order, with the exception instance in place
+    of any call that raised.  A call that exits (sys.exit) stops further
+    submissions and the exit is re-raised.
+
+    With a connection no more threads are started than its pool has
+    connections.  A controller already attached to it, by an enclosing
+    run_bulk, stays attached: its requests keep driving the outer job
+    while the inner one paces itself with its own controller.
+    '''
+    if controller is None:
+        controller = (ENC_AdaptiveConcurrency() if connection is None else
+                      ENC_AdaptiveConcurrency(maximum=connection.pool_size))
+    workers = controller.maximum
+    attached = False
+    if connection is not None:
+        # threads beyond the pool size only make urllib3 discard connections
+        workers = min(workers, connection.pool_size)
+        if connection.controller is None:
+            connection.controller = controller
+            attached = True
+    aborted = threading.Event()
+
+    def call(item):
+        start = time.time()
+        try:
+            result = func(item)
+        except Exception as e:
+            if connection is None:
+                controller.record(time.time() - start, _is_overload(error=e))
+            raise
+        except BaseException:
+            aborted.set()
+            raise
+        if connection is None:
+            controller.record(time.time() - start)
+        return result
+
+    futures = []
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for item in items:
+                controller.acquire()
+                if aborted.is_set():
+                    controller.release()
+                    break
+                future = pool.submit(call, item)
+                future.add_done_callback(lambda f: controller.release())
+                futures.append(future)
+    finally:
+        if attached:
+            connection.controller = None
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as e:
+            logging.warning('bulk call failed: %s' % (e))
+            results.append(e)
+    return results
+
+
 class ENC_Connection(object):
-    def __init__(self, key):
+    '''
+    Holds the server, credentials and a pool of keep-alive HTTP connections.
+
+    All of the encodedcc verbs go through connection.session, so repeated
+    calls reuse open TCP/TLS connections instead of handshaking every time.
+    One ENC_Connection can be shared by any number of worker threads: each
+    thread gets its own requests.Session (Session objects are not thread-safe)
+    but they all mount the same HTTPAdapter, whose connection pool is.
+    pool_size should be at least the number of threads sharing the object.
+
+    Requests are retried according to retry (an ENC_RetryPolicy) and, if
+    rate_limit is given, throttled to that many requests per second across
+    every connection to the same server.
+    '''
+    def __init__(self, key, pool_size=10, keep_alive=True,
+                 max_cached_objects=20000, max_cached_bytes=256 * 1024 * 1024,
+                 retry=None, rate_limit=None):
         self.headers = {'content-type': 'application/json',
                         'accept': 'application/json'}
+        if not keep_alive:
+            self.headers['connection'] = 'close'
         self.server = key.server
         self.auth = (key.authid, key.authpw)
+        self.cache = None
+        self.mirror = None
+        self.inflight = ENC_SingleFlight()
+        self.objects = None
+        if max_cached_objects:
+            self.objects = ENC_ObjectCache(max_cached_objects,
+                                           max_cached_bytes)
+        self.retry = retry or ENC_RetryPolicy()
+        self.controller = None
+        self.rate_limiter = None
+        if rate_limit:
+            self.rate_limiter = rate_limiter_for(self.server, rate_limit)
+        self.pool_size = pool_size
+        self.adapter = requests.adapters.HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size)
+        self._local = threading.local()
+
+    @property
+    def session(self):
+        '''requests.Session for the calling thread, sharing the pool'''
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.mount('https://', self.adapter)
+            session.mount('http://', self.adapter)
+            self._local.session = session
+        return session
+
+    def request(self, method, url, **kwargs):
+        '''send a request through the pool, rate limiter and retry policy'''
+        method = method.upper()
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            start = time.time()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.exceptions.RequestException as e:
+                if self.controller is not None:
+                    self.controller.record(time.time() - start,
+                                           _is_overload(error=e))
+                if not self.retry.should_retry(method, attempt, error=e):
+                    raise
+                wait = self.retry.delay(attempt)
+                logging.warning('%s %s failed (%s), retrying in %.1fs' %
+                                (method, url, e, wait))
+            else:
+                if self.controller is not None:
+                    self.controller.record(time.time() - start,
+                                           _is_overload(response=response))
+                if not self.retry.should_retry(method, attempt,
+                                               response=response):
+                    return response
+                wait = self.retry.delay(attempt, response)
+                logging.warning('%s %s returned %s, retrying in %.1fs' %
+                                (method, url, response.status_code, wait))
+            attempt += 1
+            time.sleep(wait)
+
+    def close(self):
+        '''drop the calling thread's session and close pooled connections'''
+        self._local.session = None
+        self.adapter.close()
+
+
+class ENC_ResponseCache(object):
+    '''
+    Persistent SQLite cache of GET responses, shared between runs.
+
+    Entries are keyed by server, credentials and the canonical URL (query
+    parameters sorted, so frame and limit are part of the key).  Bodies are
+    stored zlib compressed.  Each entry is fresh for a TTL chosen by the kind
+    of request, see ttl_for(); once stale it is revalidated with
+    If-None-Match/If-Modified-Since if the server sent an ETag or
+    Last-Modified, and a 304 answer refreshes the entry without a download.
+
+    Attach one to a connection to turn it on:
+
+        connection.cache = encodedcc.ENC_ResponseCache('~/.encodedcc_cache')
+
+    or use add_cache_args()/configure_cache() in a script.
+    '''
+    # seconds, checked in order against the URL path
+    DEFAULT_TTLS = [('/profiles/', 24 * 60 * 60),
+                    ('/search/', 5 * 60),
+                    ('/report/', 5 * 60),
+                    ('/matrix/', 5 * 60)]
+    DEFAULT_TTL = 60 * 60
+
+    def __init__(self, cache_dir, ttls=None, default_ttl=None):
+        cache_dir = os.path.expanduser(cache_dir)
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self.path = os.path.join(cache_dir, 'responses.sqlite')
+        self.ttls = self.DEFAULT_TTLS if ttls is None else ttls
+        self.default_ttl = (self.DEFAULT_TTL if default_ttl is None
+                            else default_ttl)
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute('''CREATE TABLE IF NOT EXISTS responses (
+                            key TEXT PRIMARY KEY,
+                            url TEXT,
+                            body BLOB,
+                            etag TEXT,
+                            last_modified TEXT,
+                            stored REAL)''')
+        self._db.commit()
+
+    @staticmethod
+    def canonical_url(url):
+        '''the ENC_Query form of url, so equivalent URLs share a key'''
+        parts = urlsplit(url)
+        query = ENC_Query(urlunsplit(('', '', parts.path, parts.query, '')))
+        return query.url(urlunsplit((parts.scheme, parts.netloc.lower(),
+                                     '', '', '')))
+
+    def key(self, url, auth):
+        user = auth[0] if auth else ''
+        return hashlib.sha1((user + ' ' + self.canonical_url(url)).encode(
+            'utf-8')).hexdigest()
+
+    def ttl_for(self, url):
+        path = urlsplit(url).path
+        for prefix, ttl in self.ttls:
+            if path.startswith(prefix):
+                return ttl
+        return self.default_ttl
+
+    def lookup(self, url, auth):
+        '''return (body, fresh, etag, last_modified) or None'''
+        with self._lock:
+            row = self._db.execute(
+                'SELECT body, etag, last_modified, stored FROM responses '
+                'WHERE key = ?', (self.key(url, auth),)).fetchone()
+        if row is None:
+            return None
+        body, etag, last_modified, stored = row
+        fresh = time.time() - stored < self.ttl_for(url)
+        return zlib.decompress(body), fresh, etag, last_modified
+
+    def store(self, url, auth, body, etag=None, last_modified=None):
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                (self.key(url, auth), self.canonical_url(url),
+                 zlib.compress(body), etag, last_modified, time.time()))
+            self._db.commit()
+
+    def invalidate(self, url):
+        '''drop the entries of url in every frame, for every user'''
+        base = self.canonical_url(url.split('?')[0])
+        with self._lock:
+            self._db.execute(
+                'DELETE FROM responses WHERE url = ? OR '
+                'substr(url, 1, ?) = ?',
+                (base, len(base) + 1, base + '?'))
+            self._db.commit()
+
+    def touch(self, url, auth):
+        with self._lock:
+            self._db.execute('UPDATE responses SET stored = ? WHERE key = ?',
+                             (time.time(), self.key(url, auth)))
+            self._db.commit()
+
+    def summary(self):
+        return 'response cache: %d hits, %d misses, %d revalidated (%s)' % (
+            self.hits, self.misses, self.revalidated, self.path)
+
+
+def add_cache_args(parser):
+    '''add the --cache-dir/--no-cache switches to an argparse parser'''
+    parser.add_argument('--cache-dir',
+                        default=os.environ.get('ENCODEDCC_CACHE_DIR'),
+                        help="Cache GET responses in this directory between \
+                        runs.  Default is $ENCODEDCC_CACHE_DIR, if set")
+    parser.add_argument('--no-cache',
+                        default=False,
+                        action='store_true',
+                        help="Do not use the response cache.  Default is False")
+
+
+def configure_cache(connection, args):
+    '''attach an ENC_ResponseCache to connection per add_cache_args()
+    and print its hit/miss summary to stderr at exit'''
+    if args.cache_dir and not args.no_cache:
+        connection.cache = ENC_ResponseCache(args.cache_dir)
+        atexit.register(
+            lambda: print(connection.cache.summary(), file=sys.stderr))
+    return connection
+
+
+class ENC_Mirror(object):
+    '''
+    Local SQLite copy of portal objects (frame=object), for tools that
+    would otherwise search the same collections over and over.
+
+    sync() copies whole types through paged searches and afterwards only
+    asks for objects whose date_modified is at or past the newest one
+    already held, so later syncs are small; each sync also lists the
+    uuids the portal still shows and drops the objects it no longer does
+    (deleted, replaced or hidden ones).  Objects are indexed by @id,
+    uuid, accession, aliases, type and status.  Attach one to a connection
+    to answer searches from it:
+
+        connection.mirror = encodedcc.ENC_Mirror('~/encode_mirror.sqlite')
+
+    or use add_mirror_args()/configure_mirror() in a script.  The mirror is
+    only as current as its last sync, so single object GETs (get_ENCODE,
+    and the expander and model fetches) are answered from it only when
+    max_age is set, and then only for types synced at most max_age
+    seconds ago.  Leave it unset for anything that reads objects in order
+    to PATCH them.
+
+    Every property of every object is also kept in an inverted index of
+    (field, value) postings, which query() uses to answer portal style
+    searches offline; count(), facets() and search() go through it when
+    the connection has a mirror.
+    '''
+    # longer strings (descriptions, notes) are not worth indexing
+    MAX_INDEXED_LENGTH = 256
+    DEFAULT_TYPES = ['Experiment', 'File', 'Replicate', 'Library',
+                     'Biosample', 'Analysis']
+
+    def __init__(self, path, max_age=None):
+        self.path = os.path.expanduser(path)
+        self.max_age = max_age
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS objects (
+                uuid TEXT PRIMARY KEY,
+                at_id TEXT UNIQUE,
+                type TEXT,
+                accession TEXT,
+                status TEXT,
+                date_modified TEXT,
+                body BLOB);
+            CREATE INDEX IF NOT EXISTS objects_type ON objects (type, status);
+            CREATE INDEX IF NOT EXISTS objects_accession
+                ON objects (accession);
+            CREATE TABLE IF NOT EXISTS identifiers (
+                identifier TEXT PRIMARY KEY,
+                uuid TEXT);
+            CREATE INDEX IF NOT EXISTS identifiers_uuid
+                ON identifiers (uuid);
+            CREATE TABLE IF NOT EXISTS synced (
+                type TEXT PRIMARY KEY,
+                last_modified TEXT,
+                synced_at REAL);
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT);
+            CREATE TABLE IF NOT EXISTS postings (
+                field TEXT,
+                value TEXT,
+                uuid TEXT);
+            CREATE INDEX IF NOT EXISTS postings_field
+                ON postings (field, value);
+            CREATE INDEX IF NOT EXISTS postings_uuid ON postings (uuid);''')
+        self._db.commit()
+        self._fields = None
+        if self._db.execute('SELECT 1 FROM objects LIMIT 1').fetchone() and \
+                not self._db.execute('SELECT 1 FROM postings LIMIT 1').fetchone():
+            self.reindex()
+
+    @property
+    def server(self):
+        row = self._db.execute(
+            "SELECT value FROM meta WHERE key = 'server'").fetchone()
+        return row[0] if row else None
+
+    def types(self):
+        '''the types that have been synced'''
+        return [row[0] for row in
+                self._db.execute('SELECT type FROM synced ORDER BY type')]
+
+    def has_type(self, item_type):
+        return item_type in self.types()
+
+    def sync(self, connection, types=None, full=False, page_size=1000):
+        '''
+        Bring types (by default those already synced, or DEFAULT_TYPES for
+        a new mirror) up to date and return the number of objects fetched.
+        full drops what is held for each type and copies it afresh.
+        '''
+        server = self.server
+        if server is None:
+            with self._lock:
+                self._db.execute("INSERT INTO meta VALUES ('server', ?)",
+                                 (connection.server,))
+                self._db.commit()
+        elif server != connection.server:
+            logging.warning('Mirror %s is of %s, not syncing it from %s' %
+                            (self.path, server, connection.server))
+            return 0
+        types = types or self.types() or self.DEFAULT_TYPES
+        fetched = 0
+        for item_type in types:
+            row = self._db.execute(
+                'SELECT last_modified FROM synced WHERE type = ?',
+                (item_type,)).fetchone()
+            last_modified = row[0] if row and not full else None
+            if full:
+                self._drop_type(item_type)
+            query = 'search/?type=' + item_type
+            if last_modified:
+                query += '&' + urlencode([(
+                    'advancedQuery',
+                    'date_modified:["%s" TO *]' % last_modified)])
+            batch = []
+            for obj in iter_search(query, connection, page_size=page_size):
+                batch.append(obj)
+                if len(batch) == 500:
+                    last_modified = self._store(batch, last_modified)
+                    fetched += len(batch)
+                    batch = []
+            last_modified = self._store(batch, last_modified)
+            fetched += len(batch)
+            if not full:
+                self._reconcile(connection, item_type, page_size)
+            with self._lock:
+                self._db.execute(
+                    '''INSERT OR REPLACE INTO synced
+                       (type, last_modified, synced_at) VALUES (?, ?, ?)''',
+                    (item_type, last_modified, time.time()))
+                self._db.commit()
+            logging.info('mirror: %s up to date (%s)' %
+                         (item_type, last_modified))
+        return fetched
+
+    def _reconcile(self, connection, item_type, page_size):
+        '''drop the objects of item_type that the portal no longer lists;
+        changed ones are found by date_modified, but not those that left
+        the search results'''
+        listed = set(hit['uuid'] for hit in iter_search(
+            'search/?type=%s&field=uuid' % (item_type), connection,
+            page_size=page_size, frame=None))
+        with self._lock:
+            gone = [row[0] for row in self._db.execute(
+                'SELECT uuid FROM objects WHERE type = ?', (item_type,))
+                if row[0] not in listed]
+            if gone:
+                self._fields = None
+                for table in ('identifiers', 'postings', 'objects'):
+                    self._db.executemany(
+                        'DELETE FROM %s WHERE uuid = ?' % table,
+                        [(uuid,) for uuid in gone])
+                self._db.commit()
+        if gone:
+            logging.info('mirror: dropped %d %s no longer listed' %
+                         (len(gone), item_type))
+
+    def _drop_type(self, item_type):
+        with self._lock:
+            for table in ('identifiers', 'postings'):
+                self._db.execute(
+                    '''DELETE FROM %s WHERE uuid IN
+                       (SELECT uuid FROM objects WHERE type = ?)''' % table,
+                    (item_type,))
+            self._db.execute('DELETE FROM objects WHERE type = ?',
+                             (item_type,))
+            self._db.commit()
+
+    def _store(self, objs, last_modified):
+        '''upsert objs and return the newest date_modified seen'''
+        rows = []
+        names = []
+        postings = []
+        for obj in objs:
+            if 'uuid' not in obj or '@id' not in obj:
+                continue
+            modified = obj.get('date_modified')
+            if modified and (last_modified is None or
+                             modified > last_modified):
+                last_modified = modified
+            rows.append((obj['uuid'], obj['@id'], obj['@type'][0],
+                         obj.get('accession'), obj.get('status'), modified,
+                         zlib.compress(json_dumps(obj).encode('utf-8'))))
+            for name in [obj['@id'], obj['uuid'], obj.get('accession')] + \
+                    (obj.get('aliases') or []):
+                if name:
+                    names.append((name, obj['uuid']))
+            postings.extend((field, value, obj['uuid'])
+                            for field, value in self._terms(obj))
+        with self._lock:
+            self._fields = None
+            for table in ('identifiers', 'postings'):
+                self._db.executemany(
+                    '''DELETE FROM %s WHERE uuid = ?''' % table,
+                    [(row[0],) for row in rows])
+            self._db.executemany(
+                '''INSERT INTO postings (field, value, uuid)
+                   VALUES (?, ?, ?)''', postings)
+            self._db.executemany(
+                '''INSERT OR REPLACE INTO objects
+                   (uuid, at_id, type, accession, status, date_modified, body)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)''', rows)
+            self._db.executemany(
+                '''INSERT OR REPLACE INTO identifiers (identifier, uuid)
+                   VALUES (?, ?)''', names)
+            self._db.commit()
+        return last_modified
+
+    def get(self, obj_id, max_age=None):
+        '''the object named by an @id, uuid, accession or alias, or None;
+        with max_age, None too if its type was synced longer ago'''
+        obj_id = unquote(obj_id)
+        names = [obj_id, ENC_ObjectCache.name(obj_id)]
+        if obj_id.startswith('/') and not obj_id.endswith('/'):
+            names.insert(0, obj_id + '/')
+        sql = '''SELECT body FROM objects JOIN identifiers
+                 ON objects.uuid = identifiers.uuid'''
+        args = []
+        if max_age is not None:
+            sql += ''' JOIN synced ON synced.type = objects.type
+                      AND synced_at >= ?'''
+            args.append(time.time() - max_age)
+        sql += ' WHERE identifier = ?'
+        with self._lock:
+            for name in names:
+                row = self._db.execute(sql, args + [name]).fetchone()
+                if row is not None:
+                    self.hits += 1
+                    return json_loads(zlib.decompress(row[0]))
+        self.misses += 1
+        return None
+
+    def items(self, item_type=None, status=None):
+        '''yield the objects held, optionally of one type and/or status'''
+        sql = 'SELECT body FROM objects'
+        where = []
+        args = []
+        if item_type is not None:
+            where.append('type = ?')
+            args.append(item_type)
+        if status is not None:
+            where.append('status = ?')
+            args.append(status)
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        with self._lock:
+            bodies = [row[0] for row in self._db.execute(sql, args)]
+        for body in bodies:
+            yield json_loads(zlib.decompress(body))
+
+    def summary(self):
+        return 'mirror: %d hits, %d misses (%s)' % (
+            self.hits, self.misses, self.path)
+
+    @classmethod
+    def _terms(cls, value, field=''):
+        '''the (field, value) postings of an object: every scalar under a
+        dotted path, lists contributing one posting per member'''
+        terms = set()
+        if isinstance(value, dict):
+            for key, member in value.items():
+                if key.startswith('@') and key != '@type':
+                    continue
+                terms |= cls._terms(member, field + '.' + key if field
+                                    else key)
+        elif isinstance(value, list):
+            for member in value:
+                terms |= cls._terms(member, field)
+        elif isinstance(value, str):
+            if len(value) <= cls.MAX_INDEXED_LENGTH:
+                terms.add((field, value))
+        elif value is not None:
+            terms.add((field, json.dumps(value)))
+        return terms
+
+    def reindex(self):
+        '''rebuild the postings from the objects held'''
+        with self._lock:
+            self._fields = None
+            self._db.execute('DELETE FROM postings')
+            for uuid, body in self._db.execute(
+                    'SELECT uuid, body FROM objects').fetchall():
+                obj = json_loads(zlib.decompress(body))
+                self._db.executemany(
+                    '''INSERT INTO postings (field, value, uuid)
+                       VALUES (?, ?, ?)''',
+                    [(f, v, uuid) for f, v in self._terms(obj)])
+            self._db.commit()
+
+    def _select(self, sql, values, *args):
+        '''run sql, whose last parameter is an IN list written as "%s",
+        over values in chunks, returning all the rows'''
+        values = list(values)
+        rows = []
+        for start in range(0, len(values), 500):
+            chunk = values[start:start + 500]
+            rows += self._db.execute(
+                sql % ', '.join('?' * len(chunk)),
+                list(args) + chunk).fetchall()
+        return rows
+
+    def _hops(self, path):
+        '''
+        Split a dotted query path into the indexed fields it runs through,
+        taking the longest field that exists at each step, so
+        replicates.library.biosample.organism becomes
+        [replicates, library, biosample, organism] while
+        flowcell_details.lane stays whole.  Every hop but the last must
+        lead to @ids of mirrored objects, or the path cannot be answered.
+        '''
+        if self._fields is None:
+            self._fields = set(row[0] for row in self._db.execute(
+                'SELECT DISTINCT field FROM postings'))
+            self._linked = {}
+        names = path.split('.')
+        hops = []
+        while names:
+            for i in range(len(names), 0, -1):
+                field = '.'.join(names[:i])
+                if field in self._fields:
+                    break
+            else:
+                # not held anywhere, so matches nothing
+                field, i = '.'.join(names), len(names)
+            hops.append(field)
+            names = names[i:]
+        for field in hops[:-1]:
+            if field not in self._linked:
+                self._linked[field] = not self._db.execute(
+                    '''SELECT 1 FROM postings WHERE field = ?
+                       AND NOT EXISTS (SELECT 1 FROM objects
+                                       WHERE at_id = postings.value)
+                       LIMIT 1''', (field,)).fetchone()
+            if not self._linked[field]:
+                raise ValueError('%s links to objects that are not mirrored'
+                                 % (field))
+        return hops
+
+    def _match(self, path, values):
+        '''uuids of the objects whose path has any of values'''
+        hops = self._hops(path)
+        uuids = set(row[0] for row in self._select(
+            'SELECT uuid FROM postings WHERE field = ? AND value IN (%s)',
+            values, hops[-1]))
+        for field in reversed(hops[:-1]):
+            at_ids = [row[0] for row in self._select(
+                'SELECT at_id FROM objects WHERE uuid IN (%s)', uuids)]
+            uuids = set(row[0] for row in self._select(
+                'SELECT uuid FROM postings WHERE field = ? AND value IN (%s)',
+                at_ids, field))
+        return uuids
+
+    def _facet(self, path, uuids):
+        '''OrderedDict of {value: number of uuids having it at path}'''
+        hops = self._hops(path)
+        # which of the hits each object reached so far stands for
+        reached = dict((uuid, set([uuid])) for uuid in uuids)
+        for field in hops[:-1]:
+            step = {}
+            for uuid, target in self._select(
+                    '''SELECT postings.uuid, objects.uuid FROM postings
+                       JOIN objects ON objects.at_id = postings.value
+                       WHERE field = ? AND postings.uuid IN (%s)''',
+                    reached, field):
+                step.setdefault(target, set()).update(reached[uuid])
+            reached = step
+        counts = {}
+        for uuid, value in self._select(
+                '''SELECT uuid, value FROM postings
+                   WHERE field = ? AND uuid IN (%s)''', reached, hops[-1]):
+            counts.setdefault(value, set()).update(reached[uuid])
+        return OrderedDict(sorted(((value, len(hits))
+                                   for value, hits in counts.items()),
+                                  key=lambda term: (-term[1], term[0])))
+
+    def _project(self, value, names):
+        '''value cut down to the dotted path names, following @ids into
+        mirrored objects along the way'''
+        if isinstance(value, list):
+            return [self._project(member, names) for member in value]
+        if names and isinstance(value, str) and value.startswith('/'):
+            value = self.get(value)
+            if value is None:
+                raise ValueError('%s is not mirrored' % (names[0]))
+        if not names or not isinstance(value, dict):
+            return value if not names else None
+        projected = {'@id': value['@id']} if '@id' in value else {}
+        if names[0] in value:
+            projected[names[0]] = self._project(value[names[0]], names[1:])
+        return projected
+
+    def query(self, query, facets=None):
+        '''
+        Answer a search query string the way the portal would, from the
+        index, and return a response shaped like the portal's (@graph,
+        total and facets).
+
+        type= picks the objects (Item for all of them, abstract types
+        included), field=value filters AND across fields and OR across
+        repeats of one field, field!=value excludes, dotted paths follow
+        links between mirrored objects, and field= projects the hits as
+        the portal does.  from and limit page through the hits, in uuid
+        order.  facets lists the fields to count, by default
+        type and status.  Anything that cannot be answered exactly from
+        the mirror (searchTerm, advancedQuery, audits, types or links
+        that are not mirrored) raises ValueError.
+        '''
+        parts = urlsplit(query)
+        if parts.path.strip('/') not in ('search', 'report'):
+            raise ValueError('only searches can be answered offline')
+        types, fields = [], []
+        equal, unequal = OrderedDict(), OrderedDict()
+        limit = 25
+        start = 0
+        for key, value in parse_qsl(parts.query, keep_blank_values=True):
+            if key == 'type':
+                types.append(value)
+            elif key == 'field':
+                if value.startswith('audit'):
+                    raise ValueError('audits cannot be answered offline')
+                fields.append(value)
+            elif key == 'limit':
+                limit = None if value == 'all' else int(value)
+            elif key == 'from':
+                start = int(value)
+            elif key in ('frame', 'format', 'sort'):
+                continue
+            elif key in ('searchTerm', 'advancedQuery') or \
+                    key.startswith('audit'):
+                raise ValueError('%s cannot be answered offline' % (key))
+            elif key.endswith('!'):
+                unequal.setdefault(key[:-1], []).append(value)
+            else:
+                equal.setdefault(key, []).append(value)
+        if not types:
+            raise ValueError('a type is needed to search offline')
+        with self._lock:
+            for field in fields:
+                # projections through links must stay inside the mirror
+                self._hops(field)
+            if 'Item' in types:
+                uuids = set(row[0] for row in
+                            self._db.execute('SELECT uuid FROM objects'))
+            else:
+                held = self.types()
+                for item_type in types:
+                    if item_type not in held and not self._db.execute(
+                            '''SELECT 1 FROM postings WHERE field = '@type'
+                               AND value = ? LIMIT 1''',
+                            (item_type,)).fetchone():
+                        raise ValueError('%s is not mirrored' % (item_type))
+                uuids = self._match('@type', types)
+            for key, values in equal.items():
+                uuids &= self._match(key, values)
+            for key, values in unequal.items():
+                uuids -= self._match(key, values)
+            uuids = sorted(uuids)
+            facet_list = []
+            for field in ['type', 'status'] if facets is None else facets:
+                counts = self._facet('@type' if field == 'type' else field,
+                                     uuids)
+                facet_list.append({'field': field,
+                                   'terms': [{'key': key, 'doc_count': count}
+                                             for key, count in counts.items()]})
+            # from, then limit, over a fixed order so pages do not overlap
+            shown = uuids[start:] if limit is None else \
+                uuids[start:start + limit]
+            bodies = dict(self._select(
+                'SELECT uuid, body FROM objects WHERE uuid IN (%s)', shown))
+        graph = [json_loads(zlib.decompress(bodies[uuid]))
+                 for uuid in shown]
+        if fields:
+            projected = []
+            for obj in graph:
+                record = {'@id': obj['@id'], '@type': obj['@type']}
+                for field in fields:
+                    record = _merge(record, self._project(
+                        obj, field.split('.')))
+                projected.append(record)
+            graph = projected
+        return {'@graph': graph, 'total': len(uuids), 'facets': facet_list}
+
+
+def _merge(a, b):
+    '''deep merge b into a, lists member by member'''
+    if isinstance(a, dict) and isinstance(b, dict):
+        for key, value in b.items():
+            a[key] = _merge(a[key], value) if key in a else value
+        return a
+    if isinstance(a, list) and isinstance(b, list) and len(a) == len(b):
+        return [_merge(x, y) for x, y in zip(a, b)]
+    return b
+
+
+def add_mirror_args(parser):
+    '''add the --mirror/--mirror-max-age/--sync-mirror switches to an
+    argparse parser'''
+    parser.add_argument('--mirror',
+                        default=os.environ.get('ENCODEDCC_MIRROR'),
+                        help="Answer searches from the local mirror \
+                        database at this path.  Default is \
+                        $ENCODEDCC_MIRROR, if set")
+    parser.add_argument('--mirror-max-age',
+                        type=float,
+                        help="Also answer single object GETs from the \
+                        mirror, for types synced at most this many seconds \
+                        ago.  Default is to always GET from the portal")
+    parser.add_argument('--sync-mirror',
+                        default=False,
+                        action='store_true',
+                        help="Bring the mirror up to date before running.  \
+                        Default is False")
+
+
+def configure_mirror(connection, args):
+    '''attach an ENC_Mirror to connection per add_mirror_args(),
+    syncing it first if asked'''
+    if args.mirror:
+        connection.mirror = ENC_Mirror(args.mirror,
+                                       max_age=args.mirror_max_age)
+        if args.sync_mirror:
+            connection.mirror.sync(connection)
+        atexit.register(
+            lambda: print(connection.mirror.summary(), file=sys.stderr))
+    return connection
 
 
 class ENC_Collection(object):
@@ -121,12 +1363,34 @@ class ENC_Collection(object):
         self.server = connection.server
         self.schema = get_ENCODE(schema_uri, connection)
         self.frame = frame
-        search_string = '/search/?format=json&limit=all&\
-                        type=%s&frame=%s' % (self.search_name, frame)
-        collection = get_ENCODE(search_string, connection)
-        self.items = collection['@graph']
+        self.search_string = '/search/?type=%s' % (self.search_name)
+        self._items = None
         self.es_connection = None
 
+    def __iter__(self):
+        '''stream the collection page by page'''
+        if self._items is not None:
+            return iter(self._items)
+        return iter_search(self.search_string, self.connection,
+                           frame=self.frame)
+
+    @property
+    def items(self):
+        '''the whole collection as a list, fetched on first use'''
+        if self._items is None:
+            self._items = list(iter_search(self.search_string,
+                                           self.connection, frame=self.frame))
+        return self._items
+
+    def columns(self, fields):
+        '''fields of the whole collection in an ENC_ColumnStore'''
+        if self._items is not None:
+            store = ENC_ColumnStore(fields)
+            store.extend(self._items)
+            return store
+        return ENC_ColumnStore.from_search(self.search_string,
+                                           self.connection, fields)
+
     def query(self, query_dict, maxhits=10000):
         from pyelasticsearch import ElasticSearch
         if self.es_connection is None:
@@ -147,8 +1411,7 @@ class ENC_Schema(object):
         self.uri = uri
         self.connection = connection
         self.server = connection.server
-        response = get_ENCODE(uri, connection)
-        self.properties = response['properties']
+        self.properties = get_profile(uri, connection)['properties']
 
 
 class ENC_Item(object):
@@ -241,17 +1504,17 @@ class ENC_Item(object):
 
     def new_creds(self):
         if self.type.lower() == 'file':  # There is no id, so this is a new object to POST
-            r = requests.post("%s/%s/upload/" % (self.connection.server, self.id),
-                              auth=self.connection.auth,
-                              headers=self.connection.headers,
-                              data=json.dumps({}))
+            r = self.connection.request(
+                'POST', "%s/%s/upload/" % (self.connection.server, self.id),
+                auth=self.connection.auth,
+                headers=self.connection.headers,
+                data=json.dumps({}))
             return r.json()['@graph'][0]['upload_credentials']
         else:
             return None
 
 
-def get_ENCODE(obj_id, connection, frame="object"):
-    '''GET an ENCODE object as JSON and return as dict'''
+def _get_url(obj_id, connection, frame):
     if frame is None:
         if '?' in obj_id:
             url = urljoin(connection.server, obj_id + '&limit=all')
@@ -261,30 +1524,1595 @@ def get_ENCODE(obj_id, connection, frame="object"):
         url = urljoin(connection.server, obj_id + '&limit=all&frame=' + frame)
     else:
         url = urljoin(connection.server, obj_id + '?limit=all&frame=' + frame)
+    return url
+
+
+def get_ENCODE(obj_id, connection, frame="object"):
+    '''GET an ENCODE object as JSON and return as dict'''
+    url = _get_url(obj_id, connection, frame)
+    mirror = getattr(connection, 'mirror', None)
+    if mirror is not None and mirror.max_age is not None and \
+            frame == 'object' and '?' not in obj_id:
+        obj = mirror.get(obj_id, mirror.max_age)
+        if obj is not None:
+            logging.debug('GET %s (mirror)' % (url))
+            return obj
+    objects = getattr(connection, 'objects', None)
+    if objects is not None:
+        body = objects.get(obj_id, frame)
+        if body is not None:
+            logging.debug('GET %s (cached)' % (url))
+            return json_loads(body)
+    status_code, body, result = _get_json(url, connection)
+    if status_code == 200 and objects is not None:
+        objects.put(obj_id, frame, result, body)
+    return result
+
+
+def _get_json(url, connection):
+    '''GET url exactly as given and return (status code, raw body, JSON)'''
     logging.debug('GET %s' % (url))
-    response = requests.get(url, auth=connection.auth,
-                            headers=connection.headers)
-    logging.debug('GET RESPONSE code %s' % (response.status_code))
+    inflight = getattr(connection, 'inflight', None)
+    if inflight is not None:
+        status_code, body = inflight.do((url, connection.auth[0]),
+                                        _get_body, url, connection)
+    else:
+        status_code, body = _get_body(url, connection)
     try:
-        if response.json():
-            logging.debug('GET RESPONSE JSON: %s' % (json.dumps(
-                response.json(), indent=4, separators=(',', ': '))))
-    except:
-        logging.debug('GET RESPONSE text %s' % (response.text))
-    if not response.status_code == 200:
-        if response.json().get("notification"):
-            logging.warning('%s' % (response.json().get("notification")))
+        result = json_loads(body)
+    except ValueError:
+        logging.debug('GET RESPONSE text %s' % (body.decode('utf-8')))
+        raise
+    if result and _debugging():
+        logging.debug('GET RESPONSE JSON: %s' % (_pretty(result)))
+    if not status_code == 200:
+        if isinstance(result, dict) and result.get("notification"):
+            logging.warning('%s' % (result.get("notification")))
         else:
+            logging.warning('GET failure.  Response code = %s' %
+                            (body.decode('utf-8')))
+    return status_code, body, result
+
+
+class _GraphStream(object):
+    '''
+    Incremental parser for a JSON search response arriving in chunks.
+
+    The top level object is walked key by key; the members of its @graph
+    array are decoded and yielded one at a time as soon as they are
+    complete, everything else is decoded and kept in self.meta.  Only the
+    unparsed tail of the text is buffered, so memory stays proportional to
+    the largest single item rather than the whole response.
+    '''
+    WHITESPACE = ' \t\n\r'
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.meta = {}
+        self.buf = ''
+        self.pos = 0
+        self.done = False
+        self._decoder = json.JSONDecoder()
+        self._text = codecs.getincrementaldecoder('utf-8')()
+
+    def _more(self):
+        if self.done:
+            return False
+        for chunk in self.chunks:
+            if chunk:
+                self.buf = self.buf[self.pos:] + self._text.decode(chunk)
+                self.pos = 0
+                return True
+        self.buf = self.buf[self.pos:] + self._text.decode(b'', final=True)
+        self.pos = 0
+        self.done = True
+        return False
+
+    def _next_char(self):
+        while True:
+            while self.pos < len(self.buf) and \
+                    self.buf[self.pos] in self.WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._more():
+                raise ValueError('unexpected end of JSON response')
+
+    def _expect(self, chars):
+        char = self._next_char()
+        if char not in chars:
+            raise ValueError('expected %r, found %r' % (chars, char))
+        self.pos += 1
+        return char
+
+    def _value(self):
+        self._next_char()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                if not self._more():
+                    raise
+                continue
+            # a number at the end of the buffer may still be incomplete
+            if end == len(self.buf) and not self.done and \
+                    not isinstance(value, (dict, list, str)):
+                if self._more():
+                    continue
+            self.pos = end
+            return value
+
+    def __iter__(self):
+        self._expect('{')
+        if self._next_char() == '}':
+            return
+        while True:
+            key = self._value()
+            self._expect(':')
+            if key == '@graph' and self._next_char() == '[':
+                self.pos += 1
+                if self._next_char() == ']':
+                    self.pos += 1
+                else:
+                    while True:
+                        yield self._value()
+                        if self._expect(',]') == ']':
+                            break
+            else:
+                self.meta[key] = self._value()
+            if self._expect(',}') == '}':
+                return
+
+
+def iter_graph(obj_id, connection, frame='object', chunk_size=64 * 1024):
+    '''
+    GET a search or collection (with limit=all, as get_ENCODE does) and
+    yield the members of its @graph one at a time, parsing them straight off
+    the socket instead of holding the whole body and its decoded tree in
+    memory.  Streamed responses bypass the object and response caches.
+    '''
+    url = _get_url(obj_id, connection, frame)
+    logging.debug('GET %s (streaming)' % (url))
+    response = connection.request('GET', url, auth=connection.auth,
+                                  headers=connection.headers, stream=True)
+    try:
+        if not response.status_code == 200:
             logging.warning('GET failure.  Response code = %s' %
                             (response.text))
-    return response.json()
+            return
+        for item in _GraphStream(response.iter_content(chunk_size)):
+            yield item
+    finally:
+        response.close()
+
+
+def iter_search(query, connection, page_size=1000, frame='object',
+                prefetch=True):
+    '''
+    Yield the results of a search one at a time, fetching page_size hits
+    per request instead of one limit=all response.  Any limit, from or
+    sort already in query is ignored.  With prefetch the next page is
+    downloaded in the background while the current one is consumed.
+
+    Hits come sorted by uuid and each page after the first asks for the
+    uuids past the last one seen (uuid=gt:...), so pages neither overlap
+    nor skip hits and no request goes deeper into the result set than
+    page_size, however large it is.  A page that fails after the first
+    raises ValueError rather than end the results early.
+    '''
+    path, params = _search_params(query)
+    params = [(k, v) for k, v in params if k != 'sort']
+    if frame is not None:
+        params.append(('frame', frame))
+    if any(k == 'field' for k, v in params) and \
+            ('field', 'uuid') not in params:
+        # the uuid of the last hit is needed to ask for the next page
+        params.append(('field', 'uuid'))
+    params.append(('sort', 'uuid'))
+
+    def page_url(after):
+        page = params + [('limit', page_size)]
+        if after is not None:
+            page.append(('uuid', 'gt:' + after))
+        return urljoin(connection.server, path + '?' + urlencode(page))
+
+    def fetch(after):
+        return _get_json(page_url(after), connection)
+
+    executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+    try:
+        after = None
+        pending = None
+        while True:
+            if pending is not None:
+                status_code, body, result = pending.result()
+            else:
+                status_code, body, result = fetch(after)
+            graph = result.get('@graph') if isinstance(result, dict) else None
+            if status_code == 404 and graph == []:
+                # the portal answers 404 when nothing is left
+                return
+            if status_code != 200 or graph is None:
+                if after is None:
+                    logging.warning('Search %s failed, no results' % (query))
+                    return
+                raise ValueError('%s failed after uuid %s (status %s)' %
+                                 (query, after, status_code))
+            uuids = [item.get('uuid') for item in graph]
+            if after is not None and graph and \
+                    not all(uuid and uuid > after for uuid in uuids):
+                raise ValueError('%s: the portal did not page by uuid' %
+                                 (query))
+            more = len(graph) == page_size
+            pending = None
+            if more:
+                after = uuids[-1]
+                if executor is not None:
+                    pending = executor.submit(fetch, after)
+            del body, result
+            for item in graph:
+                yield item
+            if not more:
+                return
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+def _pluck(value, names):
+    '''the value at the dotted path names in value; lists along the way
+    are flattened into one list and embedded objects reduced to their @id'''
+    if isinstance(value, list):
+        found = []
+        for member in value:
+            member = _pluck(member, names)
+            if isinstance(member, list):
+                found.extend(member)
+            elif member is not None:
+                found.append(member)
+        return found
+    if not names:
+        if isinstance(value, dict) and '@id' in value:
+            return value['@id']
+        return value
+    if not isinstance(value, dict):
+        return None
+    return _pluck(value.get(names[0]), names[1:])
+
+
+def search(query, connection, fields=None, frame=None, flat=True,
+           page_size=1000):
+    '''
+    Yield the hits of a search query, asking the portal only for fields
+    (as field= parameters, dotted paths reaching into embedded objects)
+    instead of whole frames.  With flat each hit is an OrderedDict of
+    {field: value}, where a path through a list gives a list of values and
+    an embedded object gives its @id; otherwise the portal's trimmed,
+    nested object is returned.  Without fields this is iter_search.
+    Searches for fields or frame=object are answered from the connection's
+    mirror if it has one that can.
+    '''
+    path, params = _search_params(query)
+    if fields:
+        params = [(k, v) for k, v in params if k != 'field']
+        params += [('field', field) for field in fields]
+        query = path + '?' + urlencode(params)
+    result = None
+    if fields or frame == 'object':
+        result = _offline(path + '?' + urlencode(params + [('limit', 'all')]),
+                          connection)
+    if result is not None:
+        items = result['@graph']
+    else:
+        items = iter_search(query, connection, page_size=page_size,
+                            frame=frame)
+    for item in items:
+        if fields and flat:
+            yield OrderedDict((field, _pluck(item, field.split('.')))
+                              for field in fields)
+        else:
+            yield item
+
+
+class ENC_Query(object):
+    '''
+    A portal URL built from a path and named, repeatable parameters rather
+    than by joining strings:
+
+        ENC_Query('search', type='Experiment',
+                  status=['released', 'in progress'],
+                  **{'assembly!': 'hg19'})
+
+    params may also be a list of (name, value) pairs or a dict, and path a
+    whole URL whose query string is taken apart.  Values that are lists
+    give one parameter each.
+
+    str() and url() give the canonical form: the path with its slashes,
+    the parameters sorted by name and then by value (the portal ORs the
+    values of a repeated name, so their order does not matter, except for
+    field and sort which keep theirs) and each quoted the same way.
+    Queries that mean the same thing therefore give the same URL and
+    key(), however they were written.  Queries are not changed in place;
+    add() and remove() return new ones.
+    '''
+    ORDERED = frozenset(['field', 'sort'])
+    NAME_SAFE = '@.!*'
+    VALUE_SAFE = '@/:*'
+
+    def __init__(self, path='search', params=None, **kwargs):
+        parts = urlsplit(path)
+        pairs = parse_qsl(parts.query, keep_blank_values=True)
+        for given in (params, kwargs):
+            if isinstance(given, dict):
+                given = given.items()
+            for name, value in given or []:
+                if isinstance(value, (list, tuple, set, frozenset)):
+                    pairs.extend((name, member) for member in value)
+                elif value is not None:
+                    pairs.append((name, value))
+        self.path = self._path(parts.path)
+        self.params = self._canonical(pairs)
+
+    @staticmethod
+    def _path(path):
+        path = '/' + path.strip('/')
+        last = path.rsplit('/', 1)[-1]
+        if last and '@@' not in last and '.' not in last:
+            path += '/'
+        return path
+
+    @classmethod
+    def _canonical(cls, pairs):
+        pairs = [(str(name), str(value)) for name, value in pairs]
+        ordered = OrderedDict()
+        for name, value in pairs:
+            ordered.setdefault(name, [])
+            if value not in ordered[name]:
+                ordered[name].append(value)
+        canonical = []
+        for name in sorted(ordered):
+            values = ordered[name]
+            if name not in cls.ORDERED:
+                values = sorted(values)
+            canonical.extend((name, value) for value in values)
+        return tuple(canonical)
+
+    def __str__(self):
+        return self.url()
+
+    def __repr__(self):
+        return 'ENC_Query(%r)' % (self.url())
+
+    def __eq__(self, other):
+        return isinstance(other, ENC_Query) and \
+            (self.path, self.params) == (other.path, other.params)
+
+    def __hash__(self):
+        return hash((self.path, self.params))
+
+    def url(self, server=None):
+        '''the canonical URL, on server if one is given'''
+        query = '&'.join(
+            quote_plus(name, safe=self.NAME_SAFE) + '=' +
+            quote_plus(value, safe=self.VALUE_SAFE)
+            for name, value in self.params)
+        url = self.path + ('?' + query if query else '')
+        if server:
+            url = server.rstrip('/') + url
+        return url
+
+    def key(self):
+        '''a stable, fixed length key for the query'''
+        return hashlib.sha1(self.url().encode('utf-8')).hexdigest()
+
+    def get(self, name):
+        '''the values of a parameter'''
+        return [value for key, value in self.params if key == name]
+
+    def add(self, params=None, **kwargs):
+        '''the query with more parameters'''
+        query = ENC_Query(self.path, params, **kwargs)
+        query.params = self._canonical(self.params + query.params)
+        return query
+
+    def remove(self, *names):
+        '''the query without any values of names'''
+        query = ENC_Query(self.path)
+        query.params = tuple((name, value) for name, value in self.params
+                             if name not in names)
+        return query
+
+    def split(self, max_url_length=4000, server=None, name=None):
+        '''
+        Queries, each with a URL no longer than max_url_length, whose
+        results together are this query's: the values of name (by default
+        the parameter with most values) are shared out between them.  Only
+        a parameter whose values are ORed can be split, so not a negated
+        (name!) one or field.  A query that fits is returned on its own.
+        '''
+        if len(self.url(server)) <= max_url_length:
+            return [self]
+        if name is None:
+            counts = OrderedDict()
+            for key, value in self.params:
+                if not key.endswith('!') and key not in self.ORDERED:
+                    counts[key] = counts.get(key, 0) + 1
+            if not counts:
+                return [self]
+            name = max(counts, key=counts.get)
+        base = self.remove(name)
+        length = len(base.url(server))
+        chunks = []
+        values = []
+        size = length
+        for value in self.get(name):
+            term = len(quote_plus(name, safe=self.NAME_SAFE)) + 2 + \
+                len(quote_plus(value, safe=self.VALUE_SAFE))
+            if values and size + term > max_url_length:
+                chunks.append(base.add([(name, v) for v in values]))
+                values = []
+                size = length
+            values.append(value)
+            size += term
+        if values:
+            chunks.append(base.add([(name, v) for v in values]))
+        return chunks
+
+
+def search_split(query, connection, max_url_length=4000):
+    '''
+    Run a search too long for one URL as several, concurrently, and return
+    one response with the @graph of them all (each object once) and its
+    length as total.  query is an ENC_Query or a URL; see ENC_Query.split.
+    '''
+    if not isinstance(query, ENC_Query):
+        query = ENC_Query(query)
+
+    def fetch(chunk):
+        status_code, body, result = _get_json(chunk.url(connection.server),
+                                              connection)
+        if isinstance(result, dict):
+            return result.get('@graph', [])
+        return []
+
+    graph = OrderedDict()
+    chunks = query.split(max_url_length, connection.server)
+    for hits in run_bulk(fetch, chunks, connection):
+        if isinstance(hits, Exception):
+            logging.warning('%s' % (hits))
+            continue
+        for hit in hits:
+            graph.setdefault(hit.get('@id', len(graph)), hit)
+    return {'@graph': list(graph.values()), 'total': len(graph)}
+
+
+def _search_params(query):
+    '''split a search query into its path and its parameters, less any
+    limit, from or frame'''
+    parts = urlsplit(query)
+    params = [(k, v) for k, v in parse_qsl(parts.query,
+                                           keep_blank_values=True)
+              if k not in ('limit', 'from', 'frame')]
+    path = urlunsplit(('', '', parts.path or '/search/', '', ''))
+    return path, params
+
+
+def _offline(query, connection, facets=None):
+    '''answer a query from the connection's mirror, or return None if there
+    is no mirror or it cannot'''
+    mirror = getattr(connection, 'mirror', None)
+    if mirror is None:
+        return None
+    try:
+        return mirror.query(query, facets=facets)
+    except ValueError as e:
+        logging.debug('%s: %s, asking the portal' % (query, e))
+        return None
+
+
+def _summary(query, connection, fields=None):
+    '''GET query with limit=0: the total and facets but none of the hits'''
+    path, params = _search_params(query)
+    query = path + '?' + urlencode(params + [('limit', 0)])
+    result = _offline(query, connection, fields)
+    if result is not None:
+        return result
+    url = urljoin(connection.server, query)
+    status_code, body, result = _get_json(url, connection)
+    # an empty search comes back as a 404 that still carries its total
+    if isinstance(result, dict) and 'total' in result:
+        return result
+    return None
+
+
+def count(query, connection):
+    '''
+    Return the number of hits for a search query without downloading any
+    of them, or None if the search failed.
+    '''
+    result = _summary(query, connection, fields=[])
+    if result is None:
+        return None
+    return result['total']
+
+
+def facets(query, connection, fields=None):
+    '''
+    Return the facets of a search query, without downloading any hits, as
+    an OrderedDict of {field: OrderedDict of {term: doc_count}}.
+    With fields only those facets are returned; the portal only computes
+    the facets its schemas declare, so a field without one is warned about
+    and left out.
+    '''
+    result = _summary(query, connection, fields)
+    if result is None:
+        return None
+    found = OrderedDict()
+    for facet in result.get('facets', []):
+        found[facet['field']] = OrderedDict(
+            (term['key'], term['doc_count']) for term in facet['terms'])
+    if fields is None:
+        return found
+    missing = [f for f in fields if f not in found]
+    if missing:
+        logging.warning('No facet for %s in %s' % (', '.join(missing), query))
+    return OrderedDict((f, found[f]) for f in fields if f in found)
+
+
+def count_many(queries, connection):
+    '''
+    count() every query in queries concurrently, through run_bulk, and
+    return the totals in the same order.  Each query that failed is logged
+    and then ValueError is raised, so no report is written with holes.
+    '''
+    results = run_bulk(lambda query: count(query, connection), queries,
+                       connection)
+    failed = 0
+    for query, result in zip(queries, results):
+        if isinstance(result, Exception):
+            logging.warning('Count of %s failed: %s', query, result)
+            failed += 1
+        elif result is None:
+            logging.warning('Count of %s failed', query)
+            failed += 1
+    if failed:
+        raise ValueError('%d of %d counts failed' % (failed, len(queries)))
+    return results
+
+
+UUID_RE = re.compile(
+    r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$')
+ACCESSION_RE = re.compile(r'^(ENC|TST)[A-Z]{2}[0-9]{3}[A-Z]{3}$')
+
+
+def _numpy():
+    '''numpy, if it is installed'''
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+class ENC_ColumnStore(object):
+    '''
+    Many items held column by column, for whole-collection reports that
+    would not fit in memory as a list of dicts.
+
+    Each field is a column of the value at that (dotted) path, as search()
+    would give it: embedded objects reduced to their @id, lists kept as
+    tuples.  A column starts dictionary encoded, each row a small integer
+    code into the distinct values seen so far, which suits status, lab,
+    file_format and the like; once it passes max_categories distinct values
+    it becomes a plain list of interned values instead.
+
+    select(), filter(), group_by() and counts() work on the codes, with
+    numpy when it is installed; to_dataframe() needs pandas.
+    '''
+    MAX_CATEGORIES = 4096
+
+    def __init__(self, fields, max_categories=MAX_CATEGORIES):
+        self.fields = list(fields)
+        self.max_categories = max_categories
+        self._rows = 0
+        self._codes = {}  # field: array of codes, -1 for missing
+        self._categories = {}  # field: [value, ...]
+        self._lookup = {}  # field: {value: code}
+        self._values = {}  # field: [value, ...] for high cardinality fields
+        for field in self.fields:
+            self._codes[field] = array('i')
+            self._categories[field] = []
+            self._lookup[field] = {}
+
+    @classmethod
+    def from_search(cls, query, connection, fields, **kwargs):
+        '''a store of fields for the hits of a search query'''
+        store = cls(fields, **kwargs)
+        store.extend(search(query, connection, fields=fields))
+        return store
+
+    def __len__(self):
+        return self._rows
+
+    def __iter__(self):
+        for row in range(self._rows):
+            yield self.row(row)
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    def append(self, item):
+        for field in self.fields:
+            if field in item:
+                value = _pluck(item[field], [])
+            else:
+                value = _pluck(item, field.split('.'))
+            value = self._cell(value)
+            if field in self._values:
+                self._values[field].append(value)
+                continue
+            lookup = self._lookup[field]
+            code = -1 if value is None else lookup.get(value)
+            if code is None:
+                if len(lookup) >= self.max_categories:
+                    self._spill(field)
+                    self._values[field].append(value)
+                    continue
+                code = lookup[value] = len(lookup)
+                self._categories[field].append(value)
+            self._codes[field].append(code)
+        self._rows += 1
+
+    @classmethod
+    def _cell(cls, value):
+        '''value in a hashable, shared form'''
+        if isinstance(value, str):
+            return sys.intern(value)
+        if isinstance(value, list):
+            return tuple(cls._cell(member) for member in value)
+        if isinstance(value, dict):
+            return sys.intern(json.dumps(value, sort_keys=True))
+        return value
+
+    def _spill(self, field):
+        '''turn a dictionary encoded column into a list of values'''
+        categories = self._categories.pop(field)
+        self._values[field] = [None if code < 0 else categories[code]
+                               for code in self._codes.pop(field)]
+        del self._lookup[field]
+
+    def categorical(self, field):
+        '''whether field is still dictionary encoded'''
+        return field in self._codes
+
+    def column(self, field):
+        '''the values of field, one per row'''
+        if field in self._values:
+            return list(self._values[field])
+        categories = self._categories[field]
+        return [None if code < 0 else categories[code]
+                for code in self._codes[field]]
+
+    def row(self, row):
+        '''the row\'th item as an OrderedDict of {field: value}'''
+        record = OrderedDict()
+        for field in self.fields:
+            if field in self._values:
+                record[field] = self._values[field][row]
+            else:
+                code = self._codes[field][row]
+                record[field] = None if code < 0 \
+                    else self._categories[field][code]
+        return record
+
+    def select(self, **conditions):
+        '''
+        Row numbers of the items meeting every condition, given as
+        field=value, field={value, ...} or field=predicate (a callable
+        taking the value).  Fields with dots are passed as **{'a.b': value}.
+        '''
+        np = _numpy()
+        rows = None
+        for field, wanted in conditions.items():
+            if callable(wanted):
+                test = wanted
+            elif isinstance(wanted, (set, frozenset, list)):
+                test = set(wanted).__contains__
+            else:
+                test = lambda value: value == wanted
+            if field in self._values:
+                values = self._values[field]
+                candidates = range(self._rows) if rows is None else rows
+                rows = [row for row in candidates if test(values[row])]
+                continue
+            codes = [code for code, value in
+                     enumerate(self._categories[field]) if test(value)]
+            if test(None):
+                codes.append(-1)
+            if np is not None:
+                column = np.frombuffer(self._codes[field], dtype=np.int32)
+                if rows is not None:
+                    column = column[rows]
+                found = np.flatnonzero(np.isin(column, codes))
+                found = found if rows is None else np.asarray(rows)[found]
+                rows = found.tolist()
+            else:
+                codes = set(codes)
+                column = self._codes[field]
+                candidates = range(self._rows) if rows is None else rows
+                rows = [row for row in candidates if column[row] in codes]
+        return list(range(self._rows)) if rows is None else rows
+
+    def take(self, rows):
+        '''a new store of just the given rows'''
+        store = self.__class__(self.fields, self.max_categories)
+        for field in self.fields:
+            if field in self._values:
+                values = self._values[field]
+                store._values[field] = [values[row] for row in rows]
+                del store._codes[field]
+                del store._categories[field]
+                del store._lookup[field]
+            else:
+                codes = self._codes[field]
+                store._codes[field] = array('i', (codes[row] for row in rows))
+                store._categories[field] = list(self._categories[field])
+                store._lookup[field] = dict(self._lookup[field])
+        store._rows = len(rows)
+        return store
+
+    def filter(self, **conditions):
+        '''a new store of the items meeting conditions, as for select()'''
+        return self.take(self.select(**conditions))
+
+    def group_by(self, field):
+        '''OrderedDict of {value: [row, ...]}, in order of first row'''
+        groups = OrderedDict()
+        for row, value in enumerate(self.column(field)):
+            groups.setdefault(value, []).append(row)
+        return groups
+
+    def counts(self, field):
+        '''OrderedDict of {value: number of rows}, most common first'''
+        np = _numpy()
+        if field in self._codes and np is not None and self._rows:
+            column = np.frombuffer(self._codes[field], dtype=np.int32)
+            tally = np.bincount(column + 1).tolist()
+            values = [None] + self._categories[field]
+            found = [(values[code], n) for code, n in enumerate(tally) if n]
+        else:
+            found = [(value, len(rows))
+                     for value, rows in self.group_by(field).items()]
+        found.sort(key=lambda pair: -pair[1])
+        return OrderedDict(found)
+
+    def to_dataframe(self):
+        '''the store as a pandas DataFrame, encoded columns as categoricals'''
+        import pandas
+        data = OrderedDict()
+        for field in self.fields:
+            categories = self._categories.get(field)
+            if categories is not None and \
+                    not any(isinstance(value, tuple) for value in categories):
+                data[field] = pandas.Categorical.from_codes(
+                    list(self._codes[field]), categories)
+            else:
+                data[field] = self.column(field)
+        return pandas.DataFrame(data, columns=self.fields)
+
+
+def _id_param(identifier):
+    '''the search parameter that finds identifier, or None'''
+    if identifier.startswith('/'):
+        return '@id'
+    if UUID_RE.match(identifier.lower()):
+        return 'uuid'
+    if ACCESSION_RE.match(identifier):
+        return 'accession'
+    if ':' in identifier:
+        return 'aliases'
+    return None
+
+
+def _id_value(param, identifier):
+    if param == '@id' and not identifier.endswith('/'):
+        return identifier + '/'
+    if param == 'uuid':
+        return identifier.lower()
+    return identifier
+
+
+def get_multi(ids, connection, frame='object', fields=None,
+              max_url_length=4000, fallback=True, fallback_frame=None):
+    '''
+    GET many objects at once and return a dict of {id: object}.
+
+    ids may be any mix of @ids, uuids, accessions and aliases; they are
+    sent as @id=, uuid=, accession= or aliases= terms of a few
+    search/?type=Item requests, each kept under max_url_length characters
+    and run concurrently through run_bulk.  With fields only those are
+    asked for and each object is a flat record, as from search().
+    Anything the searches do not turn up (other identifiers, or objects
+    the search hides such as replaced ones) is fetched one by one with
+    get_ENCODE (in fallback_frame if given) unless fallback is False.  Ids
+    still not found are left out of the dict and reported with a warning.
+    '''
+    ids = list(OrderedDict.fromkeys(ids))
+    params = [('type', 'Item')]
+    if fields:
+        # the identifiers come along so hits can be matched to ids
+        params += [('field', field) for field in
+                   ['@id', 'uuid', 'accession', 'aliases'] + list(fields)]
+    elif frame is not None:
+        params.append(('frame', frame))
+    params.append(('limit', 'all'))
+    base = ENC_Query('search', params)
+
+    # different parameters are ANDed by the portal, so each kind of
+    # identifier gets its own searches
+    terms = OrderedDict()
+    for identifier in ids:
+        param = _id_param(identifier)
+        if param is not None:
+            terms.setdefault(param, []).append(_id_value(param, identifier))
+    chunks = []
+    for param, values in terms.items():
+        query = base.add([(param, value) for value in values])
+        chunks.extend(chunk.url(connection.server) for chunk in
+                      query.split(max_url_length, connection.server, param))
+
+    def fetch(url):
+        status_code, body, result = _get_json(url, connection)
+        if isinstance(result, dict):
+            return result.get('@graph', [])
+        return []
+
+    index = {}
+    for hits in run_bulk(fetch, chunks, connection):
+        if isinstance(hits, Exception):
+            continue
+        for hit in hits:
+            for param in ('@id', 'uuid', 'accession'):
+                if hit.get(param):
+                    index[(param, hit[param])] = hit
+            for alias in hit.get('aliases', []):
+                index[('aliases', alias)] = hit
+
+    def project(obj):
+        if fields:
+            return OrderedDict((field, _pluck(obj, field.split('.')))
+                               for field in fields)
+        return obj
+
+    found = OrderedDict()
+    missing = []
+    for identifier in ids:
+        param = _id_param(identifier)
+        hit = index.get((param, _id_value(param, identifier)))
+        if hit is not None:
+            found[identifier] = project(hit)
+        else:
+            missing.append(identifier)
+
+    if missing and fallback:
+        def get_one(identifier):
+            return get_ENCODE(quote(identifier), connection,
+                              frame=fallback_frame or
+                              ('object' if fields else frame))
+        for identifier, obj in zip(missing, run_bulk(get_one, missing,
+                                                     connection)):
+            if isinstance(obj, dict) and \
+                    'Error' not in obj.get('@type', []):
+                found[identifier] = project(obj)
+        missing = [i for i in missing if i not in found]
+        found = OrderedDict((i, found[i]) for i in ids if i in found)
+    if missing:
+        logging.warning('get_multi: %d of %d not found: %s' % (
+            len(missing), len(ids), ', '.join(missing)))
+    return found
+
+
+AUDIT_LEVELS = ('ERROR', 'NOT_COMPLIANT')
+
+
+def get_audits(ids, connection):
+    '''
+    The audits of each of ids, as an OrderedDict of {id: {level: [audit,
+    ...]}}, from a few field-projected searches (see get_multi) rather than
+    a frame=page GET each.  Objects the searches do not find, such as
+    replaced ones, are read from their page frame.
+    '''
+    found = get_multi(ids, connection, fields=['audit'],
+                      fallback_frame='page')
+    return OrderedDict((obj_id, record.get('audit') or {})
+                       for obj_id, record in found.items())
+
+
+def audit_failures(ids, connection, levels=AUDIT_LEVELS):
+    '''
+    OrderedDict of {id: {level: [category, ...]}} for those of ids that
+    have audits at any of levels (by default ERROR and NOT_COMPLIANT).
+    '''
+    failures = OrderedDict()
+    for obj_id, audit in get_audits(ids, connection).items():
+        failed = OrderedDict((level, [a.get('category') for a in audit[level]])
+                             for level in levels if audit.get(level))
+        if failed:
+            failures[obj_id] = failed
+    return failures
+
+
+def _cache_dir(connection):
+    '''where to keep files shared between runs: the connection's response
+    cache directory, else $ENCODEDCC_CACHE_DIR, else None'''
+    cache = getattr(connection, 'cache', None)
+    if cache is not None:
+        return os.path.dirname(cache.path)
+    return os.environ.get('ENCODEDCC_CACHE_DIR')
+
+
+class ENC_Resolver(object):
+    '''
+    Resolve any mix of aliases, uuids, accessions and @ids to the canonical
+    (@id, uuid) of the objects they name, in batches.
+
+    Identifiers not already known are looked up together through
+    get_multi, a few searches for the lot, and every identifier of each
+    object found is remembered in an SQLite index.  The index lives in
+    index_dir (by default the connection's response cache directory or
+    $ENCODEDCC_CACHE_DIR) so it is shared between runs, or in memory if
+    there is neither.  Entries older than max_age seconds are looked up
+    again the next time they are asked for, so the index refreshes
+    incrementally; identifiers that resolve to nothing are not remembered,
+    as the object may yet be created.
+
+    Aliases can be reassigned and accessions move to their replacements,
+    so anything that writes should use max_age=0: every identifier is
+    then looked up afresh, still in a few batched searches, and the index
+    is refreshed for the readers.
+    '''
+    MAX_AGE = 7 * 24 * 60 * 60
+
+    def __init__(self, connection, index_dir=None, max_age=None):
+        self.connection = connection
+        self.max_age = self.MAX_AGE if max_age is None else max_age
+        if index_dir is None:
+            index_dir = _cache_dir(connection)
+        if index_dir:
+            index_dir = os.path.expanduser(index_dir)
+            if not os.path.exists(index_dir):
+                os.makedirs(index_dir)
+            self.path = os.path.join(index_dir, 'identifiers.sqlite')
+        else:
+            self.path = ':memory:'
+        self.hits = 0
+        self.fetched = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute('''CREATE TABLE IF NOT EXISTS identifiers (
+                            server TEXT,
+                            identifier TEXT,
+                            at_id TEXT,
+                            uuid TEXT,
+                            stored REAL,
+                            PRIMARY KEY (server, identifier))''')
+        self._db.commit()
+
+    def resolve(self, identifiers):
+        '''return an OrderedDict of {identifier: (@id, uuid)} for those of
+        identifiers that name an object'''
+        identifiers = list(OrderedDict.fromkeys(i for i in identifiers if i))
+        server = self.connection.server
+        now = time.time()
+        resolved = {}
+        stale = []
+        with self._lock:
+            for identifier in identifiers:
+                row = self._db.execute(
+                    '''SELECT at_id, uuid, stored FROM identifiers
+                       WHERE server = ? AND identifier = ?''',
+                    (server, identifier)).fetchone()
+                if row is not None and now - row[2] < self.max_age:
+                    resolved[identifier] = (row[0], row[1])
+                else:
+                    stale.append(identifier)
+        self.hits += len(identifiers) - len(stale)
+        if stale:
+            self.fetched += len(stale)
+            found = get_multi(stale, self.connection,
+                              fields=['@id', 'uuid', 'accession', 'aliases'])
+            for identifier, record in found.items():
+                resolved[identifier] = self.learn(record, identifier)
+        return OrderedDict((i, resolved[i]) for i in identifiers
+                           if i in resolved)
+
+    def resolve_one(self, identifier):
+        '''the (@id, uuid) of one identifier, or None'''
+        return self.resolve([identifier]).get(identifier)
+
+    def learn(self, obj, *identifiers):
+        '''
+        Remember every identifier of obj (a dict with @id and uuid, like a
+        newly POSTed object), plus any extra identifiers given, and return
+        its (@id, uuid).
+        '''
+        canonical = (obj['@id'], obj['uuid'])
+        names = [obj['@id'], obj['uuid'], obj.get('accession')]
+        names += obj.get('aliases') or []
+        names += identifiers
+        rows = [(self.connection.server, name, canonical[0], canonical[1],
+                 time.time()) for name in names if name]
+        with self._lock:
+            self._db.executemany(
+                '''INSERT OR REPLACE INTO identifiers
+                   (server, identifier, at_id, uuid, stored)
+                   VALUES (?, ?, ?, ?, ?)''', rows)
+            self._db.commit()
+        return canonical
+
+
+def profile_links(profiles):
+    '''
+    Return {type: [property, ...]} of the properties of each type, in a
+    /profiles/ response, that hold @ids of other objects: linkTo and
+    linkFrom properties and arrays of them.
+    '''
+    links = {}
+    for item_type, profile in profiles.items():
+        if not isinstance(profile, dict) or 'properties' not in profile:
+            continue
+        props = []
+        for prop, schema in profile.get('properties', {}).items():
+            items = schema.get('items')
+            if schema.get('linkTo') or schema.get('linkFrom') or \
+                    isinstance(items, dict) and (items.get('linkTo') or
+                                                 items.get('linkFrom')):
+                props.append(prop)
+        links[item_type] = props
+    return links
+
+
+def _fetch_objects(ids, connection):
+    '''{id: frame=object form} for ids, from the connection's mirror and
+    object cache and then one get_multi for the rest'''
+    mirror = getattr(connection, 'mirror', None)
+    objects = getattr(connection, 'objects', None)
+    found = {}
+    missing = []
+    for obj_id in OrderedDict.fromkeys(ids):
+        obj = None
+        if mirror is not None and mirror.max_age is not None:
+            obj = mirror.get(obj_id, mirror.max_age)
+        if obj is None and objects is not None:
+            body = objects.get(obj_id, 'object')
+            if body is not None:
+                obj = json_loads(body)
+        if obj is not None:
+            found[obj_id] = obj
+        else:
+            missing.append(obj_id)
+    if missing:
+        for obj_id, obj in get_multi(missing, connection).items():
+            found[obj_id] = obj
+            if objects is not None:
+                objects.put(obj_id, 'object', obj,
+                            json_dumps(obj).encode('utf-8'))
+    return found
+
+
+class ENC_ProfileMap(object):
+    '''
+    /profiles/ compiled down to what the tools read from it: for each
+    type its schema id, schema_version and properties, each property kept
+    to its type, enum, linkTo/linkFrom and the type and links of its items.
+    profiles is that, in the shape of /profiles/; links is
+    profile_links(profiles).
+
+    load() keeps the compiled map on disk next to the response cache (or in
+    $ENCODEDCC_CACHE_DIR), one file per server, along with the schema
+    versions and the ETag of /profiles/.  Every load asks for /profiles/
+    conditionally, so a schema change is seen by the next run; only when
+    it changed is it downloaded and compiled again.  A positive max_age
+    trusts the stored map that long without asking, for offline use.  Use
+    profile_map() to get one map per server per run.
+    '''
+    MAX_AGE = 0
+    PROPERTY_KEYS = ('type', 'enum', 'linkTo', 'linkFrom', 'items',
+                     'reference', 'url')
+    NESTED_KEYS = ('type', 'linkTo', 'linkFrom')
+
+    def __init__(self, profiles):
+        self.profiles = profiles
+        self.versions = {item_type: profile.get('version')
+                         for item_type, profile in profiles.items()}
+        self.links = profile_links(profiles)
+        self._names = {}
+        for item_type, profile in profiles.items():
+            self._names[item_type.lower()] = item_type
+            name = (profile.get('id') or '').rsplit('/', 1)[-1]
+            self._names[name.replace('.json', '').lower()] = item_type
+
+    @classmethod
+    def compile(cls, profiles):
+        '''an ENC_ProfileMap from a /profiles/ response'''
+        compiled = {}
+        for item_type, profile in profiles.items():
+            if not isinstance(profile, dict) or \
+                    not profile.get('properties'):
+                continue
+            properties = OrderedDict()
+            for prop, schema in profile['properties'].items():
+                kept = {}
+                for key in cls.PROPERTY_KEYS:
+                    if key not in schema:
+                        continue
+                    value = schema[key]
+                    if isinstance(value, dict):
+                        value = {k: value[k] for k in cls.NESTED_KEYS
+                                 if k in value}
+                    kept[key] = value
+                properties[prop] = kept
+            version = profile['properties'].get(
+                'schema_version', {}).get('default')
+            compiled[item_type] = {'id': profile.get('id'),
+                                   'version': version,
+                                   'properties': properties}
+        return cls(compiled)
+
+    @classmethod
+    def load(cls, connection, path=None, max_age=MAX_AGE):
+        '''the map for connection's server, from path if it is fresh'''
+        if path is None:
+            cache_dir = _cache_dir(connection)
+            if cache_dir:
+                path = os.path.join(
+                    os.path.expanduser(cache_dir), 'profiles-%s.json' %
+                    (hashlib.sha1(connection.server.encode('utf-8'))
+                     .hexdigest()[:12]))
+        stored = None
+        if path and os.path.exists(path):
+            with open(path) as f:
+                stored = json_loads(f.read())
+            if stored.get('server') != connection.server:
+                stored = None
+        if stored and max_age and time.time() - stored['stored'] < max_age:
+            return cls(stored['profiles'])
+        url = _get_url('/profiles/', connection, 'object')
+        headers = dict(connection.headers)
+        if stored and stored.get('etag'):
+            headers['if-none-match'] = stored['etag']
+        if stored and stored.get('last_modified'):
+            headers['if-modified-since'] = stored['last_modified']
+        try:
+            response = connection.request('GET', url, auth=connection.auth,
+                                          headers=headers)
+        except requests.exceptions.RequestException as e:
+            if stored is None:
+                raise
+            logging.warning('Using stored profiles, GET failed: %s' % (e))
+            return cls(stored['profiles'])
+        if response.status_code == 304 and stored:
+            profile_map = cls(stored['profiles'])
+        elif response.status_code == 200:
+            profile_map = cls.compile(json_loads(response.content))
+            if stored and stored.get('versions') != profile_map.versions:
+                changed = sorted(
+                    t for t in set(stored.get('versions') or {}) |
+                    set(profile_map.versions)
+                    if (stored.get('versions') or {}).get(t) !=
+                    profile_map.versions.get(t))
+                logging.info('Schema versions changed on %s: %s' %
+                             (connection.server, ', '.join(changed)))
+        elif stored:
+            logging.warning('Using stored profiles, GET failed: %s' %
+                            (response.status_code))
+            return cls(stored['profiles'])
+        else:
+            logging.warning('GET failure.  Response code = %s' %
+                            (response.text))
+            return cls({})
+        if path:
+            profile_map.save(path, connection.server,
+                             response.headers.get('etag'),
+                             response.headers.get('last-modified'))
+        return profile_map
+
+    def save(self, path, server, etag=None, last_modified=None):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        temp = path + '.%d' % (os.getpid())
+        with open(temp, 'w') as f:
+            f.write(json_dumps({'server': server, 'stored': time.time(),
+                                'etag': etag, 'last_modified': last_modified,
+                                'versions': self.versions,
+                                'profiles': self.profiles}))
+        os.replace(temp, path)
+
+    def types(self):
+        return sorted(self.profiles)
+
+    def schema(self, name):
+        '''the compiled profile named by its type (Experiment), its schema
+        file (experiment.json, /profiles/experiment.json) or its
+        collection style name (experiment), or None'''
+        name = name.rstrip('/').rsplit('/', 1)[-1]
+        if name.endswith('.json'):
+            name = name[:-len('.json')]
+        item_type = self._names.get(name.lower()) or \
+            self._names.get(name.replace('-', '_').lower())
+        return self.profiles.get(item_type)
+
+
+_profile_maps = {}
+_profile_maps_lock = threading.Lock()
+
+
+def profile_map(connection):
+    '''the ENC_ProfileMap of connection's server, loaded once per run'''
+    with _profile_maps_lock:
+        if connection.server not in _profile_maps:
+            _profile_maps[connection.server] = ENC_ProfileMap.load(connection)
+        return _profile_maps[connection.server]
+
+
+def get_profile(name, connection):
+    '''the compiled profile of a type (see ENC_ProfileMap.schema), or the
+    full profile from the portal if the map does not have it'''
+    profile = profile_map(connection).schema(name)
+    if profile is None:
+        if not name.startswith('/profiles/'):
+            name = '/profiles/' + name.lstrip('/')
+        profile = get_ENCODE(name, connection)
+    return profile
+
+
+class ENC_Expander(object):
+    '''
+    Build embedded views of objects on the client from their frame=object
+    forms, instead of asking the portal to render frame=embedded or
+    frame=page.
+
+    The @ids held by link properties (found from /profiles/, see
+    profile_links) are replaced by the objects they name, level by level:
+    every link of a level is gathered and the objects are taken from the
+    connection's mirror or object cache where possible, the rest fetched
+    together with get_multi.  depth limits how many levels are expanded;
+    paths instead names the only link paths to follow, e.g.
+    ['files', 'replicates.library.biosample'].
+
+    The result is not the portal's embedded frame: it embeds every link
+    (or those in paths) rather than the type's embedded list, and carries
+    no audits.
+    '''
+    def __init__(self, connection, links=None):
+        self.connection = connection
+        if links is None:
+            links = profile_map(connection).links
+        self.links = links
+
+    def embed(self, obj, depth=1, paths=None):
+        '''the embedded view of obj, an object or an identifier'''
+        return self.embed_many([obj], depth, paths)[0]
+
+    def embed_many(self, objs, depth=1, paths=None):
+        '''embed() each of objs, sharing the fetches between them'''
+        ids = [obj for obj in objs if not isinstance(obj, dict)]
+        fetched = _fetch_objects(ids, self.connection)
+        tops = []
+        for obj in objs:
+            if not isinstance(obj, dict):
+                obj = fetched.get(obj, {})
+            tops.append(dict(obj))
+        if paths:
+            paths = [path.split('.') for path in paths]
+            depth = max(len(path) for path in paths)
+        frontier = [(top, []) for top in tops if '@type' in top]
+        for level in range(depth):
+            slots = []
+            for holder, prefix in frontier:
+                for prop in self.links.get(holder['@type'][0], []):
+                    if prop not in holder:
+                        continue
+                    if paths and not any(path[:len(prefix) + 1] ==
+                                         prefix + [prop] for path in paths):
+                        continue
+                    slots.append((holder, prop, prefix + [prop]))
+            wanted = []
+            for holder, prop, path in slots:
+                value = holder[prop]
+                for member in value if isinstance(value, list) else [value]:
+                    if isinstance(member, str):
+                        wanted.append(member)
+            fetched = _fetch_objects(wanted, self.connection)
+            frontier = []
+            for holder, prop, path in slots:
+                def replace(member):
+                    if isinstance(member, str) and member in fetched:
+                        sub = dict(fetched[member])
+                        frontier.append((sub, path))
+                        return sub
+                    return member
+                value = holder[prop]
+                if isinstance(value, list):
+                    holder[prop] = [replace(member) for member in value]
+                else:
+                    holder[prop] = replace(value)
+        return tops
+
+
+class ENC_Object(object):
+    '''
+    Base of the classes ENC_Model makes for each type in /profiles/.
+
+    Properties are attributes (@id and @type as id and type, other names
+    made into identifiers), held in __slots__.  Reading a link property
+    gives the linked object, fetched on first use together with the same
+    link of every object loaded alongside this one.  Links that cannot be
+    fetched read as None.  obj['property'] and get() give the stored
+    value, with links as @ids.
+    '''
+    __slots__ = ('_model', '_batch')
+    fields = OrderedDict()  # property: attribute
+    links = frozenset()  # properties holding @ids
+
+    def __init__(self, model, batch, obj):
+        self._model = model
+        self._batch = batch
+        for prop, attr in self.fields.items():
+            if prop in obj:
+                setattr(self, '_' + attr, model._wrap(obj[prop], batch))
+        batch.append(self)
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, self.get('@id'))
+
+    def __getitem__(self, prop):
+        if prop not in self.fields:
+            raise KeyError(prop)
+        return _unwrap(getattr(self, '_' + self.fields[prop], None))
+
+    def __contains__(self, prop):
+        return prop in self.fields and \
+            hasattr(self, '_' + self.fields[prop])
+
+    def get(self, prop, default=None):
+        if prop not in self:
+            return default
+        return self[prop]
+
+    def to_dict(self):
+        '''the object as its frame=object dict'''
+        return OrderedDict((prop, self[prop])
+                           for prop in self.fields if prop in self)
+
+    def follow(self, path):
+        '''the value at a dotted path of attributes, or None where the
+        path is broken'''
+        value = self
+        for attr in path.split('.'):
+            value = getattr(value, attr, None)
+            if value is None:
+                return None
+        return value
+
+
+def _unwrap(value):
+    '''value with ENC_Objects in it replaced by their @ids'''
+    if isinstance(value, ENC_Object):
+        return value.get('@id')
+    if isinstance(value, list):
+        return [_unwrap(member) for member in value]
+    return value
+
+
+def _pending(value):
+    '''the @ids in a link value not yet resolved'''
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, list):
+        return [member for member in value if isinstance(member, str)]
+    return []
+
+
+class ENC_Model(object):
+    '''
+    Lightweight classes, subclasses of ENC_Object, for every type in
+    /profiles/, and a shared cache of their instances.
+
+    Objects loaded together (by load(), get_many() or search()) form a
+    batch.  The first time a link is read on one of them the same link is
+    fetched for the whole batch at once, so walking
+    file.replicate.library.biosample.donor.organism.name over the files of
+    an experiment costs one fetch per hop rather than one per file per
+    hop.  Fetches go through the connection's mirror and object cache and
+    then get_multi; an object is made at most once per model.
+    '''
+    def __init__(self, connection, profiles=None):
+        self.connection = connection
+        if profiles is None:
+            profiles = profile_map(connection).profiles
+        links = profile_links(profiles)
+        self.classes = {}
+        for item_type, props in links.items():
+            self.classes[item_type] = self._make_class(
+                item_type, profiles[item_type]['properties'], props)
+        self._objects = {}  # any identifier: ENC_Object
+        self._missing = set()
+
+    @staticmethod
+    def attribute(prop):
+        '''the attribute name for a property'''
+        attr = re.sub(r'\W', '_', prop.lstrip('@'))
+        if attr[:1].isdigit() or keyword.iskeyword(attr) or \
+                hasattr(ENC_Object, attr):
+            attr += '_'
+        return attr
+
+    def _make_class(self, item_type, properties, links):
+        fields = OrderedDict()
+        for prop in ['@id', '@type'] + list(properties):
+            attr = self.attribute(prop)
+            if prop not in fields and attr not in fields.values():
+                fields[prop] = attr
+        namespace = {
+            '__slots__': tuple('_' + attr for attr in fields.values()),
+            'fields': fields,
+            'links': frozenset(links),
+        }
+        for prop, attr in fields.items():
+            namespace[attr] = self._accessor('_' + attr, prop in links)
+        return type(str(item_type), (ENC_Object,), namespace)
+
+    @staticmethod
+    def _accessor(slot, link):
+        def value(obj):
+            return getattr(obj, slot, None)
+
+        def linked(obj):
+            found = getattr(obj, slot, None)
+            if _pending(found):
+                obj._model._resolve(obj, slot)
+                found = getattr(obj, slot, None)
+            if isinstance(found, list):
+                return [member for member in found
+                        if not isinstance(member, str)]
+            return None if isinstance(found, str) else found
+        return property(linked if link else value)
+
+    def _wrap(self, value, batch):
+        '''value with embedded objects made into ENC_Objects'''
+        if isinstance(value, list):
+            return [self._wrap(member, batch) for member in value]
+        if not isinstance(value, dict) or '@id' not in value:
+            return value
+        known = self._objects.get(value['@id'])
+        if known is not None:
+            return known
+        cls = self.classes.get((value.get('@type') or [None])[0])
+        if cls is None:
+            return value
+        obj = cls(self, batch, value)
+        for name in [value['@id'], value.get('uuid'), value.get('accession')]:
+            if name:
+                self._objects[name] = obj
+        return obj
+
+    def load(self, objs):
+        '''ENC_Objects for frame=object dicts, as one batch'''
+        batch = []
+        return [self._wrap(obj, batch) for obj in objs]
+
+    def get_many(self, ids):
+        '''OrderedDict of {identifier: ENC_Object} for those of ids that
+        could be fetched, fetching as one batch those not yet seen'''
+        wanted = [obj_id for obj_id in OrderedDict.fromkeys(ids)
+                  if obj_id not in self._objects and
+                  obj_id not in self._missing]
+        fetched = _fetch_objects(wanted, self.connection) if wanted else {}
+        batch = []
+        for obj_id in wanted:
+            obj = self._wrap(fetched.get(obj_id), batch)
+            if isinstance(obj, ENC_Object):
+                self._objects[obj_id] = obj
+            else:
+                self._missing.add(obj_id)
+        return OrderedDict((obj_id, self._objects[obj_id])
+                           for obj_id in ids if obj_id in self._objects)
+
+    def get(self, obj_id):
+        '''the ENC_Object for an identifier, or None'''
+        return self.get_many([obj_id]).get(obj_id)
+
+    def search(self, query, page_size=1000):
+        '''yield ENC_Objects for the hits of a search, each page a batch'''
+        page = []
+        for hit in iter_search(query, self.connection, page_size=page_size):
+            page.append(hit)
+            if len(page) == page_size:
+                for obj in self.load(page):
+                    yield obj
+                page = []
+        for obj in self.load(page):
+            yield obj
+
+    def _resolve(self, obj, slot):
+        '''fetch the pending links in slot of obj and of every object of
+        its type in its batch'''
+        batch = [other for other in obj._batch if type(other) is type(obj)]
+        ids = []
+        for obj in batch:
+            ids.extend(_pending(getattr(obj, slot, None)))
+        found = self.get_many(ids)
+
+        def resolved(value):
+            if isinstance(value, str):
+                return found.get(value, value)
+            if isinstance(value, list):
+                return [resolved(member) for member in value]
+            return value
+        for obj in batch:
+            if hasattr(obj, slot):
+                setattr(obj, slot, resolved(getattr(obj, slot)))
+
+
+def _get_body(url, connection):
+    '''GET url, through the response cache if the connection has one,
+    and return (status code, raw body)'''
+    cache = getattr(connection, 'cache', None)
+    headers = connection.headers
+    cached = None
+    if cache is not None:
+        cached = cache.lookup(url, connection.auth)
+        if cached is not None:
+            body, fresh, etag, last_modified = cached
+            if fresh:
+                cache.hits += 1
+                return 200, body
+            headers = dict(headers)
+            if etag:
+                headers['if-none-match'] = etag
+            if last_modified:
+                headers['if-modified-since'] = last_modified
+    response = connection.request('GET', url, auth=connection.auth,
+                                  headers=headers)
+    logging.debug('GET RESPONSE code %s' % (response.status_code))
+    if cache is not None:
+        if response.status_code == 304 and cached is not None:
+            cache.revalidated += 1
+            cache.touch(url, connection.auth)
+            return 200, cached[0]
+        cache.misses += 1
+        if response.status_code == 200:
+            cache.store(url, connection.auth, response.content,
+                        response.headers.get('etag'),
+                        response.headers.get('last-modified'))
+    return response.status_code, response.content
+
+
+def _forget_cached(obj_id, connection, result):
+    '''drop a written object from the connection's object and response
+    caches, under obj_id and the identifiers in the write's response'''
+    names = [obj_id]
+    if isinstance(result, dict):
+        for obj in result.get('@graph', [])[:1]:
+            names += [obj.get(name) for name in ('@id', 'uuid', 'accession')]
+            names += obj.get('aliases', [])
+    objects = getattr(connection, 'objects', None)
+    cache = getattr(connection, 'cache', None)
+    for name in filter(None, names):
+        if objects is not None:
+            objects.invalidate(name)
+        if cache is not None:
+            cache.invalidate(urljoin(connection.server, name))
 
 
 def replace_ENCODE(obj_id, connection, put_input):
     '''PUT an existing ENCODE object and return the response JSON
     '''
     if isinstance(put_input, dict):
-        json_payload = json.dumps(put_input)
+        json_payload = json_dumps(put_input)
     elif isinstance(put_input, str):
         json_payload = put_input
     else:
@@ -292,20 +3120,23 @@ def replace_ENCODE(obj_id, connection, put_input):
     url = urljoin(connection.server, obj_id)
     logging.debug('PUT URL : %s' % (url))
     logging.debug('PUT data: %s' % (json_payload))
-    response = requests.put(url, auth=connection.auth, data=json_payload,
-                            headers=connection.headers)
-    logging.debug('PUT RESPONSE: %s' % (json.dumps(response.json(), indent=4,
-                                                   separators=(',', ': '))))
+    response = connection.request('PUT', url, auth=connection.auth,
+                                  data=json_payload,
+                                  headers=connection.headers)
+    result = json_loads(response.content)
+    _forget_cached(obj_id, connection, result)
+    if _debugging():
+        logging.debug('PUT RESPONSE: %s' % (_pretty(result)))
     if not response.status_code == 200:
         logging.warning('PUT failure.  Response = %s' % (response.text))
-    return response.json()
+    return result
 
 
 def patch_ENCODE(obj_id, connection, patch_input):
     '''PATCH an existing ENCODE object and return the response JSON
     '''
     if isinstance(patch_input, dict):
-        json_payload = json.dumps(patch_input)
+        json_payload = json_dumps(patch_input)
     elif isinstance(patch_input, str):
         json_payload = patch_input
     else:
@@ -313,39 +3144,40 @@ def patch_ENCODE(obj_id, connection, patch_input):
     url = urljoin(connection.server, obj_id)
     logging.debug('PATCH URL : %s' % (url))
     logging.debug('PATCH data: %s' % (json_payload))
-    response = requests.patch(url, auth=connection.auth, data=json_payload,
-                              headers=connection.headers)
-    logging.debug('PATCH RESPONSE: %s' % (json.dumps(response.json(), indent=4,
-                                                     separators=(',', ': '))))
+    response = connection.request('PATCH', url, auth=connection.auth,
+                                  data=json_payload,
+                                  headers=connection.headers)
+    result = json_loads(response.content)
+    _forget_cached(obj_id, connection, result)
+    if _debugging():
+        logging.debug('PATCH RESPONSE: %s' % (_pretty(result)))
     if not response.status_code == 200:
         logging.warning('PATCH failure.  Response = %s' % (response.text))
-    return response.json()
+    return result
 
 
 def new_ENCODE(connection, collection_name, post_input):
     '''POST an ENCODE object as JSON and return the response JSON
     '''
     if isinstance(post_input, dict):
-        json_payload = json.dumps(post_input)
+        json_payload = json_dumps(post_input)
     elif isinstance(post_input, str):
         json_payload = post_input
     else:
         print('Datatype to POST is not string or dict.', file=sys.stderr)
     url = urljoin(connection.server, collection_name)
     logging.debug("POST URL : %s" % (url))
-    logging.debug("POST data: %s" % (json.dumps(post_input,
-                                                sort_keys=True, indent=4,
-                                                separators=(',', ': '))))
-    response = requests.post(url, auth=connection.auth,
-                             headers=connection.headers, data=json_payload)
-    logging.debug("POST RESPONSE: %s" % (json.dumps(response.json(),
-                                                    indent=4, separators=(',', ': '))))
+    if _debugging():
+        logging.debug("POST data: %s" % (_pretty(post_input, sort_keys=True)))
+    response = connection.request('POST', url, auth=connection.auth,
+                                  headers=connection.headers,
+                                  data=json_payload)
+    result = json_loads(response.content)
+    if _debugging():
+        logging.debug("POST RESPONSE: %s" % (_pretty(result)))
     if not response.status_code == 201:
         logging.warning('POST failure. Response = %s' % (response.text))
-    logging.debug("Return object: %s" % (json.dumps(response.json(),
-                                                    sort_keys=True, indent=4,
-                                                    separators=(',', ': '))))
-    return response.json()
+    return result
 
 
 def flat_one(JSON_obj):
@@ -403,15 +3235,14 @@ class GetFields():
             temp = []
             if self.args.collection:
                 if self.args.es:
-                    temp = get_ENCODE(
-                        "/search/?type=" + self.args.collection, self.connection).get("@graph", [])
+                    temp = iter_search(
+                        "/search/?type=" + self.args.collection, self.connection)
                 else:
-                    temp = get_ENCODE(
-                        self.args.collection, self.connection, frame=None).get("@graph", [])
+                    temp = iter_graph(
+                        self.args.collection, self.connection, frame=None)
             elif self.args.query:
                 if "search" in self.args.query:
-                    temp = get_ENCODE(
-                        self.args.query, self.connection).get("@graph", [])
+                    temp = iter_search(self.args.query, self.connection)
                 else:
                     temp = [get_ENCODE(self.args.query, self.connection)]
             elif self.args.infile:
@@ -420,28 +3251,27 @@ class GetFields():
                                        for line in open(self.args.infile)]
                 else:
                     self.accessions = self.args.infile.split(",")
-            if any(temp):
-                for obj in temp:
-                    if obj.get("accession"):
-                        self.accessions.append(obj["accession"])
-                    elif obj.get("uuid"):
-                        self.accessions.append(obj["uuid"])
-                    elif obj.get("@id"):
-                        self.accessions.append(obj["@id"])
-                    elif obj.get("aliases"):
-                        self.accessions.append(obj["aliases"][0])
-                    else:
-                        print("ERROR: object has no identifier", file=sys.stderr)
+            for obj in temp:
+                if obj.get("accession"):
+                    self.accessions.append(obj["accession"])
+                elif obj.get("uuid"):
+                    self.accessions.append(obj["uuid"])
+                elif obj.get("@id"):
+                    self.accessions.append(obj["@id"])
+                elif obj.get("aliases"):
+                    self.accessions.append(obj["aliases"][0])
+                else:
+                    print("ERROR: object has no identifier", file=sys.stderr)
             if self.args.allfields:
                 if self.args.collection:
-                    obj = get_ENCODE(
-                        "/profiles/" + self.args.collection + ".json", self.connection).get("properties")
+                    obj = get_profile(
+                        self.args.collection + ".json", self.connection).get("properties")
                 else:
                     obj_type = get_ENCODE(
                         self.accessions[0], self.connection).get("@type")
                     if any(obj_type):
-                        obj = get_ENCODE(
-                            "/profiles/" + obj_type[0] + ".json", self.connection).get("properties")
+                        obj = get_profile(
+                            obj_type[0], self.connection).get("properties")
                 self.fields = list(obj.keys())
                 for key in obj.keys():
                     if obj[key]["type"] == "string":
@@ -617,6 +3447,7 @@ class GetFields():
 
 def patch_set(args, connection):
     import csv
+    from io import StringIO
     data = []
     print("Running on", connection.server)
     if args.update:
@@ -645,25 +3476,41 @@ def patch_set(args, connection):
         for row in reader:
             data.append(row)
     identifiers = ["accession", "uuid", "@id", "alias"]
-    for d in data:
+
+    def row_id(d):
+        # the last identifier column filled in is the one used
+        ids = [d[i] for i in identifiers if d.get(i)]
+        return ids[-1] if ids else None
+
+    # resolve every row's identifier up front in a few batched searches,
+    # fresh from the portal as the index may be out of date
+    resolved = ENC_Resolver(connection, max_age=0).resolve(
+        row_id(d) for d in data)
+
+    def patch_one(d):
+        # collect the report for each object so that rows patched
+        # concurrently don't interleave their output
+        out = StringIO()
         temp_data = d
-        accession = ''
+        accession = row_id(d)
         for i in identifiers:
-            if d.get(i):
-                accession = d[i]
-                temp_data.pop(i)
+            temp_data.pop(i, None)
         if not accession:
             print("No identifier found in headers! Cannot PATCH data")
             sys.exit(1)
-        accession = quote(accession)
-        full_data = get_ENCODE(accession, connection, frame="edit")
+        if accession not in resolved:
+            print("OBJECT:", accession, "was not found, cannot PATCH")
+            return
+        uuid = resolved[accession][1]
+        full_data = get_ENCODE(uuid, connection, frame="edit")
         if args.remove:
             put_dict = full_data
-            print("OBJECT:", accession)
+            print("OBJECT:", accession, file=out)
             for key in temp_data.keys():
                 k = key.split(":")
                 name = k[0]
                 if name not in full_data.keys():
+                    sys.stdout.write(out.getvalue())
                     print("Cannot PATCH '{}' may be a calculated property".format(name))
                     sys.exit(1)
                 if len(k) > 1:
@@ -673,13 +3520,14 @@ def patch_set(args, connection):
                         new_list = [x.replace("'", "").strip() for x in l]
                         patch_list = list(set(old_list) - set(new_list))
                         put_dict[name] = patch_list
-                        print("OLD DATA:", name, old_list)
-                        print("NEW DATA:", name, patch_list)
+                        print("OLD DATA:", name, old_list, file=out)
+                        print("NEW DATA:", name, patch_list, file=out)
                 else:
                     put_dict.pop(name, None)
-                    print("Removing value:", name)
+                    print("Removing value:", name, file=out)
+            sys.stdout.write(out.getvalue())
             if args.update:
-                replace_ENCODE(accession, connection, put_dict)
+                replace_ENCODE(uuid, connection, put_dict)
         else:
             patch_data = {}
             if args.flowcell:
@@ -717,7 +3565,7 @@ def patch_set(args, connection):
                             patch_data[k[0]] = l
                         else:
                             append_list = get_ENCODE(
-                                accession, connection).get(k[0], [])
+                                uuid, connection).get(k[0], [])
                             patch_data[k[0]] = l + append_list
                     elif k[1] == "dict":
                         # this is a dictionary that is being PATCHed
@@ -730,12 +3578,15 @@ def patch_set(args, connection):
                             patch_data[k[0]] = False
                 else:
                     patch_data[k[0]] = temp_data[key]
-            print("OBJECT:", accession)
+            print("OBJECT:", accession, file=out)
             for key in patch_data.keys():
-                print("OLD DATA:", key, full_data.get(key))
-                print("NEW DATA:", key, patch_data[key])
+                print("OLD DATA:", key, full_data.get(key), file=out)
+                print("NEW DATA:", key, patch_data[key], file=out)
+            sys.stdout.write(out.getvalue())
             if args.update:
-                patch_ENCODE(accession, connection, patch_data)
+                patch_ENCODE(uuid, connection, patch_data)
+
+    run_bulk(patch_one, data, connection)
 
 
 def fastq_read(connection, uri=None, filename=None, reads=1):
@@ -750,7 +3601,8 @@ def fastq_read(connection, uri=None, filename=None, reads=1):
     if uri:
         BLOCK_SIZE = 512
         url = urljoin(connection.server, quote(uri))
-        data = requests.get(url, auth=connection.auth, stream=True)
+        data = connection.request('GET', url, auth=connection.auth,
+                                  stream=True)
         block = BytesIO(next(data.iter_content(BLOCK_SIZE * reads)))
         compressed = gzip.GzipFile(None, 'r', fileobj=block)
     elif filename:
@@ -778,14 +3630,16 @@ def post_file(file_metadata, connection, update=False):
     local_path = file_metadata.get('submitted_file_name')
     if not file_metadata.get('md5sum'):
         file_metadata['md5sum'] = md5(local_path)
-    try:
-        logging.debug("POST JSON: %s" % (json.dumps(file_metadata)))
-    except:
-        pass
+    if _debugging():
+        try:
+            logging.debug("POST JSON: %s" % (json_dumps(file_metadata)))
+        except:
+            pass
     if update:
         url = urljoin(connection.server, '/files/')
-        r = requests.post(url, auth=connection.auth,
-                          headers=connection.headers, data=json.dumps(file_metadata))
+        r = connection.request('POST', url, auth=connection.auth,
+                               headers=connection.headers,
+                               data=json_dumps(file_metadata))
         try:
             r.raise_for_status()
         except:
@@ -145,31 +145,23 @@ def main():
         new_json = json.loads(new_json_string)
         if args.debug:
             encodedcc.pprint_ENCODE(new_json)
-        if '@id' in new_json:
-            id_response = encodedcc.get_ENCODE(new_json['@id'], connection)
-            if id_response.get("code") == 404:
-                id_response = {}
-                new_object = True
-        else:
-            id_response = {}
-            new_object = True
-        if 'uuid' in new_json:
-            uuid_response = encodedcc.get_ENCODE(new_json['uuid'], connection)
-            if uuid_response.get("code") == 404:
-                uuid_response = {}
-                new_object = True
-        else:
-            uuid_response = {}
-            new_object = True
-        if 'accession' in new_json:
-            accession_response = encodedcc.get_ENCODE(
-                new_json['accession'], connection)
-            if accession_response.get("code") == 404:
-                accession_response = {}
+        # resolve all the identifiers at once, then GET each object found
+        names = ['@id', 'uuid', 'accession']
+        resolved = encodedcc.ENC_Resolver(connection, max_age=0).resolve(
+            new_json.get(name) for name in names)
+        found = {}
+        responses = {}
+        for name in names:
+            if new_json.get(name) in resolved:
+                uuid = resolved[new_json[name]][1]
+                if uuid not in found:
+                    found[uuid] = encodedcc.get_ENCODE(uuid, connection)
+                responses[name] = found[uuid]
+            else:
                 new_object = True
-        else:
-            accession_response = {}
-            new_object = True
+        id_response = responses.get('@id', {})
+        uuid_response = responses.get('uuid', {})
+        accession_response = responses.get('accession', {})
 
         if new_object:
             print(
@@ -21,8 +21,8 @@ def get_experiment_list(path, search, connection):
         with open(path) as f:
             experiment_list = [line.strip() for line in f.readlines()]
     else:
-        results = encodedcc.get_ENCODE(search, connection, frame='embedded')
-        experiment_list = [r['accession'] for r in results['@graph']]
+        results = encodedcc.search(search, connection, fields=['accession'])
+        experiment_list = [r['accession'] for r in results]
     return experiment_list
 
 
@@ -53,10 +53,12 @@ def get_char_summary(lot, connection):
 
 
 def get_antibody_approval(antibody, target, connection):
-    search = encodedcc.get_ENCODE(
-        'search/?searchTerm=' + antibody + '&type=antibody_approval', connection, frame='embedded')
-    for approval in search['@graph']:
-        if approval['target']['name'] == target:
+    query = encodedcc.ENC_Query('search', searchTerm=antibody,
+                                type='antibody_approval')
+    search = encodedcc.search(query.url(), connection,
+                              fields=['target.name', 'status'])
+    for approval in search:
+        if approval['target.name'] == target:
             return approval['status']
     return "UNKNOWN"
 
@@ -246,6 +248,7 @@ def main():
                         default=False,
                         action='store_true',
                         help="Print a library based report based on standards. Default off")
+    encodedcc.add_cache_args(parser)
     parser.add_argument('--encode2',
                         default=False,
                         action='store_true',
@@ -254,6 +257,7 @@ def main():
 
     key = encodedcc.ENC_Key(args.keyfile, args.key)
     connection = encodedcc.ENC_Connection(key)
+    encodedcc.configure_cache(connection, args)
 
     '''Adjust the checked list by the datatype'''
     if args.datatype != 'CHIP':
@@ -2,21 +2,20 @@ import encodedcc
 
 
 def files(objList, fileCheckedItems, connection):
+    # links are read as attributes and fetched for all the files of an
+    # experiment at once, one batched fetch per hop
+    model = encodedcc.ENC_Model(connection)
     for obj in objList:
-        exp = encodedcc.get_ENCODE(obj, connection)
-        exps = encodedcc.get_ENCODE(
-            '/search/?type=File&dataset=/experiments/{}/'.format(obj), connection)
-        expfiles = [e['uuid'] for e in exps['@graph']]
-        for f in expfiles:
+        exp = model.get(obj)
+        file_objs = list(model.search(
+            '/search/?type=File&dataset=/experiments/{}/'.format(obj)))
+        for file in file_objs:
             fileob = {}
-            file = encodedcc.get_ENCODE(f, connection)
             for field in fileCheckedItems:
                 fileob[field] = file.get(field)
-            fileob["submitted_by"] = encodedcc.get_ENCODE(
-                file["submitted_by"], connection)["title"]
-            fileob["experiment"] = exp["accession"]
-            fileob["experiment-lab"] = encodedcc.get_ENCODE(
-                exp["lab"], connection)["name"]
+            fileob["submitted_by"] = file.submitted_by.title
+            fileob["experiment"] = exp.accession
+            fileob["experiment-lab"] = exp.lab.name
             fileob["biosample"] = exp.get("biosample_term_name", "")
             fileob["flowcell"] = []
             fileob["lane"] = []
@@ -27,49 +26,30 @@ def files(objList, fileCheckedItems, connection):
             if file.get("file_format", "") == "bam":
                 for q in file.get("quality_metrics", []):
                     if "star-quality-metrics" in q:
-                        star = encodedcc.get_ENCODE(q, connection)
+                        star = model.get(q)
                         fileob["Uniquely mapped reads number"] = star["Uniquely mapped reads number"]
-            for fcd in file["flowcell_details"]:
+            for fcd in file.get("flowcell_details", []):
                 fileob["flowcell"].append(fcd.get("flowcell", ""))
                 fileob["lane"].append(fcd.get("lane"))
-            try:
-                fileob["platform"] = encodedcc.get_ENCODE(
-                    fileob["platform"], connection)["title"]
-            except:
-                fileob["platform"] = None
-            if "replicates" in exp:
-                temp_rep = encodedcc.get_ENCODE(
-                    exp["replicates"][0], connection)
-                if "library" in temp_rep:
-                    temp_lib = encodedcc.get_ENCODE(
-                        temp_rep["library"], connection)
-                    if "biosample" in temp_lib:
-                        temp_bio = encodedcc.get_ENCODE(
-                            temp_lib["biosample"], connection)
-                        if "donor" in temp_bio:
-                            temp_don = encodedcc.get_ENCODE(
-                                temp_bio["donor"], connection)
-                            if "organism" in temp_don:
-                                temp_org = encodedcc.get_ENCODE(
-                                    temp_don["organism"], connection)
-                                fileob["species"] = temp_org["name"]
+            platform = file.platform
+            fileob["platform"] = platform.title if platform else None
+            if exp.replicates:
+                species = exp.replicates[0].follow(
+                    "library.biosample.donor.organism.name")
+                if species is not None:
+                    fileob["species"] = species
             else:
                 fileob["species"] = ""
-            if "replicate" in file:
-                rep = encodedcc.get_ENCODE(file["replicate"], connection)
-                fileob["biological_replicate"] = rep["biological_replicate_number"]
-                fileob["technical_replicate"] = rep["technical_replicate_number"]
-                fileob["replicate_id"] = rep["uuid"]
-                if "library" in rep:
-                    library = encodedcc.get_ENCODE(rep["library"], connection)
-                    try:
-                        fileob["library_aliases"] = library["aliases"]
-                    except:
-                        fileob["library_aliases"] = ""
-                    if "biosample" in library:
-                        bio = encodedcc.get_ENCODE(
-                            library["biosample"], connection)
-                        fileob["biosample_aliases"] = bio["aliases"]
+            rep = file.replicate
+            if rep is not None:
+                fileob["biological_replicate"] = rep.biological_replicate_number
+                fileob["technical_replicate"] = rep.technical_replicate_number
+                fileob["replicate_id"] = rep.uuid
+                library = rep.library
+                if library is not None:
+                    fileob["library_aliases"] = library.get("aliases", "")
+                    if library.biosample is not None:
+                        fileob["biosample_aliases"] = library.biosample.aliases
             if any(exp.get("aliases", [])):
                 fileob["alias"] = exp["aliases"][0]
             else:
@@ -40,3 +40,798 @@ def test_get():
     connection = encodedcc.ENC_Connection(key)
     result = encodedcc.get_ENCODE("/profiles/", connection)
     assert(type(result) is dict)
+
+
+@pytest.mark.connection
+def test_connection_session_per_thread():
+    import threading
+    key = encodedcc.ENC_Key(keypairs, "default")
+    connection = encodedcc.ENC_Connection(key, pool_size=4)
+    sessions = []
+    worker = threading.Thread(target=lambda: sessions.append(connection.session))
+    worker.start()
+    worker.join()
+    assert(connection.session is connection.session)
+    assert(sessions[0] is not connection.session)
+    assert(sessions[0].get_adapter(key.server) is connection.adapter)
+
+
+def test_response_cache(tmp_path):
+    cache = encodedcc.ENC_ResponseCache(str(tmp_path))
+    auth = ("keystring", "secretstring")
+    url = "https://test.encodedcc.org/search/?type=File&frame=object"
+    cache.store(url, auth, b'{"@graph": []}', etag='"abc"')
+    body, fresh, etag, last_modified = cache.lookup(
+        "https://test.encodedcc.org/search/?frame=object&type=File", auth)
+    assert(body == b'{"@graph": []}')
+    assert(fresh)
+    assert(etag == '"abc"')
+    assert(cache.lookup(url, ("otherkey", "secret")) is None)
+    assert(cache.ttl_for("https://test.encodedcc.org/profiles/") == 24 * 60 * 60)
+
+
+def test_read_after_write(monkeypatch, tmp_path):
+    import json
+    key = encodedcc.ENC_Key(keypairs, "default")
+    connection = encodedcc.ENC_Connection(key)
+    connection.cache = encodedcc.ENC_ResponseCache(str(tmp_path))
+    stored = {"@id": "/files/ENCFF000AAA/", "accession": "ENCFF000AAA",
+              "uuid": "0a1b2c3d-0000-4000-8000-00000000abcd",
+              "status": "in progress"}
+
+    class Response(object):
+        def __init__(self, obj):
+            self.status_code = 200
+            self.content = json.dumps(obj).encode("utf-8")
+            self.text = self.content.decode("utf-8")
+            self.headers = {}
+
+    def fake_request(method, url, **kwargs):
+        if method == "PATCH":
+            stored.update(json.loads(kwargs["data"]))
+            return Response({"status": "success", "@graph": [stored]})
+        return Response(stored)
+
+    monkeypatch.setattr(connection, "request", fake_request)
+    for frame in ("object", "embedded"):
+        encodedcc.get_ENCODE("ENCFF000AAA", connection, frame)
+    encodedcc.patch_ENCODE("/files/ENCFF000AAA/", connection,
+                           {"status": "released"})
+    for frame in ("object", "embedded"):
+        obj = encodedcc.get_ENCODE("ENCFF000AAA", connection, frame)
+        assert(obj["status"] == "released")
+
+
+def test_object_cache():
+    cache = encodedcc.ENC_ObjectCache(max_entries=2)
+    uuid = "0a1b2c3d-0000-4000-8000-00000000abcd"
+    obj = {"@id": "/files/ENCFF000AAA/", "uuid": uuid,
+           "accession": "ENCFF000AAA", "aliases": ["john-stam:sample1"]}
+    cache.put("ENCFF000AAA", "object", obj, b"{}")
+    assert(cache.get("/files/ENCFF000AAA/", "object") == b"{}")
+    assert(cache.get(uuid, "object") == b"{}")
+    assert(cache.get("/files/%s/" % uuid, "object") == b"{}")
+    assert(cache.get(uuid, "embedded") is None)
+    # accessions, aliases and other collections always go to the portal
+    assert(cache.get("ENCFF000AAA", "object") is None)
+    assert(cache.get("john-stam:sample1", "object") is None)
+    assert(cache.get("bradley-bernstein:sample1", "object") is None)
+    assert(cache.get("/biosamples/ENCFF000AAA/", "object") is None)
+    assert(cache.get("/files/ENCFF000AAA/?datastore=database",
+                     "object") is None)
+    # but any of them drops the object after a PATCH
+    cache.invalidate("john-stam:sample1")
+    assert(cache.get("/files/ENCFF000AAA/", "object") is None)
+    for i in range(3):
+        cache.put("/labs/lab%d/" % i, "object",
+                  {"@id": "/labs/lab%d/" % i, "uuid": "u%d" % i}, b"{}")
+    assert(cache.stats()["entries"] == 2)
+    assert(cache.stats()["evictions"] == 1)
+    assert(cache.get("u0", "object") is None)
+    assert(cache.get("u2", "object") == b"{}")
+
+
+def test_single_flight():
+    import threading
+    import time
+    flight = encodedcc.ENC_SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def slow_get():
+        calls.append(1)
+        release.wait(5)
+        return "body"
+
+    results = []
+    workers = [threading.Thread(
+        target=lambda: results.append(flight.do("url", slow_get)))
+        for i in range(5)]
+    for w in workers:
+        w.start()
+    while flight.leaders + flight.saved < 5:
+        time.sleep(0.01)
+    release.set()
+    for w in workers:
+        w.join()
+    assert(results == ["body"] * 5)
+    assert(len(calls) == 1)
+    assert(flight.saved == 4)
+
+
+def test_retry_policy():
+    import requests
+    import email.utils
+    import time
+
+    class Response(object):
+        def __init__(self, status_code, headers=None):
+            self.status_code = status_code
+            self.headers = headers or {}
+
+    policy = encodedcc.ENC_RetryPolicy(max_retries=3, idempotent_patch=False)
+    assert(policy.should_retry("GET", 0, response=Response(502)))
+    assert(not policy.should_retry("GET", 3, response=Response(502)))
+    assert(not policy.should_retry("GET", 0, response=Response(404)))
+    assert(policy.should_retry("POST", 0, response=Response(429)))
+    assert(not policy.should_retry("POST", 0, response=Response(500)))
+    assert(not policy.should_retry("PATCH", 0, response=Response(502)))
+    assert(policy.should_retry(
+        "POST", 0, error=requests.exceptions.ConnectTimeout()))
+    assert(not policy.should_retry(
+        "PATCH", 0, error=requests.exceptions.ReadTimeout()))
+    assert(policy.delay(0, Response(503, {"retry-after": "7"})) == 7)
+    assert(0 <= policy.delay(
+        0, Response(503, {"retry-after": "soon"})) <= 0.5)
+    # a -0000 zone parses to a naive datetime, taken as UTC
+    later = email.utils.formatdate(time.time() + 30)
+    assert(later.endswith("-0000"))
+    assert(25 <= policy.delay(0, Response(503, {"retry-after": later})) <= 30)
+    assert(0 <= policy.delay(2) <= 2)
+
+
+def test_adaptive_concurrency():
+    controller = encodedcc.ENC_AdaptiveConcurrency(
+        initial=4, maximum=6, target_latency=1.0, window=5)
+    for i in range(5):
+        controller.record(0.1)
+    assert(controller.limit == 5)
+    for i in range(5):
+        controller.record(3.0)
+    assert(controller.limit == 5)
+    controller.record(0.1, error=True)
+    assert(controller.limit == 2)
+    controller.record(0.1, error=True)
+    assert(controller.limit == 2)
+    results = encodedcc.run_bulk(lambda x: 10 // x, [1, 0, 5],
+                                 controller=controller)
+    assert(results[0] == 10 and results[2] == 2)
+    assert(isinstance(results[1], ZeroDivisionError))
+    # a nested run_bulk gives the connection back its outer controller
+    key = encodedcc.ENC_Key(keypairs, "default")
+    connection = encodedcc.ENC_Connection(key, pool_size=3)
+
+    def outer(x):
+        assert(connection.controller is not None)
+        encodedcc.run_bulk(lambda y: y, [x], connection)
+        return connection.controller
+
+    outer_controller = encodedcc.ENC_AdaptiveConcurrency(maximum=8)
+    results = encodedcc.run_bulk(outer, [1, 2], connection, outer_controller)
+    assert(results == [outer_controller, outer_controller])
+    assert(connection.controller is None)
+
+
+def test_json_backend():
+    default = encodedcc.json_backend
+    try:
+        assert(encodedcc.set_json_backend("json") == "json")
+        assert(encodedcc.set_json_backend("nosuchjson") in encodedcc.JSON_BACKENDS)
+        for backend in encodedcc.JSON_BACKENDS:
+            if encodedcc.set_json_backend(backend) != backend:
+                continue
+            assert(encodedcc.json_loads(b'{"n": 1, "t": "\xc3\xa9"}') == {"n": 1, "t": "é"})
+            assert(encodedcc.json_loads('[%d]' % 2 ** 70) == [2 ** 70])
+            assert(encodedcc.json_loads(encodedcc.json_dumps({"a": [1, "/b/"]})) == {"a": [1, "/b/"]})
+    finally:
+        encodedcc.set_json_backend(default)
+
+
+def test_iter_search(monkeypatch):
+    from urllib.parse import urlsplit, parse_qs
+    data = [{"@id": "/files/ENCFF%03d/" % i, "uuid": "%04x" % (i * 7 % 25)}
+            for i in range(25)]
+    urls = []
+    fail_after = []
+
+    def fake_get_json(url, connection):
+        urls.append(url)
+        query = parse_qs(urlsplit(url).query)
+        assert("from" not in query and query["sort"] == ["uuid"])
+        after = query.get("uuid", ["gt:"])[0][len("gt:"):]
+        if fail_after and after == fail_after[0]:
+            return 500, b"", {"status": "error"}
+        hits = sorted((o for o in data if o["uuid"] > after), key=lambda o: o["uuid"])
+        if not hits:
+            return 404, b"", {"@graph": [], "total": 0}
+        return 200, b"", {"@graph": hits[:int(query["limit"][0])], "total": len(hits)}
+
+    monkeypatch.setattr(encodedcc, "_get_json", fake_get_json)
+    key = encodedcc.ENC_Key(keypairs, "default")
+    connection = encodedcc.ENC_Connection(key)
+    results = list(encodedcc.iter_search("/search/?type=File&limit=all&sort=accession",
+                                         connection, page_size=10))
+    assert(results == sorted(data, key=lambda o: o["uuid"]))
+    assert(len(urls) == 3)
+    assert("limit=all" not in urls[0] and "accession" not in urls[0])
+    # a last page that comes back exactly full ends on the portal's 404
+    del urls[:]
+    assert(len(list(encodedcc.iter_search("/search/?type=File", connection,
+                                          page_size=5))) == 25)
+    assert(len(urls) == 6)
+    # a page failing part way raises instead of cutting the results short
+    fail_after.append("0009")
+    with pytest.raises(ValueError):
+        list(encodedcc.iter_search("/search/?type=File", connection, page_size=10))
+
+
+def test_graph_stream():
+    import json
+    response = {"@id": "/search/", "facets": [{"field": "type"}],
+                "@graph": [{"@id": "/files/ENCFF%03d/" % i, "title": "é" * i}
+                           for i in range(50)],
+                "total": 50}
+    raw = json.dumps(response).encode("utf-8")
+    chunks = (raw[i:i + 7] for i in range(0, len(raw), 7))
+    stream = encodedcc._GraphStream(chunks)
+    assert(list(stream) == response["@graph"])
+    assert(stream.meta["total"] == 50)
+    assert(stream.meta["facets"] == response["facets"])
+
+
+def test_query():
+    query = encodedcc.ENC_Query("search", {"type": "Experiment", "assembly!": "hg19"},
+                                status=["released", "in progress"],
+                                field=["accession", "@id"])
+    assert(query.url() == "/search/?assembly!=hg19&field=accession&field=@id"
+                          "&status=in+progress&status=released&type=Experiment")
+    same = encodedcc.ENC_Query("/search?type=Experiment&status=released&field=accession"
+                               "&field=@id&status=in%20progress&assembly!=hg19&status=released")
+    assert(same == query and same.key() == query.key())
+    assert(query.add(status="archived").get("status") == ["archived", "in progress", "released"])
+    assert(query.remove("field", "assembly!").url("https://x.org/") ==
+           "https://x.org/search/?status=in+progress&status=released&type=Experiment")
+    assert(encodedcc.ENC_Query("files/ENCFF000AAA/@@download").url() ==
+           "/files/ENCFF000AAA/@@download")
+    many = query.add(accession=["ENCSR%03dAAA" % i for i in range(100)])
+    chunks = many.split(max_url_length=300, server="https://x.org")
+    assert(len(chunks) > 1)
+    assert(all(len(c.url("https://x.org")) <= 300 for c in chunks))
+    assert(sum((c.get("accession") for c in chunks), []) == many.get("accession"))
+    assert(all(c.get("status") == ["in progress", "released"] for c in chunks))
+
+
+def test_count_and_facets(monkeypatch):
+    from urllib.parse import urlsplit, parse_qs
+
+    def fake_get_json(url, connection):
+        query = parse_qs(urlsplit(url).query)
+        assert(query["limit"] == ["0"])
+        if query.get("type") == ["Broken"]:
+            return 500, b"", None
+        if query.get("status") == ["deleted"]:
+            return 404, b"", {"@graph": [], "total": 0,
+                              "notification": "No results found"}
+        facets = [{"field": "status",
+                   "terms": [{"key": "released", "doc_count": 7},
+                             {"key": "submitted", "doc_count": 3}]}]
+        return 200, b"", {"@graph": [], "total": 10, "facets": facets}
+
+    monkeypatch.setattr(encodedcc, "_get_json", fake_get_json)
+    key = encodedcc.ENC_Key(keypairs, "default")
+    connection = encodedcc.ENC_Connection(key)
+    assert(encodedcc.count("search/?type=File&limit=all", connection) == 10)
+    assert(encodedcc.count_many(["search/?type=File&status=deleted",
+                                 "search/?type=File"], connection) == [0, 10])
+    with pytest.raises(ValueError):
+        encodedcc.count_many(["search/?type=File", "search/?type=Broken"],
+                             connection)
+    result = encodedcc.facets("search/?type=File", connection,
+                              ["status", "lab.title"])
+    assert(result == {"status": {"released": 7, "submitted": 3}})
+
+
+def test_search_fields(monkeypatch):
+    from urllib.parse import urlsplit, parse_qs
+    hit = {"@id": "/experiments/ENCSR000AAA/", "accession": "ENCSR000AAA",
+           "lab": {"@id": "/labs/j-michael-cherry/", "name": "j-michael-cherry"},
+           "files": [{"status": "released", "replicate": {"biological_replicate_number": 1}},
+                     {"status": "deleted"}]}
+    urls = []
+
+    def fake_get_json(url, connection):
+        urls.append(url)
+        return 200, b"", {"@graph": [hit], "total": 1}
+
+    monkeypatch.setattr(encodedcc, "_get_json", fake_get_json)
+    key = encodedcc.ENC_Key(keypairs, "default")
+    connection = encodedcc.ENC_Connection(key)
+    fields = ["accession", "lab", "files.status",
+              "files.replicate.biological_replicate_number", "description"]
+    records = list(encodedcc.search("search/?type=Experiment&frame=page",
+                                    connection, fields=fields))
+    query = parse_qs(urlsplit(urls[0]).query)
+    # uuid comes along to page by
+    assert(query["field"] == fields + ["uuid"])
+    assert("frame" not in query)
+    assert(records == [{"accession": "ENCSR000AAA",
+                        "lab": "/labs/j-michael-cherry/",
+                        "files.status": ["released", "deleted"],
+                        "files.replicate.biological_replicate_number": [1],
+                        "description": None}])
+
+
+def test_get_multi(monkeypatch):
+    from urllib.parse import urlsplit, parse_qs, unquote
+    objs = [{"@id": "/files/ENCFF%03dAAA/" % i, "accession": "ENCFF%03dAAA" % i,
+             "uuid": "00000000-0000-0000-0000-%012d" % i,
+             "aliases": ["lab:file-%d" % i]} for i in range(60)]
+    urls = []
+
+    def fake_get_json(url, connection):
+        urls.append(url)
+        query = parse_qs(urlsplit(url).query)
+        wanted = set(query.get("accession", []) + query.get("@id", []) +
+                     query.get("uuid", []) + query.get("aliases", []))
+        graph = [o for o in objs if wanted & {o["@id"], o["accession"],
+                                               o["uuid"], o["aliases"][0]}]
+        return 200, b"", {"@graph": graph, "total": len(graph)}
+
+    def fake_get_ENCODE(obj_id, connection, frame="object"):
+        obj_id = unquote(obj_id)
+        if obj_id == "ENCFF999ZZZ":
+            return {"@type": ["HTTPNotFound", "Error"], "status": "error"}
+        return {"@id": "/files/%s/" % obj_id, "accession": obj_id}
+
+    monkeypatch.setattr(encodedcc, "_get_json", fake_get_json)
+    monkeypatch.setattr(encodedcc, "get_ENCODE", fake_get_ENCODE)
+    key = encodedcc.ENC_Key(keypairs, "default")
+    connection = encodedcc.ENC_Connection(key)
+    ids = [o["accession"] for o in objs[:40]] + ["/files/ENCFF040AAA",
+           objs[41]["uuid"], "lab:file-42", "md5:abc", "ENCFF999ZZZ"]
+    found = encodedcc.get_multi(ids, connection, max_url_length=300)
+    assert(len(urls) > 1)
+    assert(all(len(url) <= 300 for url in urls))
+    assert(list(found) == ids[:-1])
+    assert(found["/files/ENCFF040AAA"] == objs[40])
+    assert(found["lab:file-42"] == objs[42])
+    assert(found["md5:abc"]["accession"] == "md5:abc")
+    records = encodedcc.get_multi(ids[:2], connection, fields=["accession"])
+    assert(records == {ids[0]: {"accession": ids[0]},
+                       ids[1]: {"accession": ids[1]}})
+
+
+def test_column_store():
+    store = encodedcc.ENC_ColumnStore(
+        ["accession", "status", "lab.name", "biological_replicates", "md5sum"],
+        max_categories=3)
+    store.extend({"accession": "ENCFF%03dAAA" % i,
+                  "status": "released" if i % 3 else "revoked",
+                  "lab": {"@id": "/labs/l%d/" % (i % 2), "name": "l%d" % (i % 2)},
+                  "biological_replicates": [1 + i % 2],
+                  "md5sum": "abc" if i < 2 else None}
+                 for i in range(6))
+    store.append({"accession": "ENCFF999AAA", "lab.name": "l0", "status": "released"})
+    assert(len(store) == 7)
+    assert(store.categorical("status") and not store.categorical("accession"))
+    assert(store.row(6) == {"accession": "ENCFF999AAA", "status": "released",
+                            "lab.name": "l0", "biological_replicates": None,
+                            "md5sum": None})
+    assert(store.select(status="revoked") == [0, 3])
+    assert(store.select(status={"released"}, **{"lab.name": "l0"}) == [2, 4, 6])
+    assert(store.select(accession=lambda a: a.startswith("ENCFF00"), md5sum=None) == [2, 3, 4, 5])
+    released = store.filter(status="released")
+    assert(released.column("accession") == ["ENCFF001AAA", "ENCFF002AAA", "ENCFF004AAA",
+                                             "ENCFF005AAA", "ENCFF999AAA"])
+    assert(released.group_by("biological_replicates") == {(2,): [0, 3], (1,): [1, 2], None: [4]})
+    assert(store.counts("status") == {"released": 5, "revoked": 2})
+
+
+def test_audit_failures(monkeypatch):
+    calls = []
+
+    def fake_get_multi(ids, connection, **kwargs):
+        calls.append(kwargs)
+        return {"ENCSR000AAA": {"audit": {"ERROR": [{"category": "missing control"}],
+                                          "WARNING": [{"category": "low depth"}]}},
+                "ENCSR000AAB": {"audit": {"WARNING": [{"category": "low depth"}]}},
+                "ENCSR000AAC": {"audit": None}}
+
+    monkeypatch.setattr(encodedcc, "get_multi", fake_get_multi)
+    key = encodedcc.ENC_Key(keypairs, "default")
+    connection = encodedcc.ENC_Connection(key)
+    ids = ["ENCSR000AAA", "ENCSR000AAB", "ENCSR000AAC"]
+    assert(encodedcc.get_audits(ids, connection)["ENCSR000AAC"] == {})
+    assert(calls[0] == {"fields": ["audit"], "fallback_frame": "page"})
+    assert(encodedcc.audit_failures(ids, connection) ==
+           {"ENCSR000AAA": {"ERROR": ["missing control"]}})
+    assert(list(encodedcc.audit_failures(ids, connection, levels=["WARNING"])) ==
+           ["ENCSR000AAA", "ENCSR000AAB"])
+
+
+def test_expander(monkeypatch):
+    objs = {
+        "ENCSR000AAA": {"@id": "/experiments/ENCSR000AAA/", "@type": ["Experiment", "Item"],
+                        "files": ["/files/ENCFF000AAA/", "/files/ENCFF000BBB/"],
+                        "lab": "/labs/lab-a/", "replicates": ["/replicates/r1/"]},
+        "/files/ENCFF000AAA/": {"@id": "/files/ENCFF000AAA/", "@type": ["File", "Item"],
+                                "lab": "/labs/lab-a/"},
+        "/files/ENCFF000BBB/": {"@id": "/files/ENCFF000BBB/", "@type": ["File", "Item"],
+                                "lab": "/labs/lab-b/"},
+        "/labs/lab-a/": {"@id": "/labs/lab-a/", "@type": ["Lab", "Item"], "name": "a"},
+        "/labs/lab-b/": {"@id": "/labs/lab-b/", "@type": ["Lab", "Item"], "name": "b"},
+    }
+    for n, obj in enumerate(objs.values()):
+        obj["uuid"] = "00000000-0000-0000-0000-%012d" % n
+    calls = []
+
+    def fake_get_multi(ids, connection, frame="object", fields=None, **kwargs):
+        calls.append(sorted(ids))
+        return {i: objs[i] for i in ids if i in objs}
+
+    monkeypatch.setattr(encodedcc, "get_multi", fake_get_multi)
+    key = encodedcc.ENC_Key(keypairs, "default")
+    connection = encodedcc.ENC_Connection(key)
+    links = encodedcc.profile_links({
+        "Experiment": {"properties": {"files": {"type": "array", "items": {"linkFrom": "File.dataset"}},
+                                      "lab": {"type": "string", "linkTo": "Lab"},
+                                      "replicates": {"type": "array", "items": {"linkTo": "Replicate"}},
+                                      "description": {"type": "string"}}},
+        "File": {"properties": {"lab": {"type": "string", "linkTo": "Lab"}}},
+        "_subtypes": {}})
+    assert(links == {"Experiment": ["files", "lab", "replicates"], "File": ["lab"]})
+    expander = encodedcc.ENC_Expander(connection, links=links)
+    exp = expander.embed("ENCSR000AAA", paths=["files.lab"])
+    assert([f["lab"]["name"] for f in exp["files"]] == ["a", "b"])
+    assert(exp["lab"] == "/labs/lab-a/")
+    assert(calls == [["ENCSR000AAA"], ["/files/ENCFF000AAA/", "/files/ENCFF000BBB/"],
+                     ["/labs/lab-a/", "/labs/lab-b/"]])
+    assert(objs["/files/ENCFF000AAA/"]["lab"] == "/labs/lab-a/")
+    del calls[:]
+    exp = expander.embed(objs["ENCSR000AAA"], depth=1)
+    assert(exp["lab"]["name"] == "a")
+    assert(exp["replicates"] == ["/replicates/r1/"])
+    assert(calls == [["/replicates/r1/"]])
+
+
+def test_profile_map(monkeypatch, tmp_path):
+    import json
+    profiles = {"Experiment": {"id": "/profiles/experiment.json", "title": "Experiment",
+                               "properties": {"schema_version": {"default": "28"},
+                                              "status": {"type": "string", "enum": ["released"],
+                                                         "description": "long text"},
+                                              "lab": {"type": "string", "linkTo": "Lab",
+                                                      "comment": "dropped"},
+                                              "files": {"type": "array",
+                                                        "items": {"linkFrom": "File.dataset",
+                                                                  "description": "x"}}}},
+                "_subtypes": {"Item": ["Experiment"]}}
+
+    class Response(object):
+        def __init__(self, status_code, content=b""):
+            self.status_code = status_code
+            self.content = content
+            self.headers = {"etag": '"v1"'}
+
+    requests_seen = []
+
+    def fake_request(method, url, **kwargs):
+        requests_seen.append(kwargs["headers"].get("if-none-match"))
+        if kwargs["headers"].get("if-none-match") == '"v1"':
+            return Response(304)
+        return Response(200, json.dumps(profiles).encode("utf-8"))
+
+    key = encodedcc.ENC_Key(keypairs, "default")
+    connection = encodedcc.ENC_Connection(key)
+    monkeypatch.setattr(connection, "request", fake_request)
+    monkeypatch.setenv("ENCODEDCC_CACHE_DIR", str(tmp_path))
+    first = encodedcc.ENC_ProfileMap.load(connection)
+    assert(first.profiles["Experiment"]["properties"]["lab"] == {"type": "string", "linkTo": "Lab"})
+    assert(first.profiles["Experiment"]["properties"]["files"] ==
+           {"type": "array", "items": {"linkFrom": "File.dataset"}})
+    assert(first.versions == {"Experiment": "28"})
+    assert(first.links == {"Experiment": ["lab", "files"]})
+    assert(first.schema("experiment.json") is first.schema("/profiles/Experiment"))
+    assert(first.schema("experiments") is None)
+    # every run revalidates, unless told to trust the stored map
+    second = encodedcc.ENC_ProfileMap.load(connection)
+    assert(second.profiles == first.profiles and requests_seen == [None, '"v1"'])
+    third = encodedcc.ENC_ProfileMap.load(connection, max_age=60)
+    assert(third.profiles == first.profiles and len(requests_seen) == 2)
+
+
+def test_model(monkeypatch):
+    profiles = {
+        "File": {"properties": {"accession": {"type": "string"},
+                                "replicate": {"type": "string", "linkTo": "Replicate"},
+                                "class": {"type": "string"}}},
+        "Replicate": {"properties": {"library": {"type": "string", "linkTo": "Library"}}},
+        "Library": {"properties": {"aliases": {"type": "array", "items": {"type": "string"}}}},
+    }
+    objs = {"/replicates/r%d/" % i: {"@id": "/replicates/r%d/" % i, "@type": ["Replicate", "Item"],
+                                     "library": "/libraries/l%d/" % i} for i in range(3)}
+    objs.update({"/libraries/l%d/" % i: {"@id": "/libraries/l%d/" % i, "@type": ["Library", "Item"],
+                                         "aliases": ["lab:l%d" % i]} for i in range(2)})
+    calls = []
+
+    def fake_fetch(ids, connection):
+        calls.append(sorted(ids))
+        return {i: objs[i] for i in ids if i in objs}
+
+    monkeypatch.setattr(encodedcc, "_fetch_objects", fake_fetch)
+    key = encodedcc.ENC_Key(keypairs, "default")
+    connection = encodedcc.ENC_Connection(key)
+    model = encodedcc.ENC_Model(connection, profiles=profiles)
+    files = model.load({"@id": "/files/ENCFF%03dAAA/" % i, "@type": ["File", "Item"],
+                        "accession": "ENCFF%03dAAA" % i, "class": "x",
+                        "replicate": "/replicates/r%d/" % i} for i in range(3))
+    assert(not hasattr(files[0], "__dict__"))
+    assert(files[0].class_ == "x" and files[0].id == "/files/ENCFF000AAA/")
+    assert(files[0].follow("replicate.library.aliases") == ["lab:l0"])
+    assert(calls == [["/replicates/r0/", "/replicates/r1/", "/replicates/r2/"],
+                     ["/libraries/l0/", "/libraries/l1/", "/libraries/l2/"]])
+    assert(files[2].replicate.library is None)
+    assert(files[1].follow("replicate.library.aliases") == ["lab:l1"])
+    assert(len(calls) == 2)
+    assert(files[1]["replicate"] == "/replicates/r1/")
+    assert(files[1].to_dict() == {"@id": "/files/ENCFF001AAA/", "@type": ["File", "Item"],
+                                  "accession": "ENCFF001AAA", "replicate": "/replicates/r1/",
+                                  "class": "x"})
+    assert(model.get("/replicates/r1/") is files[1].replicate)
+    assert(len(calls) == 2)
+
+
+def test_resolver(monkeypatch, tmp_path):
+    obj = {"@id": "/biosamples/ENCBS000AAA/", "uuid": "11111111-2222-3333-4444-555555555555",
+           "accession": "ENCBS000AAA", "aliases": ["lab:sample-1"]}
+    calls = []
+
+    def fake_get_multi(ids, connection, frame="object", fields=None, **kwargs):
+        calls.append(list(ids))
+        return {i: obj for i in ids if i in ("ENCBS000AAA", "lab:sample-1")}
+
+    monkeypatch.setattr(encodedcc, "get_multi", fake_get_multi)
+    key = encodedcc.ENC_Key(keypairs, "default")
+    connection = encodedcc.ENC_Connection(key)
+    canonical = (obj["@id"], obj["uuid"])
+    resolver = encodedcc.ENC_Resolver(connection, index_dir=str(tmp_path))
+    resolved = resolver.resolve(["ENCBS000AAA", "lab:sample-1", "ENCBS999ZZZ"])
+    assert(resolved == {"ENCBS000AAA": canonical, "lab:sample-1": canonical})
+    assert(len(calls) == 1)
+    # a new run sharing the index answers from it, except for the miss
+    resolver = encodedcc.ENC_Resolver(connection, index_dir=str(tmp_path))
+    assert(resolver.resolve_one(obj["uuid"]) == canonical)
+    assert(resolver.resolve_one("/biosamples/ENCBS000AAA/") == canonical)
+    assert(len(calls) == 1)
+    resolver.resolve(["ENCBS999ZZZ"])
+    assert(calls[-1] == ["ENCBS999ZZZ"])
+    # writers look everything up afresh
+    writer = encodedcc.ENC_Resolver(connection, index_dir=str(tmp_path),
+                                    max_age=0)
+    assert(writer.resolve_one("ENCBS000AAA") == canonical)
+    assert(calls[-1] == ["ENCBS000AAA"])
+
+
+def test_mirror(monkeypatch, tmp_path):
+    from urllib.parse import unquote
+    objs = [{"@id": "/files/ENCFF%03dAAA/" % i, "@type": ["File", "Item"],
+             "uuid": "00000000-0000-0000-0000-%012d" % i,
+             "accession": "ENCFF%03dAAA" % i, "aliases": ["lab:file-%d" % i],
+             "status": "released" if i % 2 else "in progress",
+             "date_modified": "2020-01-%02dT00:00:00" % (i + 1)} for i in range(5)]
+    queries = []
+    listed = objs[:]
+
+    def fake_iter_search(query, connection, page_size=1000, **kwargs):
+        if "field=uuid" in query:
+            return iter({"uuid": o["uuid"]} for o in listed)
+        queries.append(query)
+        return iter(objs if len(queries) == 1 else objs[-1:])
+
+    monkeypatch.setattr(encodedcc, "iter_search", fake_iter_search)
+    key = encodedcc.ENC_Key(keypairs, "default")
+    connection = encodedcc.ENC_Connection(key)
+    mirror = encodedcc.ENC_Mirror(str(tmp_path / "mirror.sqlite"))
+    assert(mirror.sync(connection, types=["File"]) == 5)
+    # the next sync fetches what changed and drops what the portal hides
+    listed.remove(objs[0])
+    assert(mirror.sync(connection) == 1)
+    assert(mirror.get("ENCFF000AAA") is None)
+    assert("2020-01-05T00:00:00" in unquote(queries[1]))
+    assert(mirror.types() == ["File"])
+    assert(mirror.get("ENCFF001AAA") == objs[1])
+    assert(mirror.get("/files/ENCFF002AAA/") == objs[2])
+    assert(mirror.get("lab%3Afile-3") == objs[3])
+    assert(mirror.get("ENCFF999ZZZ") is None)
+    assert(len(list(mirror.items("File", status="released"))) == 2)
+    # GETs are answered from it only when asked to, and only if fresh
+    connection.mirror = mirror
+    monkeypatch.setattr(encodedcc, "_get_json",
+                        lambda url, connection: (200, b"{}", {"from": "portal"}))
+    assert(encodedcc.get_ENCODE(objs[4]["uuid"], connection) == {"from": "portal"})
+    mirror.max_age = 60
+    assert(encodedcc.get_ENCODE(objs[4]["uuid"], connection) == objs[4])
+    assert(mirror.get(objs[4]["uuid"], max_age=-1) is None)
+
+
+def test_mirror_query(tmp_path):
+    def item(kind, i, **props):
+        props.update({"@id": "/%ss/%s-%d/" % (kind.lower(), kind, i),
+                      "@type": [kind, "Item"], "uuid": "%s-%d" % (kind, i)})
+        return props
+    biosamples = [item("Biosample", i, organism=["human", "mouse"][i % 2])
+                  for i in range(2)]
+    libraries = [item("Library", i, biosample=biosamples[i]["@id"])
+                 for i in range(2)]
+    replicates = [item("Replicate", i, library=libraries[i]["@id"])
+                  for i in range(2)]
+    experiments = [item("Experiment", i, status=["released", "submitted"][i % 2],
+                        assay_title=["ChIP-seq", "DNase-seq", "RNA-seq"][i % 3],
+                        replicates=[replicates[i % 2]["@id"]],
+                        lab="/labs/some-lab/")
+                   for i in range(6)]
+    mirror = encodedcc.ENC_Mirror(str(tmp_path / "mirror.sqlite"))
+    mirror._store(biosamples + libraries + replicates + experiments, None)
+
+    def total(query):
+        return mirror.query(query)["total"]
+
+    assert(total("search/?type=Experiment") == 6)
+    assert(total("search/?type=Experiment&status=released") == 3)
+    assert(total("/search/?type=Experiment&assay_title=ChIP-seq&assay_title=RNA-seq") == 4)
+    assert(total("search/?type=Experiment&assay_title%21=ChIP-seq") == 4)
+    assert(total("search/?type=Experiment&replicates.library.biosample.organism=mouse") == 3)
+    pages = [mirror.query("search/?type=Experiment&limit=4&from=%d" % start)["@graph"]
+             for start in (0, 4)]
+    assert([len(page) for page in pages] == [4, 2])
+    assert(sorted(o["uuid"] for page in pages for o in page) ==
+           sorted(o["uuid"] for o in experiments))
+    result = mirror.query("search/?type=Experiment&status=released&limit=all"
+                          "&field=replicates.library.biosample.organism",
+                          facets=["assay_title", "replicates.library.biosample.organism"])
+    assert(result["total"] == 3)
+    assert(result["@graph"][0]["replicates"][0]["library"]["biosample"]["organism"] == "human")
+    facets = dict((f["field"], f["terms"]) for f in result["facets"])
+    assert(facets["replicates.library.biosample.organism"] == [{"key": "human", "doc_count": 3}])
+    for query in ["search/?type=Experiment&searchTerm=CTCF",
+                  "search/?type=Experiment&audit.ERROR.category=missing+donor",
+                  "search/?type=File",
+                  "search/?type=Experiment&lab.title=Some+Lab",
+                  "search/?type=Experiment&field=audit",
+                  "search/?type=Experiment&field=lab.title"]:
+        with pytest.raises(ValueError):
+            mirror.query(query)
+
+
+def release_fixture(monkeypatch, **options):
+    '''a Data_Release over a small stub portal, with the @ids asked for
+    by each get_multi call'''
+    import argparse
+    import ENCODE_release
+    status = {"status": {"enum": ["released", "in progress"]}}
+    profiles = {
+        "Experiment": {"properties": dict(status, original_files={"items": {"linkFrom": "File.dataset"}},
+                                          replicates={"items": {"linkFrom": "Replicate.experiment"}},
+                                          biosample_term_id={"type": "string"})},
+        "Replicate": {"properties": dict(status, library={"linkTo": "Library"})},
+        "Library": {"properties": dict(status, biosample={"linkTo": "Biosample"})},
+        "Biosample": {"properties": dict(status, date_released={"type": "string"},
+                                         part_of={"linkTo": "Biosample"})},
+        "File": {"properties": dict(status, replicate={"linkTo": "Replicate"},
+                                    dataset={"linkTo": "Experiment"})},
+    }
+    objs = {}
+
+    def add(at_id, item_type, **kwargs):
+        objs[at_id] = dict({"@id": at_id, "@type": [item_type, "Item"],
+                            "uuid": at_id, "status": "in progress"}, **kwargs)
+
+    add("/experiments/E1/", "Experiment", biosample_term_id="EFO:0002791",
+        original_files=["/files/F1/", "/files/F2/"], replicates=["/replicates/R1/"])
+    add("/experiments/E2/", "Experiment", biosample_term_id="EFO:0000001",
+        original_files=["/files/F3/"], replicates=["/replicates/R1/"])
+    add("/files/F1/", "File", dataset="/experiments/E1/", replicate="/replicates/R1/")
+    add("/files/F2/", "File", dataset="/experiments/E1/", status="released")
+    add("/files/F3/", "File", dataset="/experiments/E2/", replicate="/replicates/R9/")
+    add("/replicates/R1/", "Replicate", library="/libraries/L1/")
+    add("/libraries/L1/", "Library", biosample="/biosamples/B1/")
+    add("/biosamples/B1/", "Biosample")
+    calls = []
+
+    def fake_get_multi(ids, connection, **kwargs):
+        ids = list(ids)
+        calls.append(sorted(ids))
+        return {i: objs[i] for i in ids if i in objs}
+
+    monkeypatch.setattr(encodedcc, "get_multi", fake_get_multi)
+    monkeypatch.setattr(encodedcc, "get_ENCODE", lambda i, c, frame="object": objs[i])
+    key = encodedcc.ENC_Key(keypairs, "default")
+    connection = encodedcc.ENC_Connection(key)
+    monkeypatch.setitem(encodedcc._profile_maps, connection.server,
+                        encodedcc.ENC_ProfileMap.compile(profiles))
+    args = dict(infile=None, outfile="report.txt", query=None, logall=False,
+                force=True, printall=False, update=False, timing=False,
+                hela=False, plan=None, apply=None, batch_size=2)
+    args.update(options)
+    release = ENCODE_release.Data_Release(argparse.Namespace(**args), connection)
+    return release, objs, calls
+
+
+def test_release_walk(monkeypatch):
+    release, objs, calls = release_fixture(monkeypatch)
+    release.get_status(objs["/experiments/E2/"], ["File", "Replicate", "Library", "Biosample"])
+    # one batched fetch per level, the missing replicate reported, not walked
+    assert(calls == [["/files/F3/", "/replicates/R1/"],
+                     ["/libraries/L1/", "/replicates/R9/"],
+                     ["/biosamples/B1/"]])
+    assert(sorted(release.statusDict) == ["/biosamples/B1/", "/experiments/E2/", "/files/F3/",
+                                          "/libraries/L1/", "/replicates/R1/"])
+    assert("/replicates/R9/" in release.searched)
+
+
+def test_release_plan(monkeypatch, tmp_path):
+    for name in ("plan.tsv", "plan.json"):
+        path = str(tmp_path / name)
+        release, objs, calls = release_fixture(
+            monkeypatch, infile="/experiments/E1/,/experiments/E2/", hela=True, plan=path)
+        release.run_script()
+        plan = release.read_plan(path)
+        ids = [row["@id"] for row in plan]
+        # the replicate, library and biosample shared by both appear once
+        assert(sorted(ids) == ["/biosamples/B1/", "/experiments/E1/", "/experiments/E2/",
+                               "/files/F1/", "/files/F3/", "/libraries/L1/",
+                               "/replicates/R1/"])
+        assert({row["@id"]: row["target_status"] for row in plan}["/biosamples/B1/"] == "released")
+    patched = []
+    failing = ["/libraries/L1/"]
+
+    def fake_patch(obj_id, connection, patch):
+        patched.append(obj_id)
+        if obj_id in failing:
+            failing.remove(obj_id)
+            return {"status": "error"}
+        return {"status": "success"}
+
+    monkeypatch.setattr(encodedcc, "patch_ENCODE", fake_patch)
+    release, objs, calls = release_fixture(monkeypatch, apply=path, update=True)
+    with pytest.raises(SystemExit):
+        release.run_script()
+    assert(sorted(patched) == sorted(ids))
+    # a second run PATCHes only what failed
+    del patched[:]
+    release.run_script()
+    assert(patched == ["/libraries/L1/"])
+    # progress of another plan at the same path is not resumed
+    done = open(path + ".done").read()
+    release, objs, calls = release_fixture(
+        monkeypatch, infile="/experiments/E2/", hela=True, plan=path)
+    release.run_script()
+    assert(not os.path.exists(path + ".done"))
+    with open(path + ".done", "w") as f:
+        f.write(done)
+    del patched[:]
+    release, objs, calls = release_fixture(monkeypatch, apply=path, update=True)
+    release.run_script()
+    assert(sorted(patched) == ["/biosamples/B1/", "/experiments/E2/", "/files/F3/",
+                               "/libraries/L1/", "/replicates/R1/"])
+
+
+def test_release_term_ids(monkeypatch):
+    release, objs, calls = release_fixture(monkeypatch)
+    files = [objs["/files/F1/"], objs["/files/F2/"], objs["/files/F3/"]]
+    release.resolve_term_ids(files)
+    assert(calls == [["/experiments/E1/", "/experiments/E2/"]])
+    assert(release.associated_with_hela_data("File", objs["/files/F1/"]))
+    assert(not release.associated_with_hela_data("File", objs["/files/F3/"]))
+    assert(release.associated_with_hela_data("Experiment", objs["/experiments/E1/"]))
+    assert(len(calls) == 1)